@@ -38,6 +38,29 @@ class BotInfoSchemaValidationTest(TestCase):
 
         self.assertEqual(context.exception.messages, {"JOB_UID": ["Invalid JOB_UID"]})
 
+    def test_max_jobs_must_be_positive(self):
+        """A MAX_JOBS hint below one is rejected."""
+        with self.assertRaises(ValidationError) as context:
+            BotInfoSchema().load({"MAX_JOBS": 0}, partial=True)
+
+        self.assertIn("MAX_JOBS", context.exception.messages)
+
+    def test_batched_job_results_validate_each_job_uid(self):
+        """Every JOBS entry needs a well-formed JOB_UID."""
+        job_uid = "75a04e87-a740-4c75-9096-add9ec13baf5"
+        loaded = BotInfoSchema().load(
+            {"JOBS": [{"JOB_UID": job_uid, "RESULT": "[]"}]}, partial=True
+        )
+        self.assertEqual(loaded["JOBS"], [{"JOB_UID": job_uid, "RESULT": "[]"}])
+
+        with self.assertRaises(ValidationError) as context:
+            BotInfoSchema().load({"JOBS": [{"JOB_UID": "bad"}]}, partial=True)
+
+        self.assertEqual(
+            context.exception.messages,
+            {"JOBS": {0: {"JOB_UID": ["Invalid JOB_UID"]}}},
+        )
+
 
 class NsesApiValidationTest(TestCase):
     """Tests for NSE API input normalization helpers."""
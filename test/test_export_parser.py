@@ -0,0 +1,115 @@
+"""
+Tests for the export result parsing, in the exporting process and in the
+forkserver parser workers.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+# pylint: disable=missing-function-docstring
+
+from app.utils.export_manifest import MANIFEST_STATUS_FAILED, MANIFEST_STATUS_PARSED
+from app.utils.export_parser import iter_parsed_export_jobs
+from app.utils.result_parser import normalize_db_conf
+from app.utils.result_storage import RESULT_FORMAT_NDJSON_GZ, write_result
+
+JOB_UIDS = (
+    "6f1c2b0a-3f4e-4d5a-8b6c-7d8e9f0a1b2c",
+    "0a9b8c7d-6e5f-4a3b-9c2d-1e0f9a8b7c6d",
+)
+MISSING_JOB_UID = "11111111-2222-4333-8444-555555555555"
+HOSTS = [
+    {
+        "addr": "192.0.2.10",
+        "endtime": "1700000100",
+        "hostnames": [{"name": "www.example.com", "type": "PTR"}],
+        "ports": [
+            {
+                "portid": "80",
+                "scripts": [
+                    {
+                        "id": "http-headers",
+                        "output": "HTTP/1.1 200 OK\nServer: nginx\nX-Id: abc",
+                    },
+                    {"id": "http-title", "output": "Welcome"},
+                ],
+            },
+            {
+                "portid": "25",
+                "scripts": [{"id": "banner", "output": "220 mail.example.org"}],
+            },
+        ],
+    }
+]
+
+
+class IterParsedExportJobsTest(unittest.TestCase):
+    """
+    Validate parser workers return the same documents as the serial parse.
+    """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = self._tmp_dir.name
+        for job_uid in JOB_UIDS:
+            os.makedirs(os.path.join(self.input_dir, job_uid[0]))
+        write_result(self.input_dir, JOB_UIDS[0], json.dumps(HOSTS))
+        write_result(
+            self.input_dir,
+            JOB_UIDS[1],
+            json.dumps(HOSTS),
+            storage_format=RESULT_FORMAT_NDJSON_GZ,
+        )
+        self.jobs = [
+            {"id": 1, "uid": JOB_UIDS[0]},
+            {"id": 2, "uid": JOB_UIDS[1], "flushed_ids": ()},
+            {"id": 3, "uid": MISSING_JOB_UID},
+        ]
+        # The app config holds unpicklable objects, KVROCKS_IDX among them.
+        self.parser_config = normalize_db_conf(
+            {
+                "ONLINETLD": False,
+                "TLDS": ["com"],
+                "TLDADD": ["org"],
+                "HTTP_HEADER_COLLECTION": {"x-id": True},
+                "KVROCKS_IDX": threading.RLock(),
+            }
+        )
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _parse(self, workers):
+        return [
+            (job, documents, manifest)
+            for job, documents, manifest, _ in iter_parsed_export_jobs(
+                self.jobs, self.input_dir, self.parser_config, None, workers
+            )
+        ]
+
+    def test_parser_config_only_keeps_parser_keys(self):
+        self.assertEqual(
+            sorted(self.parser_config),
+            ["HTTP_HEADER_COLLECTION", "ONLINETLD", "TLDADD", "TLDS"],
+        )
+
+    def test_workers_match_serial_parse(self):
+        serial = self._parse(1)
+        self.assertEqual(self._parse(2), serial)
+
+        self.assertEqual([job["id"] for job, _, _ in serial], [1, 2, 3])
+        for _, documents, manifest in serial[:2]:
+            self.assertEqual(manifest["status"], MANIFEST_STATUS_PARSED)
+            self.assertEqual(len(documents), 2)
+            self.assertEqual(
+                [parsed["port"] for _, parsed in documents], [["80"], ["25"]]
+            )
+        self.assertEqual(serial[2][2]["status"], MANIFEST_STATUS_FAILED)
+        self.assertEqual(serial[2][1], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
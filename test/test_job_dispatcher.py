@@ -0,0 +1,163 @@
+"""
+Tests for the getjob job dispatcher on a fake Kvrocks.
+"""
+
+import unittest
+from unittest import mock
+
+# pylint: disable=missing-function-docstring,protected-access
+
+import redis
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover - optional test dependency
+    fakeredis = None
+
+from app import apis
+from app.utils.job_dispatcher import JobDispatcher
+
+NOW = "2026-01-01 00:00:00"
+BOT_ID = 1
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class JobDispatcherTest(unittest.TestCase):
+    """
+    Validate the per-priority FIFO queues.
+    """
+
+    def setUp(self):
+        self.dispatcher = JobDispatcher(fakeredis.FakeRedis(decode_responses=True))
+
+    def test_refill_keeps_fifo_order_per_priority(self):
+        depths = self.dispatcher.refill(
+            [(11, 4), (12, 0), (13, 4), (14, "x"), (15, 9), (16, "0")]
+        )
+        self.assertEqual(depths, {0: 2, 1: 0, 2: 0, 3: 0, 4: 2})
+        self.assertEqual(self.dispatcher.depths(), depths)
+        self.assertEqual(
+            [self.dispatcher.pop(4) for _ in range(3)],
+            [11, 13, None],
+        )
+        self.assertEqual(self.dispatcher.pop(0), 12)
+        self.assertEqual(self.dispatcher.popped_total, 3)
+
+    def test_refill_replaces_the_queues(self):
+        self.dispatcher.push(2, 21, 22)
+        self.dispatcher.refill([(23, 2)])
+        self.assertEqual(self.dispatcher.pop(2), 23)
+        self.assertIsNone(self.dispatcher.pop(2))
+
+    def test_requeue_puts_back_at_the_head(self):
+        self.dispatcher.push(1, 31, 32)
+        job_id = self.dispatcher.pop(1)
+        self.dispatcher.requeue(1, job_id)
+        self.assertEqual(self.dispatcher.pop(1), 31)
+
+    def test_stats_without_kvrocks(self):
+        self.dispatcher.record_stale()
+        with mock.patch.object(
+            self.dispatcher.r, "pipeline", side_effect=redis.ConnectionError("down")
+        ):
+            stats = self.dispatcher.stats()
+        self.assertIsNone(stats["depth"])
+        self.assertEqual(stats["stale"], 1)
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class ClaimDispatchedJobTest(unittest.TestCase):
+    """
+    Validate getjob claims from the dispatcher and its database fallback.
+    """
+
+    def setUp(self):
+        self.dispatcher = JobDispatcher(fakeredis.FakeRedis(decode_responses=True))
+        self.waiting = set()
+        self._patch(apis, "_claim_job_for_bot", self._claim_job_for_bot)
+        self._patch(apis, "db")
+        apis.db.session.get.side_effect = lambda _model, job_id: f"job-{job_id}"
+
+    def _patch(self, *args, **kwargs):
+        patcher = mock.patch.object(*args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def _claim_job_for_bot(self, job_id, _bot_id, _now):
+        if job_id not in self.waiting:
+            return 0
+        self.waiting.discard(job_id)
+        return 1
+
+    def test_stale_ids_are_skipped(self):
+        self.dispatcher.push(4, 1, 2, 3)
+        self.waiting = {3}
+        prio_list = [4]
+        self.assertEqual(
+            apis._claim_dispatched_job(self.dispatcher, prio_list, BOT_ID, NOW),
+            ("job-3", 4),
+        )
+        self.assertEqual(self.dispatcher.stale_total, 2)
+        self.assertEqual(prio_list, [4])
+
+    def test_empty_queues_are_dropped_from_the_order(self):
+        self.dispatcher.push(1, 5)
+        self.waiting = {5}
+        prio_list = [4, 1]
+        self.assertEqual(
+            apis._claim_dispatched_job(self.dispatcher, prio_list, BOT_ID, NOW),
+            ("job-5", 1),
+        )
+        self.assertEqual(prio_list, [1])
+        self.assertEqual(
+            apis._claim_dispatched_job(self.dispatcher, prio_list, BOT_ID, NOW),
+            (None, None),
+        )
+        self.assertEqual(prio_list, [])
+
+    def test_pops_are_bounded_per_claim(self):
+        stale_ids = range(100, 100 + apis.MAX_DISPATCH_POPS + 8)
+        self.dispatcher.push(3, *stale_ids)
+        self.dispatcher.push(2, 7)
+        self.waiting = {7}
+        prio_list = [3, 2]
+        self.assertEqual(
+            apis._claim_dispatched_job(self.dispatcher, prio_list, BOT_ID, NOW),
+            (None, None),
+        )
+        self.assertEqual(self.dispatcher.popped_total, apis.MAX_DISPATCH_POPS)
+        self.assertEqual(self.dispatcher.depths()[3], 8)
+        self.assertEqual(prio_list, [3, 2])
+
+    def test_batch_claims_from_the_dispatcher(self):
+        self.dispatcher.push(4, 1, 2)
+        self.dispatcher.push(0, 3)
+        self.waiting = {1, 2, 3}
+        self._patch(apis, "get_job_dispatcher", return_value=self.dispatcher)
+        self._patch(apis, "_select_weighted_priority", return_value=[4, 0])
+        self.assertEqual(
+            apis._claim_jobs_for_bot(BOT_ID, NOW, 5),
+            [("job-1", 4), ("job-2", 4), ("job-3", 0)],
+        )
+
+    def test_redis_error_falls_back_to_the_database(self):
+        self.dispatcher.push(4, 1, 2)
+        self.waiting = {1, 2}
+        self._patch(apis, "get_job_dispatcher", return_value=self.dispatcher)
+        self._patch(apis, "_select_weighted_priority", return_value=[4])
+        self._patch(apis, "_get_available_job_priorities", return_value={4})
+        # Kvrocks goes away after the first claimed job.
+        self._patch(
+            self.dispatcher, "pop", side_effect=[1, redis.ConnectionError("down")]
+        )
+        claim_from_db = self._patch(
+            apis, "_claim_queued_job_from_db", side_effect=["db-job", None]
+        )
+        with self.assertLogs("flask_appbuilder", "WARNING"):
+            claimed = apis._claim_jobs_for_bot(BOT_ID, NOW, 5)
+        self.assertEqual(claimed, [("job-1", 4), ("db-job", None)])
+        self.assertEqual(claim_from_db.call_args.args, ([4], BOT_ID, NOW))
+
+
+if __name__ == "__main__":
+    unittest.main()
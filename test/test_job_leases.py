@@ -0,0 +1,47 @@
+"""
+Tests for the agent lease sizing of jobs.
+"""
+
+import unittest
+
+# pylint: disable=missing-function-docstring
+
+from app.utils.job_leases import (
+    DEFAULT_NMAP_PORT_COUNT,
+    compute_lease_seconds,
+    count_scan_ports,
+)
+
+CONFIG = {
+    "JOB_LEASE_SECONDS": 600,
+    "JOB_LEASE_SECONDS_PER_PROBE": 0.5,
+    "JOB_LEASE_MAX_SECONDS": 7200,
+}
+
+
+class JobLeaseTest(unittest.TestCase):
+    """
+    Validate lease durations derived from job addresses and ports.
+    """
+
+    def test_port_list_is_counted(self):
+        self.assertEqual(count_scan_ports("22,80,443"), 3)
+        self.assertEqual(count_scan_ports(" 22, ,80 "), 2)
+        self.assertEqual(count_scan_ports(""), DEFAULT_NMAP_PORT_COUNT)
+        self.assertEqual(count_scan_ports(None), DEFAULT_NMAP_PORT_COUNT)
+
+    def test_lease_grows_with_addresses_and_ports(self):
+        self.assertEqual(compute_lease_seconds(1, "22", CONFIG), 600)
+        self.assertEqual(compute_lease_seconds(256, "22,80", CONFIG), 856)
+
+    def test_lease_is_capped(self):
+        self.assertEqual(compute_lease_seconds(65536, "22,80", CONFIG), 7200)
+        small_cap = dict(CONFIG, JOB_LEASE_MAX_SECONDS=60)
+        self.assertEqual(compute_lease_seconds(256, "22", small_cap), 600)
+
+    def test_defaults_apply_without_config(self):
+        self.assertEqual(compute_lease_seconds(0, "22", {}), 3600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+Tests for the Kvrocks search planner on a fake Kvrocks.
+"""
+
+import unittest
+
+# pylint: disable=missing-function-docstring
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover - optional test dependency
+    fakeredis = None
+
+from app.utils.kvrocks import KVrocksIndexer
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class NegatedHeadvalTest(unittest.TestCase):
+    """
+    Validate http_headval.not terms in scoped and unscoped searches.
+    """
+
+    def setUp(self):
+        self.indexer = KVrocksIndexer.__new__(KVrocksIndexer)
+        self.indexer.r = fakeredis.FakeRedis(decode_responses=True)
+        self.indexer.r.sadd("all_uids", "uid-a", "uid-b", "uid-c")
+        self.indexer.r.sadd("port:80", "uid-a", "uid-b", "uid-c")
+        self.indexer.r.sadd("http_headval:server:nginx", "uid-a")
+
+    def test_unscoped_negated_headval_is_subtracted(self):
+        self.assertEqual(
+            sorted(
+                self.indexer.get_uids_by_criteria(
+                    {"port": "80", "http_headval.not": "Server: NGINX"}
+                )
+            ),
+            ["uid-b", "uid-c"],
+        )
+        self.assertEqual(
+            sorted(
+                self.indexer.get_uids_by_criteria({"http_headval.nt": "server:nginx"})
+            ),
+            ["uid-b", "uid-c"],
+        )
+
+    def test_scoped_negated_headval_is_subtracted(self):
+        self.assertEqual(
+            self.indexer.get_uids_by_criteria_scoped(
+                {"http_headval.not": "Server: NGINX"}, ["uid-a", "uid-b"]
+            ),
+            ["uid-b"],
+        )
+        self.assertEqual(
+            sorted(
+                self.indexer.get_uids_by_criteria_scoped(
+                    {"http_headval.not": "server:apache"}, ["uid-a", "uid-b"]
+                )
+            ),
+            ["uid-a", "uid-b"],
+        )
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class ValueIndexReadinessTest(unittest.TestCase):
+    """
+    Validate .begin searches only trust vals:{field} once flagged ready.
+    """
+
+    def setUp(self):
+        self.indexer = KVrocksIndexer.__new__(KVrocksIndexer)
+        self.indexer.r = fakeredis.FakeRedis(decode_responses=True)
+
+    def _seed_older_index(self):
+        self.indexer.r.sadd("all_uids", "uid-a", "uid-b")
+        self.indexer.r.sadd("http_title:welcome", "uid-a")
+        self.indexer.r.sadd("http_title:welcome home", "uid-b")
+        # Only the document indexed after the deploy is in the dictionary.
+        self.indexer.r.zadd("vals:http_title", {"welcome home": 0})
+
+    def test_partial_dictionary_is_not_used(self):
+        self._seed_older_index()
+        self.assertEqual(
+            sorted(self.indexer.get_uids_by_criteria({"http_title.begin": "wel"})),
+            ["uid-a", "uid-b"],
+        )
+        self.indexer.r.hset("vals:fields", "http_title", "building")
+        self.assertEqual(
+            sorted(self.indexer.get_uids_by_criteria({"http_title.begin": "wel"})),
+            ["uid-a", "uid-b"],
+        )
+
+    def test_ready_dictionary_is_used(self):
+        self._seed_older_index()
+        self.indexer.r.hset("vals:fields", "http_title", "ready")
+        self.assertEqual(
+            self.indexer.get_uids_by_criteria({"http_title.begin": "wel"}), ["uid-b"]
+        )
+
+    def test_empty_index_is_flagged_ready(self):
+        self.indexer.r.hset("vals:fields", "banner", "building")
+        self.indexer.mark_empty_value_indexes_ready()
+        states = self.indexer.r.hgetall("vals:fields")
+        self.assertEqual(states["http_title"], "ready")
+        self.assertEqual(states["banner"], "building")
+
+    def test_older_index_is_not_flagged_ready(self):
+        self._seed_older_index()
+        self.indexer.mark_empty_value_indexes_ready()
+        self.assertEqual(self.indexer.r.hgetall("vals:fields"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
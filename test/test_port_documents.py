@@ -0,0 +1,79 @@
+"""
+Tests for the per-port split of scanner host results.
+"""
+
+import copy
+import unittest
+
+# pylint: disable=missing-function-docstring
+
+from app.utils.port_documents import split_scan_result_by_port
+
+HOST = {
+    "addr": "192.0.2.10",
+    "endtime": "1700000100",
+    "ports": [
+        {
+            "portid": "21",
+            "hsh256": "stale",
+            "scripts": [{"id": "banner", "output": "220 FTP\nready"}],
+        },
+        {
+            "portid": "80",
+            "scripts": [
+                {
+                    "id": "http-favicon",
+                    "output": "Unknown favicon MD5: ABCDEF0123456789ABCDEF0123456789",
+                }
+            ],
+        },
+        {"portid": "", "scripts": []},
+        "not a port",
+    ],
+}
+
+
+class SplitScanResultByPortTest(unittest.TestCase):
+    """
+    Validate per-port documents built without copying the host.
+    """
+
+    def test_one_document_per_valid_port(self):
+        documents = split_scan_result_by_port(HOST)
+        self.assertEqual(
+            [document["body"]["ports"][0]["portid"] for document in documents],
+            ["21", "80"],
+        )
+        for document in documents:
+            self.assertEqual(document["ip"], "192.0.2.10")
+            self.assertEqual(document["body"]["endtime"], "1700000100")
+            self.assertEqual(len(document["body"]["hsh256"]), 64)
+            self.assertNotIn("hsh256", document["body"]["ports"][0])
+
+    def test_scripts_are_normalized_without_touching_the_host(self):
+        host = copy.deepcopy(HOST)
+        banner_doc, favicon_doc = split_scan_result_by_port(host)
+        self.assertEqual(host, HOST)
+        self.assertEqual(
+            banner_doc["body"]["ports"][0]["scripts"][0]["output"], "220 FTPready"
+        )
+        favicon_script = favicon_doc["body"]["ports"][0]["scripts"][0]
+        self.assertEqual(favicon_script["id"], "http-mm-sha-favicon")
+        self.assertEqual(
+            favicon_script["favicon_md5"], "abcdef0123456789abcdef0123456789"
+        )
+
+    def test_document_ids_are_stable(self):
+        first = [doc["id"] for doc in split_scan_result_by_port(HOST)]
+        second = [doc["id"] for doc in split_scan_result_by_port(copy.deepcopy(HOST))]
+        self.assertEqual(first, second)
+        self.assertEqual(len(set(first)), 2)
+
+    def test_invalid_hosts_give_no_document(self):
+        self.assertEqual(split_scan_result_by_port(None), [])
+        self.assertEqual(split_scan_result_by_port({"ports": []}), [])
+        self.assertEqual(split_scan_result_by_port({"addr": "192.0.2.1"}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,334 @@
+"""
+Tests for the compiled parsing plan of result_parser.parse_json.
+"""
+
+import copy
+import unittest
+
+# pylint: disable=missing-function-docstring
+
+from app.utils.result_parser import (
+    HttpHeaderOutput,
+    ParsePlan,
+    get_body,
+    hostname_cache_stats,
+    parse_json,
+    tld_set,
+)
+
+HEADERS_OUTPUT = (
+    "\n  Server: nginx/1.24\n"
+    "  Set-Cookie: sessionid=abc; Path=/\n"
+    '  ETag: "5f1"\n'
+    "  Location: https://www.example.com/login\n"
+    "|_ X-Powered-By: PHP/8.2\n"
+)
+
+DOCUMENT = {
+    "id": "doc-1",
+    "ip": "192.0.2.10",
+    "body": {
+        "endtime": "1700000100",
+        "hostnames": [{"name": "Portal.Example.org", "type": "user"}],
+        "ports": [
+            {
+                "portid": "443",
+                "scripts": [
+                    {"id": "http-headers", "output": HEADERS_OUTPUT},
+                    {"id": "http-title", "output": "Login"},
+                    {
+                        "id": "ssl-cert",
+                        "issuer": {"commonName": "ca.example.net"},
+                        "subject": {"commonName": "www.example.com"},
+                        "extensions": {
+                            "X509v3 Subject Alternative Name": "DNS:api.example.com"
+                        },
+                        "sha256": "ab12",
+                    },
+                ],
+            },
+            {
+                "portid": "80",
+                "scripts": [{"id": "http-headers", "output": "Server: Apache"}],
+            },
+        ],
+    },
+}
+
+CONFIG = {
+    "ONLINETLD": False,
+    "TLDS": [],
+    "TLDADD": [],
+    "HTTP_HEADER_COLLECTION": {"X-Powered-By": True, "server": False},
+}
+
+
+REGRESSION_HEADERS_OUTPUT = (
+    "\n  Server: nginx/1.24\n"
+    "  Set-Cookie: sessionid=abc; Path=/\n"
+    "  Set-Cookie: csrftoken=xyz; Secure\n"
+    '  ETag: "5f1"\n'
+    "  Location: https://login.example.com/sso\n"
+    "|_ X-Powered-By: PHP/8.2\n"
+)
+
+REGRESSION_DOCUMENT = {
+    "id": "doc-r",
+    "ip": "192.0.2.20",
+    "body": {
+        "endtime": "1700000200",
+        "hostnames": [
+            {"name": "Www.Example.co.uk", "type": "user"},
+            {"name": "host.example.net", "type": "PTR"},
+        ],
+        "ports": [
+            {
+                "portid": "443",
+                "scripts": [
+                    {"id": "http-headers", "output": REGRESSION_HEADERS_OUTPUT},
+                    {"id": "http-title", "output": "Example Login"},
+                    {
+                        "id": "ssl-cert",
+                        "issuer": {
+                            "commonName": "R3",
+                            "organizationName": "Let's Encrypt",
+                        },
+                        "subject": {"commonName": "www.example.co.uk"},
+                        "extensions": {
+                            "X509v3 Subject Alternative Name": (
+                                "DNS:www.example.co.uk, DNS:api.example.com, "
+                                "DNS:mail.internal.lan"
+                            )
+                        },
+                        "sha256": "aa11",
+                        "md5": "bb22",
+                        "sha1": "cc33",
+                    },
+                ],
+            },
+            {
+                "portid": "80",
+                "scripts": [
+                    {
+                        "id": "http-headers",
+                        "output": (
+                            "\n  Server: Apache/2.4\n"
+                            "  Location: http://www.example.org/\n"
+                        ),
+                    }
+                ],
+            },
+            {
+                "portid": "25",
+                "scripts": [
+                    {"id": "banner", "output": "220 mx1.example.org ESMTP Postfix"}
+                ],
+            },
+        ],
+    },
+}
+
+# Fields shared by both configs, as given by parse_json before the parsing
+# plan was compiled.
+REGRESSION_COMMON_FIELDS = {
+    "banner": ["220 mx1.example.org ESMTP Postfix"],
+    "domain_requested": ["example.co.uk"],
+    "fqdn_requested": ["www.example.co.uk"],
+    "http_cookiename": ["sessionid", "csrftoken"],
+    "http_etag": ['"5f1"'],
+    "http_server": ["nginx/1.24", "Apache/2.4"],
+    "http_title": ["Example Login"],
+    "ip": "192.0.2.20",
+    "last_seen": "1700000200",
+    "port": ["443", "80", "25"],
+    "uid": "doc-r",
+    "x509_issuer": ["R3"],
+    "x509_md5": ["bb22"],
+    "x509_san": ["DNS:www.example.co.uk, DNS:api.example.com, DNS:mail.internal.lan"],
+    "x509_sha1": ["cc33"],
+    "x509_sha256": ["aa11"],
+    "x509_subject": ["www.example.co.uk"],
+}
+
+
+class ParsePlanTest(unittest.TestCase):
+    """
+    Validate the fields produced by the compiled default parsing plan.
+    """
+
+    def test_header_actions_share_one_parse(self):
+        parsed = parse_json(DOCUMENT, CONFIG)
+        self.assertEqual(parsed["http_server"], ["nginx/1.24", "Apache"])
+        self.assertEqual(parsed["http_cookiename"], ["sessionid"])
+        self.assertEqual(parsed["http_etag"], ['"5f1"'])
+        self.assertEqual(parsed["http_header"], ["server", "x-powered-by"])
+        self.assertEqual(parsed["http_headval"], ["x-powered-by:php/8.2"])
+        self.assertEqual(parsed["port"], ["443", "80"])
+
+    def test_values_keep_the_rule_order(self):
+        parsed = parse_json(DOCUMENT, CONFIG)
+        # hostnames, then http-headers, then ssl-cert issuer and SAN.
+        self.assertEqual(
+            parsed["fqdn"],
+            [
+                "portal.example.org",
+                "www.example.com",
+                "ca.example.net",
+                "api.example.com",
+            ],
+        )
+        self.assertEqual(parsed["fqdn_requested"], ["portal.example.org"])
+        self.assertEqual(parsed["x509_sha256"], ["ab12"])
+
+    def test_header_fields_only_when_collected(self):
+        headers = HttpHeaderOutput(HEADERS_OUTPUT, collect_fields=False)
+        self.assertEqual(headers.server, ["nginx/1.24"])
+        self.assertEqual(headers.fields, [])
+        parsed = parse_json(DOCUMENT, dict(CONFIG, HTTP_HEADER_COLLECTION={}))
+        self.assertNotIn("http_header", parsed)
+
+    def test_paths_match_normalized_keys(self):
+        script = DOCUMENT["body"]["ports"][0]["scripts"][2]
+        self.assertEqual(
+            get_body(script, "ssl-cert.extensions.X509v3_Subject_Alternative_Name"),
+            "DNS:api.example.com",
+        )
+        self.assertIsNone(get_body(script, "ssl-cert.issuer.organizationName"))
+
+    def test_invalid_rules_are_rejected(self):
+        with self.assertRaises(TypeError):
+            ParsePlan(["get_hosts"])
+        with self.assertRaises(TypeError):
+            ParsePlan(["delete_all:p.banner.output"])
+
+
+class HostnameCacheTest(unittest.TestCase):
+    """
+    Validate the cached hostname decomposition and set-based TLD checks.
+    """
+
+    def test_repeated_hostnames_hit_the_cache(self):
+        document = {
+            "id": "doc-2",
+            "ip": "192.0.2.11",
+            "body": {
+                "endtime": "1700000100",
+                "ports": [
+                    {
+                        "portid": "25",
+                        "scripts": [
+                            {"id": "banner", "output": "220 mx.cache-test.example.org"}
+                        ],
+                    }
+                ],
+            },
+        }
+        parse_json(document, CONFIG)
+        before = hostname_cache_stats()
+        parsed = parse_json(document, CONFIG)
+        after = hostname_cache_stats()
+        self.assertEqual(parsed["fqdn"], ["mx.cache-test.example.org"])
+        self.assertGreater(after["hits"], before["hits"])
+        self.assertEqual(after["misses"], before["misses"])
+
+    def test_cached_parts_follow_the_config(self):
+        document = {
+            "id": "doc-3",
+            "ip": "192.0.2.12",
+            "body": {
+                "endtime": "1700000100",
+                "hostnames": [{"name": "www.example.com", "type": "user"}],
+                "ports": [],
+            },
+        }
+        online = dict(CONFIG, ONLINETLD=True, TLDS=["net"])
+        self.assertNotIn("domain_requested", parse_json(document, online))
+        online["TLDS"] = ["com"]
+        self.assertEqual(
+            parse_json(document, online)["domain_requested"], ["example.com"]
+        )
+
+    def test_tld_set(self):
+        self.assertEqual(tld_set(["com", "net"]), frozenset({"com", "net"}))
+        self.assertEqual(tld_set("local"), frozenset({"local"}))
+        self.assertEqual(tld_set(None), frozenset())
+
+
+class ParseJsonRegressionTest(unittest.TestCase):
+    """
+    Pin the parse_json output of a multi-port document, so the compiled
+    plan keeps the header, cookie, certificate, banner and TLD results and
+    the value order of the former rule-by-rule parser.
+    """
+
+    def test_offline_tlds(self):
+        config = {
+            "ONLINETLD": False,
+            "TLDS": [],
+            "TLDADD": [],
+            "HTTP_HEADER_COLLECTION": {},
+        }
+        expected = dict(
+            REGRESSION_COMMON_FIELDS,
+            domain=["example.co.uk", "example.net", "example.com", "example.org"],
+            fqdn=[
+                "www.example.co.uk",
+                "host.example.net",
+                "login.example.com",
+                "www.example.org",
+                "api.example.com",
+                "mx1.example.org",
+            ],
+            host=["www", "host", "login", "api", "mx1"],
+            tld=["co.uk", "net", "com", "org"],
+        )
+        self.assertEqual(
+            parse_json(copy.deepcopy(REGRESSION_DOCUMENT), config), expected
+        )
+
+    def test_online_tlds_and_collected_headers(self):
+        config = {
+            "ONLINETLD": True,
+            "TLDS": ["com", "org", "uk", "co.uk", "net"],
+            "TLDADD": ["lan"],
+            "HTTP_HEADER_COLLECTION": {
+                "server": True,
+                "x-powered-by": False,
+                "set-cookie": True,
+            },
+        }
+        expected = dict(
+            REGRESSION_COMMON_FIELDS,
+            domain=[
+                "example.co.uk",
+                "example.net",
+                "example.com",
+                "example.org",
+                "internal.lan",
+            ],
+            fqdn=[
+                "www.example.co.uk",
+                "host.example.net",
+                "login.example.com",
+                "www.example.org",
+                "api.example.com",
+                "mail.internal.lan",
+                "mx1.example.org",
+            ],
+            host=["www", "host", "login", "api", "mail", "mx1"],
+            http_header=["server", "set-cookie", "x-powered-by"],
+            http_headval=[
+                "server:nginx/1.24",
+                "set-cookie:sessionid=abc; path=/",
+                "set-cookie:csrftoken=xyz; secure",
+                "server:apache/2.4",
+            ],
+            tld=["co.uk", "net", "com", "org", "lan"],
+        )
+        self.assertEqual(
+            parse_json(copy.deepcopy(REGRESSION_DOCUMENT), config), expected
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
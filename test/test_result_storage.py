@@ -0,0 +1,132 @@
+"""
+Tests for job result storage and streamed result uploads.
+"""
+
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+# pylint: disable=missing-function-docstring
+
+from app.utils.result_storage import (
+    ResultTooLarge,
+    decode_body,
+    find_result_path,
+    iter_result_hosts,
+    read_result,
+    store_result_stream,
+    write_result,
+)
+
+JOB_UID = "0b3f2c1e-8a4d-4e55-9c1a-2f6d7e8a9b0c"
+HOSTS = [
+    {"ip": "192.0.2.1", "ports": [{"portid": "80"}]},
+    {"ip": "192.0.2.2", "ports": [{"portid": "443"}]},
+]
+
+
+class ResultStorageTest(unittest.TestCase):
+    """
+    Validate result writes, reads and format switches.
+    """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.json_folder = self._tmp_dir.name
+        os.makedirs(os.path.join(self.json_folder, JOB_UID[0]))
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_json_payload_is_stored_verbatim(self):
+        payload = json.dumps(HOSTS)
+        path = write_result(self.json_folder, JOB_UID, payload, "json")
+        with open(path, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), payload)
+
+    def test_ndjson_round_trip_replaces_json_file(self):
+        write_result(self.json_folder, JOB_UID, json.dumps(HOSTS), "json")
+        path = write_result(self.json_folder, JOB_UID, json.dumps(HOSTS), "ndjson.gz")
+        self.assertEqual(find_result_path(self.json_folder, JOB_UID), path)
+        self.assertEqual(list(iter_result_hosts(path)), HOSTS)
+        self.assertEqual(read_result(path), HOSTS)
+        self.assertEqual(
+            os.listdir(os.path.join(self.json_folder, JOB_UID[0])),
+            [os.path.basename(path)],
+        )
+
+    def test_invalid_payload_is_rejected(self):
+        with self.assertRaises(ValueError):
+            write_result(self.json_folder, JOB_UID, "{not json", "json")
+        self.assertIsNone(find_result_path(self.json_folder, JOB_UID))
+
+
+class StreamedResultUploadTest(unittest.TestCase):
+    """
+    Validate streamed, compressed and size-limited result uploads.
+    """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.json_folder = self._tmp_dir.name
+        os.makedirs(os.path.join(self.json_folder, JOB_UID[0]))
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _stored_files(self):
+        return os.listdir(os.path.join(self.json_folder, JOB_UID[0]))
+
+    def test_gzip_json_upload(self):
+        stream = io.BytesIO(gzip.compress(json.dumps(HOSTS).encode()))
+        path = store_result_stream(
+            self.json_folder, JOB_UID, stream, "json", content_encoding="gzip"
+        )
+        self.assertEqual(read_result(path), HOSTS)
+        self.assertEqual(self._stored_files(), [os.path.basename(path)])
+
+    def test_ndjson_upload_to_both_formats(self):
+        body = "\n".join(json.dumps(host) for host in HOSTS).encode()
+        for storage_format in ("json", "ndjson.gz"):
+            path = store_result_stream(
+                self.json_folder,
+                JOB_UID,
+                io.BytesIO(body),
+                storage_format,
+                ndjson=True,
+            )
+            self.assertEqual(list(iter_result_hosts(path)), HOSTS)
+            self.assertEqual(self._stored_files(), [os.path.basename(path)])
+
+    def test_decoded_size_limit(self):
+        stream = io.BytesIO(gzip.compress(b"[" + b" " * 4096 + b"]"))
+        with self.assertRaises(ResultTooLarge):
+            store_result_stream(
+                self.json_folder,
+                JOB_UID,
+                stream,
+                content_encoding="gzip",
+                max_bytes=1024,
+            )
+        self.assertEqual(self._stored_files(), [])
+        with self.assertRaises(ResultTooLarge):
+            decode_body(io.BytesIO(gzip.compress(b"x" * 4096)), "gzip", 1024)
+
+    def test_corrupt_or_unknown_encoding_is_rejected(self):
+        with self.assertRaises(ValueError):
+            store_result_stream(
+                self.json_folder,
+                JOB_UID,
+                io.BytesIO(b"not gzip"),
+                content_encoding="gzip",
+            )
+        with self.assertRaises(ValueError):
+            decode_body(io.BytesIO(b"{}"), "br")
+        self.assertEqual(self._stored_files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+"""
+Tests for the job completion of target/profile scan states on SQLite.
+"""
+
+from datetime import datetime
+import tempfile
+from types import SimpleNamespace
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# pylint: disable=missing-function-docstring
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+
+from app.models import (
+    Jobs,
+    Model,
+    ScanProfileCycles,
+    ScanProfiles,
+    Targets,
+    TargetScanStates,
+    assoc_jobs_targets,
+)
+from app.utils import scan_cycles
+from app.utils.scan_cycles import complete_job_scan_states
+
+LAST_SCAN = datetime(2026, 1, 1, 0, 0, 0)
+CYCLE_START = datetime(2026, 1, 1, 12, 0, 0)
+FIRST_END = datetime(2026, 1, 2, 0, 0, 0)
+SECOND_END = datetime(2026, 1, 3, 0, 0, 0)
+
+
+class ScanStatesDatabaseTest(unittest.TestCase):
+    """
+    Temporary SQLite database with the application schema.
+
+    Target 1 is held by jobs 1 and 2 of profile 1, target 2 by job 1 only,
+    target 3 by job 1 and also scanned by profile 2.
+    """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{Path(self._tmp_dir.name) / 'db'}")
+        Model.metadata.create_all(self.engine)
+        self.session = Session(self.engine)
+        self.session.execute(
+            ScanProfiles.__table__.insert(),
+            [
+                {"id": 1, "name": "profile", "apply_to_all": True},
+                {"id": 2, "name": "other", "apply_to_all": True},
+            ],
+        )
+        self.session.execute(
+            Targets.__table__.insert(),
+            [
+                {
+                    "id": target_id,
+                    "value": f"192.0.2.{target_id}",
+                    "working": True,
+                    "last_scan": LAST_SCAN,
+                    "scan_unit_count": 1,
+                }
+                for target_id in (1, 2, 3)
+            ],
+        )
+        self.session.execute(
+            TargetScanStates.__table__.insert(),
+            [
+                {
+                    "target_id": target_id,
+                    "scanprofile_id": 1,
+                    "working": True,
+                    "last_scan": LAST_SCAN,
+                }
+                for target_id in (1, 2, 3)
+            ]
+            + [
+                {
+                    "target_id": 3,
+                    "scanprofile_id": 2,
+                    "working": True,
+                    "last_scan": LAST_SCAN,
+                }
+            ],
+        )
+        self.session.execute(
+            Jobs.__table__.insert(),
+            [
+                {
+                    "id": job_id,
+                    "uid": f"00000000-0000-4000-8000-{job_id:012d}",
+                    "job": "192.0.2.0/30",
+                    "active": True,
+                    "finished": False,
+                    "scanprofile_id": 1,
+                    "scan_unit_count": unit_count,
+                }
+                for job_id, unit_count in ((1, 3), (2, 1))
+            ],
+        )
+        self.session.execute(
+            assoc_jobs_targets.insert(),
+            [
+                {"job_id": 1, "target_id": 1},
+                {"job_id": 1, "target_id": 2},
+                {"job_id": 1, "target_id": 3},
+                {"job_id": 2, "target_id": 1},
+            ],
+        )
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        self._tmp_dir.cleanup()
+
+    def finish_job(self, job_id, completed_at):
+        job = self.session.get(Jobs, job_id)
+        job.finished = True
+        job.active = False
+        job.job_end = completed_at
+        self.session.flush()
+        return job
+
+    def state(self, target_id, scanprofile_id=1):
+        return (
+            self.session.query(TargetScanStates)
+            .filter(
+                TargetScanStates.target_id == target_id,
+                TargetScanStates.scanprofile_id == scanprofile_id,
+            )
+            .one()
+        )
+
+
+class CompleteJobScanStatesTest(ScanStatesDatabaseTest):
+    """
+    Validate the set-based completion of the states of a finished job.
+    """
+
+    def complete(self, job_id, completed_at):
+        self.finish_job(job_id, completed_at)
+        completed = complete_job_scan_states(self.session, job_id, 1, completed_at)
+        self.session.commit()
+        self.session.expire_all()
+        return completed
+
+    def test_shared_state_stays_working_until_last_job(self):
+        self.assertEqual(self.complete(1, FIRST_END), 2)
+
+        shared = self.state(1)
+        self.assertTrue(shared.working)
+        self.assertEqual(shared.last_scan, LAST_SCAN)
+        self.assertTrue(self.session.get(Targets, 1).working)
+        self.assertEqual(self.session.get(Targets, 1).last_scan, LAST_SCAN)
+
+        only = self.state(2)
+        self.assertFalse(only.working)
+        self.assertEqual(only.last_scan, FIRST_END)
+        self.assertEqual(only.last_previous_scan, LAST_SCAN)
+        self.assertFalse(self.session.get(Targets, 2).working)
+        self.assertEqual(self.session.get(Targets, 2).last_scan, FIRST_END)
+        self.assertEqual(self.session.get(Targets, 2).last_previous_scan, LAST_SCAN)
+
+        self.assertEqual(self.complete(2, SECOND_END), 1)
+
+        shared = self.state(1)
+        self.assertFalse(shared.working)
+        self.assertEqual(shared.last_scan, SECOND_END)
+        self.assertEqual(shared.last_previous_scan, LAST_SCAN)
+        self.assertFalse(self.session.get(Targets, 1).working)
+        self.assertEqual(self.session.get(Targets, 1).last_scan, SECOND_END)
+
+    def test_target_working_flag_follows_other_profiles(self):
+        self.complete(1, FIRST_END)
+
+        self.assertFalse(self.state(3).working)
+        self.assertTrue(self.state(3, scanprofile_id=2).working)
+        self.assertTrue(self.session.get(Targets, 3).working)
+        self.assertEqual(self.session.get(Targets, 3).last_scan, FIRST_END)
+
+
+class CompleteJobInCycleTest(ScanStatesDatabaseTest):
+    """
+    Validate the incremental cycle counters against a full reconcile.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Target 1 is a /30, jobs count the units of their targets.
+        self.session.execute(
+            update(Targets).where(Targets.id == 1).values(scan_unit_count=4)
+        )
+        for job_id, unit_count in ((1, 6), (2, 4)):
+            self.session.execute(
+                update(Jobs).where(Jobs.id == job_id).values(scan_unit_count=unit_count)
+            )
+        self.session.commit()
+        self.db_patch = mock.patch.object(
+            scan_cycles, "db", SimpleNamespace(session=self.session)
+        )
+        self.db_patch.start()
+        self.cycle = scan_cycles.get_or_create_running_cycle(1, now=CYCLE_START)
+        self.session.execute(update(Jobs).values(scanprofile_cycle_id=self.cycle.id))
+        self.session.commit()
+
+    def tearDown(self):
+        self.db_patch.stop()
+        super().tearDown()
+
+    def counters(self):
+        cycle = self.session.get(ScanProfileCycles, self.cycle.id)
+        self.session.refresh(cycle)
+        return (
+            cycle.status,
+            cycle.completed_target_count,
+            cycle.completed_scan_unit_count,
+        )
+
+    def complete_and_reconcile(self, job_id, completed_at):
+        job = self.finish_job(job_id, completed_at)
+        scan_cycles.complete_job_in_cycle(job, completed_at)
+        self.session.commit()
+        incremental = self.counters()
+        scan_cycles.reconcile_scanprofile_cycle(
+            1, cycle=self.session.get(ScanProfileCycles, self.cycle.id)
+        )
+        self.session.commit()
+        return incremental, self.counters()
+
+    def test_incremental_counters_match_reconcile(self):
+        self.assertEqual(self.counters(), ("running", 0, 0))
+        self.assertEqual((self.cycle.target_count, self.cycle.scan_unit_count), (3, 6))
+
+        incremental, reconciled = self.complete_and_reconcile(1, FIRST_END)
+        self.assertEqual(incremental, reconciled)
+        self.assertEqual(incremental, ("running", 2, 6))
+
+        incremental, reconciled = self.complete_and_reconcile(2, SECOND_END)
+        self.assertEqual(incremental, reconciled)
+        self.assertEqual(incremental, ("finished", 3, 6))
+
+
+if __name__ == "__main__":
+    unittest.main()
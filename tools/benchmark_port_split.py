@@ -0,0 +1,181 @@
+#!/bin/env python
+"""
+Micro-benchmark of the per-port split of scanner host results.
+
+Compares the export splitter, which shares the host and port objects, with
+the former deep-copy splitter on synthetic hosts with many open ports, or
+on the hosts of existing result files, and checks both build the same
+documents.
+"""
+
+import argparse
+import copy
+from pathlib import Path
+import sys
+import time
+
+BASE_DIR = Path(__file__).resolve().parent
+UTILS_DIR = BASE_DIR.parent / "webapp" / "app" / "utils"
+sys.path.append(str(UTILS_DIR))
+
+# pylint: disable=wrong-import-position
+from nmap2json.smarthash import port_smart_hash
+from port_documents import (
+    normalize_port,
+    port_document_uuid,
+    split_scan_result_by_port,
+)
+from result_storage import iter_result_hosts
+
+DEFAULT_HOSTS = 5
+DEFAULT_PORTS = 300
+DEFAULT_OUTPUT_SIZE = 2000
+DEFAULT_REPEAT = 3
+
+
+def parse_args(argv=None):
+    """
+    Parse CLI options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the per-port split of scanner host results."
+    )
+    parser.add_argument(
+        "result_files",
+        nargs="*",
+        help="Result files (.json or .ndjson.gz) to split instead of synthetic hosts.",
+    )
+    parser.add_argument(
+        "--hosts",
+        type=int,
+        default=DEFAULT_HOSTS,
+        help=f"Synthetic hosts. Default: {DEFAULT_HOSTS}.",
+    )
+    parser.add_argument(
+        "--ports",
+        type=int,
+        default=DEFAULT_PORTS,
+        help=f"Open ports per synthetic host. Default: {DEFAULT_PORTS}.",
+    )
+    parser.add_argument(
+        "--output-size",
+        type=int,
+        default=DEFAULT_OUTPUT_SIZE,
+        help=f"Characters of NSE output per script. Default: {DEFAULT_OUTPUT_SIZE}.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f"Runs per splitter. Default: {DEFAULT_REPEAT}.",
+    )
+    return parser.parse_args(argv)
+
+
+def deepcopy_split(scan_result):
+    """
+    Former splitter: deep copies of the port and of the whole host per port.
+    """
+    ip = scan_result.get("addr")
+    documents = []
+    for port in scan_result.get("ports") or []:
+        port_copy = normalize_port(copy.deepcopy(port))
+        port_hash = port_smart_hash(port_copy)
+        doc_id = port_document_uuid(ip, port_copy.get("portid"), port_hash)
+        if not doc_id:
+            continue
+        public_port = copy.deepcopy(port_copy)
+        public_port.pop("hsh256", None)
+        body = copy.deepcopy(scan_result)
+        body["ports"] = [public_port]
+        body["hsh256"] = port_hash
+        documents.append({"id": doc_id, "ip": ip, "body": body})
+    return documents
+
+
+def synthetic_host(index, ports, output_size):
+    """
+    Return one host result with ports open ports carrying NSE outputs.
+    """
+    filler = ("x" * 63 + "\n") * (output_size // 64 + 1)
+    return {
+        "addr": f"192.0.2.{index % 256}",
+        "starttime": "1700000000",
+        "endtime": "1700000100",
+        "hostnames": [{"name": f"host{index}.example.com", "type": "PTR"}],
+        "ports": [
+            {
+                "protocol": "tcp",
+                "portid": str(1000 + port),
+                "state": "open",
+                "service": {"name": "http", "product": "nginx"},
+                "scripts": [
+                    {"id": "banner", "output": filler[:output_size]},
+                    {
+                        "id": "http-headers",
+                        "output": f"\n  Server: nginx\n  X-Port: {port}\n",
+                    },
+                    {"id": "http-title", "output": f"Title {port}"},
+                ],
+            }
+            for port in range(ports)
+        ],
+    }
+
+
+def time_split(splitter, hosts, repeat):
+    """
+    Split every host repeat times, return (best_seconds, documents).
+    """
+    best_seconds = None
+    documents = 0
+    for _ in range(max(repeat, 1)):
+        documents = 0
+        start_time = time.perf_counter()
+        for host in hosts:
+            documents += len(splitter(host))
+        elapsed = time.perf_counter() - start_time
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+    return best_seconds, documents
+
+
+def main(argv=None):
+    """
+    CLI entrypoint.
+    """
+    args = parse_args(argv)
+    if args.result_files:
+        hosts = [
+            host
+            for result_file in args.result_files
+            for host in iter_result_hosts(result_file)
+            if isinstance(host, dict)
+        ]
+    else:
+        hosts = [
+            synthetic_host(index, args.ports, args.output_size)
+            for index in range(args.hosts)
+        ]
+    if not hosts:
+        raise SystemExit("No host to split")
+
+    for host in hosts:
+        if split_scan_result_by_port(host) != deepcopy_split(host):
+            raise SystemExit(f"Splitters disagree on host {host.get('addr')}")
+
+    print(f"hosts={len(hosts)}")
+    print("splitter,best_ms,documents,documents_per_second")
+    for label, splitter in (
+        ("deepcopy", deepcopy_split),
+        ("shared", split_scan_result_by_port),
+    ):
+        best_seconds, documents = time_split(splitter, hosts, args.repeat)
+        print(
+            f"{label},{best_seconds * 1000:.2f},{documents},"
+            f"{documents / max(best_seconds, 1e-9):.0f}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/bin/env python
+"""
+Micro-benchmark of result_parser.parse_json on sample results.
+
+Splits the hosts of result files into per-port documents, as the export
+does, then parses them with the compiled parsing plan and with the former
+rule-by-rule interpreter, and checks both give the same fields.
+
+The former interpreter calls the current public get_* actions, so the check
+only covers the rule dispatch and the fusion order. The header, cookie,
+certificate and TLD outputs are pinned by test/test_result_parser.py.
+"""
+
+import argparse
+from pathlib import Path
+import random
+import sys
+import time
+
+BASE_DIR = Path(__file__).resolve().parent
+UTILS_DIR = BASE_DIR.parent / "webapp" / "app" / "utils"
+DEFAULT_JSON_FOLDER = BASE_DIR.parent / "webapp" / "app" / "jsons"
+sys.path.append(str(UTILS_DIR))
+
+# pylint: disable=wrong-import-position
+import result_parser
+from port_documents import split_scan_result_by_port
+from result_storage import RESULT_FORMATS, iter_result_hosts
+
+DEFAULT_SAMPLE_SIZE = 200
+DEFAULT_REPEAT = 3
+DEFAULT_HEADERS = ("server", "x-powered-by", "content-type")
+LEGACY_CONFIG_AWARE_ACTIONS = {"get_fqdn_requested", "get_hosts", "get_http_header"}
+
+
+def parse_args(argv=None):
+    """
+    Parse CLI options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark parse_json on sample scan results."
+    )
+    parser.add_argument(
+        "result_files",
+        nargs="*",
+        help="Result files (.json or .ndjson.gz). Default: a sample of --json-folder.",
+    )
+    parser.add_argument(
+        "--json-folder",
+        default=str(DEFAULT_JSON_FOLDER),
+        help=f"Result folder, JSON_FOLDER in webapp/config.py. "
+        f"Default: {DEFAULT_JSON_FOLDER}.",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=DEFAULT_SAMPLE_SIZE,
+        help=f"Result files to sample. Default: {DEFAULT_SAMPLE_SIZE}.",
+    )
+    parser.add_argument(
+        "--header",
+        action="append",
+        dest="headers",
+        help="HTTP header collected with its value, repeatable. "
+        f"Default: {', '.join(DEFAULT_HEADERS)}.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f"Runs per parser. Default: {DEFAULT_REPEAT}.",
+    )
+    return parser.parse_args(argv)
+
+
+def legacy_get_body(data, target):
+    """
+    Former get_body, with a normalized key map built at every level.
+    """
+    keys = target.replace("-", "_").replace(" ", "_").split(".")[1:]
+    current = data
+    for k in keys:
+        if not isinstance(current, dict):
+            return None
+        norm_map = {key.replace(" ", "_").replace("-", "_"): key for key in current}
+        real_key = norm_map.get(k)
+        if not real_key:
+            return None
+        current = current[real_key]
+    return current
+
+
+def legacy_parse_fields(doc, db_conf):
+    """
+    Former parse_json loop: every rule re-split and run over every script.
+    """
+    final_result = {}
+    for parsing_rule in result_parser.default_parsing:
+        action, target = parsing_rule.split(":")[:2]
+        section, script_name = target.split(".")[:2]
+        action = action.lower()
+        target = ".".join(target.split(".")[1:])
+        parser = getattr(result_parser, action)
+
+        def run(script, parser=parser, action=action, target=target):
+            # Resolve with the former get_body, then run the public action.
+            value = legacy_get_body(script, target)
+            wrapped = {"v": value}
+            if action in LEGACY_CONFIG_AWARE_ACTIONS:
+                return parser(wrapped, "x.v", db_conf)
+            return parser(wrapped, "x.v")
+
+        parse_result = {}
+        if section == "b":
+            for key in doc.get("body"):
+                if key == script_name:
+                    parse_result = run(doc.get("body").get(key))
+        elif section == "p":
+            for port in doc.get("body").get("ports"):
+                for script in port.get("scripts", []):
+                    if script.get("id") == script_name:
+                        parse_result = result_parser.fuse_dicts(
+                            parse_result, run(script)
+                        )
+        final_result = result_parser.fuse_dicts(final_result, parse_result)
+    return final_result
+
+
+def compiled_parse_fields(doc, db_conf):
+    """
+    parse_json fields from the compiled default plan.
+    """
+    return result_parser.DEFAULT_PARSE_PLAN.parse(doc, db_conf)
+
+
+def load_documents(args):
+    """
+    Return the per-port documents of the selected result files.
+    """
+    paths = [Path(path) for path in args.result_files]
+    if not paths:
+        json_folder = Path(args.json_folder).expanduser()
+        if not json_folder.is_dir():
+            raise SystemExit(f"{json_folder} is not a directory")
+        suffixes = tuple(f".{storage_format}" for storage_format in RESULT_FORMATS)
+        paths = [
+            path
+            for path in sorted(json_folder.glob("*/*"))
+            if path.is_file() and path.name.endswith(suffixes)
+        ]
+        paths = random.sample(paths, min(args.sample, len(paths)))
+
+    documents = []
+    for path in paths:
+        for host in iter_result_hosts(path):
+            documents.extend(split_scan_result_by_port(host))
+    return paths, documents
+
+
+def time_parse(parse_fields, documents, db_conf, repeat):
+    """
+    Parse every document repeat times, return the best time in seconds.
+    """
+    best_seconds = None
+    for _ in range(max(repeat, 1)):
+        start_time = time.perf_counter()
+        for document in documents:
+            parse_fields(document, db_conf)
+        elapsed = time.perf_counter() - start_time
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+    return best_seconds
+
+
+def main(argv=None):
+    """
+    CLI entrypoint.
+    """
+    args = parse_args(argv)
+    if args.sample <= 0:
+        raise SystemExit("--sample must be positive")
+    paths, documents = load_documents(args)
+    if not documents:
+        raise SystemExit("No document to parse")
+
+    db_conf = result_parser.normalize_db_conf(
+        {
+            "ONLINETLD": False,
+            "TLDS": [],
+            "TLDADD": [],
+            "HTTP_HEADER_COLLECTION": {
+                header: True for header in args.headers or DEFAULT_HEADERS
+            },
+        }
+    )
+    for document in documents:
+        if compiled_parse_fields(document, db_conf) != legacy_parse_fields(
+            document, db_conf
+        ):
+            raise SystemExit(f"Parsers disagree on document {document['id']}")
+
+    print(f"files={len(paths)} documents={len(documents)}")
+    print("parser,best_ms,documents_per_second")
+    for label, parse_fields in (
+        ("legacy", legacy_parse_fields),
+        ("compiled", compiled_parse_fields),
+    ):
+        best_seconds = time_parse(parse_fields, documents, db_conf, args.repeat)
+        print(
+            f"{label},{best_seconds * 1000:.2f},"
+            f"{len(documents) / max(best_seconds, 1e-9):.0f}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/bin/env python
+"""
+Micro-benchmark of the target updates of sndjob job completion.
+
+Seeds a temporary SQLite database with jobs of --targets targets, part of
+them still held by other unfinished jobs, then completes every job with the
+former per-target ORM loop and with the set-based
+scan_cycles.complete_job_scan_states, and checks both leave the same target
+and target/profile states.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import logging
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+WEBAPP_DIR = BASE_DIR / "webapp"
+
+DEFAULT_JOBS = 20
+DEFAULT_TARGETS = 256
+DEFAULT_OVERLAP = 0.1
+COMPLETED_AT = datetime(2026, 1, 1, 12, 0, 0)
+MIGRATION_INDEXES = (
+    "CREATE INDEX idx_jobs_targets_assoc_target_job"
+    " ON jobs_targets_assoc(target_id, job_id)",
+    "CREATE INDEX idx_jobs_targets_assoc_job_target"
+    " ON jobs_targets_assoc(job_id, target_id)",
+)
+
+
+def parse_args(argv=None):
+    """
+    Parse CLI options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the target updates of sndjob job completion."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Jobs completed per method. Default: {DEFAULT_JOBS}.",
+    )
+    parser.add_argument(
+        "--targets",
+        type=int,
+        default=DEFAULT_TARGETS,
+        help=f"Targets per job. Default: {DEFAULT_TARGETS}.",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=DEFAULT_OVERLAP,
+        help="Share of the targets of a job also held by an unfinished job. "
+        f"Default: {DEFAULT_OVERLAP}.",
+    )
+    return parser.parse_args(argv)
+
+
+def seed_database(session, models, args):
+    """
+    Create the profile, targets, states and jobs to complete.
+
+    Returns the ids of the jobs to complete, in order.
+    """
+    last_scan = COMPLETED_AT - timedelta(days=1)
+    session.execute(
+        models.ScanProfiles.__table__.insert(),
+        [{"id": 1, "name": "benchmark"}, {"id": 2, "name": "other"}],
+    )
+    target_rows = []
+    state_rows = []
+    for target_id in range(1, args.jobs * args.targets + 1):
+        target_rows.append(
+            {
+                "id": target_id,
+                "value": f"10.{target_id >> 16 & 255}.{target_id >> 8 & 255}"
+                f".{target_id & 255}",
+                "working": True,
+                "last_scan": last_scan,
+                "scan_unit_count": 1,
+            }
+        )
+        state_rows.append(
+            {
+                "target_id": target_id,
+                "scanprofile_id": 1,
+                "working": True,
+                "last_scan": last_scan,
+            }
+        )
+        # Every third target is also being scanned by another profile.
+        state_rows.append(
+            {
+                "target_id": target_id,
+                "scanprofile_id": 2,
+                "working": target_id % 3 == 0,
+                "last_scan": last_scan,
+            }
+        )
+    session.execute(models.Targets.__table__.insert(), target_rows)
+    session.execute(models.TargetScanStates.__table__.insert(), state_rows)
+
+    job_rows = []
+    assoc_rows = []
+    held_targets = int(args.targets * args.overlap)
+    for index in range(args.jobs):
+        job_id = index + 1
+        target_ids = range(index * args.targets + 1, (index + 1) * args.targets + 1)
+        job_rows.append(
+            {
+                "id": job_id,
+                "uid": f"00000000-0000-4000-8000-{job_id:012d}",
+                "job": "benchmark",
+                "active": True,
+                "scanprofile_id": 1,
+                "scan_unit_count": args.targets,
+                "lease_retries": 0,
+            }
+        )
+        assoc_rows.extend(
+            {"job_id": job_id, "target_id": target_id} for target_id in target_ids
+        )
+        # A second unfinished job of the profile holds the first targets.
+        holder_id = args.jobs + job_id
+        job_rows.append(
+            {
+                "id": holder_id,
+                "uid": f"00000000-0000-4000-8000-{holder_id:012d}",
+                "job": "holder",
+                "active": False,
+                "scanprofile_id": 1,
+                "scan_unit_count": held_targets,
+                "lease_retries": 0,
+            }
+        )
+        assoc_rows.extend(
+            {"job_id": holder_id, "target_id": target_id}
+            for target_id in list(target_ids)[:held_targets]
+        )
+    session.execute(models.Jobs.__table__.insert(), job_rows)
+    session.execute(models.assoc_jobs_targets.insert(), assoc_rows)
+    session.commit()
+    return list(range(1, args.jobs + 1))
+
+
+def legacy_complete(session, models, job_id, completed_at):
+    """
+    Former sndjob loop: three queries and a merge for every target.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sqlalchemy import distinct, func
+
+    Jobs = models.Jobs
+    TargetScanStates = models.TargetScanStates
+    job_bot = session.get(Jobs, job_id)
+    with session.no_autoflush:
+        for target in job_bot.targets:
+            previous_scan = target.last_scan
+            assoc = models.assoc_jobs_targets.alias()
+            count_query = (
+                session.query(func.count(distinct(Jobs.id)))
+                .select_from(assoc)
+                .join(Jobs, assoc.c.job_id == Jobs.id, isouter=True)
+                .filter(
+                    assoc.c.target_id == target.id,
+                    Jobs.id != job_bot.id,
+                    Jobs.finished == False,
+                    Jobs.scanprofile_id == job_bot.scanprofile_id,
+                )
+            )
+            scan_state = (
+                session.query(TargetScanStates)
+                .filter(
+                    TargetScanStates.target_id == target.id,
+                    TargetScanStates.scanprofile_id == job_bot.scanprofile_id,
+                )
+                .one_or_none()
+            )
+            if count_query.scalar() == 0:
+                if scan_state is not None:
+                    scan_state.working = False
+                    scan_state.last_previous_scan = scan_state.last_scan
+                    scan_state.last_scan = completed_at
+                target.last_previous_scan = previous_scan
+                target.last_scan = completed_at
+            target.working = any(state.working for state in target.scan_states)
+            session.merge(target)
+
+
+def set_based_complete(session, models, job_id, completed_at):
+    """
+    Current sndjob path.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from app.utils.scan_cycles import complete_job_scan_states
+
+    job_bot = session.get(models.Jobs, job_id)
+    complete_job_scan_states(session, job_id, job_bot.scanprofile_id, completed_at)
+
+
+def run_method(complete, models, args, db_path):
+    """
+    Complete every seeded job, return (latencies in seconds, final states).
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    models.Model.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Indexes of the sql_upd migrations, as on a migrated database.
+        for statement in MIGRATION_INDEXES:
+            connection.execute(text(statement))
+    latencies = []
+    with Session(engine) as session:
+        job_ids = seed_database(session, models, args)
+        for job_id in job_ids:
+            start_time = time.perf_counter()
+            job = session.get(models.Jobs, job_id)
+            job.finished = True
+            job.active = False
+            job.job_end = COMPLETED_AT
+            complete(session, models, job_id, COMPLETED_AT)
+            session.commit()
+            latencies.append(time.perf_counter() - start_time)
+        states = (
+            session.execute(
+                models.Targets.__table__.select().order_by(models.Targets.id)
+            ).all(),
+            session.execute(
+                models.TargetScanStates.__table__.select().order_by(
+                    models.TargetScanStates.id
+                )
+            ).all(),
+        )
+    engine.dispose()
+    return latencies, states
+
+
+def main(argv=None):
+    """
+    CLI entrypoint.
+    """
+    args = parse_args(argv)
+    if args.jobs <= 0 or args.targets <= 0:
+        raise SystemExit("--jobs and --targets must be positive")
+    if not 0 <= args.overlap <= 1:
+        raise SystemExit("--overlap must be between 0 and 1")
+
+    sys.path.insert(0, str(WEBAPP_DIR))
+    warnings.filterwarnings("ignore", category=Warning)
+    logging.disable(logging.CRITICAL)
+
+    from app import models  # pylint: disable=import-outside-toplevel
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for label, complete in (
+            ("legacy", legacy_complete),
+            ("set_based", set_based_complete),
+        ):
+            results[label] = run_method(
+                complete, models, args, Path(temp_dir) / f"{label}.db"
+            )
+    if results["legacy"][1] != results["set_based"][1]:
+        raise SystemExit("Methods disagree on the completed states")
+
+    print(f"jobs={args.jobs} targets_per_job={args.targets} overlap={args.overlap}")
+    print("method,mean_ms,p50_ms,p95_ms,max_ms")
+    for label, (latencies, _) in results.items():
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        p95_ms = latencies_ms[min(int(len(latencies_ms) * 0.95), len(latencies_ms) - 1)]
+        print(
+            f"{label},{statistics.fmean(latencies_ms):.2f},"
+            f"{statistics.median(latencies_ms):.2f},{p95_ms:.2f},"
+            f"{latencies_ms[-1]:.2f}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
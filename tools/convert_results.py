@@ -0,0 +1,259 @@
+#!/bin/env python
+"""
+Convert job result files under JSON_FOLDER between the json and ndjson.gz
+storage formats, or benchmark both formats on a sample of results.
+
+The web application reads both formats, so files can be converted while it
+runs. An export pass reading a file being converted fails and is retried.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+
+BASE_DIR = Path(__file__).resolve().parent
+UTILS_DIR = BASE_DIR.parent / "webapp" / "app" / "utils"
+DEFAULT_JSON_FOLDER = BASE_DIR.parent / "webapp" / "app" / "jsons"
+sys.path.append(str(UTILS_DIR))
+
+from result_storage import (  # pylint: disable=wrong-import-position
+    DEFAULT_COMPRESS_LEVEL,
+    RESULT_FORMAT_JSON,
+    RESULT_FORMAT_NDJSON_GZ,
+    RESULT_FORMATS,
+    iter_result_hosts,
+    read_result,
+    result_format_of,
+    result_path,
+    write_hosts,
+)
+
+DEFAULT_SAMPLE_SIZE = 200
+DEFAULT_BENCHMARK_REPEAT = 3
+
+
+def parse_args(argv=None):
+    """
+    Parse CLI options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert or benchmark job result storage formats."
+    )
+    parser.add_argument(
+        "--json-folder",
+        default=str(DEFAULT_JSON_FOLDER),
+        help=f"Result folder, JSON_FOLDER in webapp/config.py. "
+        f"Default: {DEFAULT_JSON_FOLDER}.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="Rewrite result files in another storage format."
+    )
+    convert_parser.add_argument(
+        "--format",
+        choices=RESULT_FORMATS,
+        default=RESULT_FORMAT_NDJSON_GZ,
+        help=f"Target storage format. Default: {RESULT_FORMAT_NDJSON_GZ}.",
+    )
+    convert_parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=DEFAULT_COMPRESS_LEVEL,
+        help=f"gzip level for ndjson.gz. Default: {DEFAULT_COMPRESS_LEVEL}.",
+    )
+    convert_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the files to convert.",
+    )
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark",
+        help="Compare disk use and read speed of both formats on sample files.",
+    )
+    benchmark_parser.add_argument(
+        "--sample",
+        type=int,
+        default=DEFAULT_SAMPLE_SIZE,
+        help=f"Result files to sample. Default: {DEFAULT_SAMPLE_SIZE}.",
+    )
+    benchmark_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_BENCHMARK_REPEAT,
+        help=f"Read passes per format. Default: {DEFAULT_BENCHMARK_REPEAT}.",
+    )
+    benchmark_parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=DEFAULT_COMPRESS_LEVEL,
+        help=f"gzip level for ndjson.gz. Default: {DEFAULT_COMPRESS_LEVEL}.",
+    )
+    return parser.parse_args(argv)
+
+
+def iter_result_files(json_folder):
+    """
+    Yield every result file in the sharded JSON_FOLDER layout.
+    """
+    suffixes = tuple(f".{storage_format}" for storage_format in RESULT_FORMATS)
+    for shard in sorted(json_folder.iterdir()):
+        if not shard.is_dir():
+            continue
+        for path in sorted(shard.iterdir()):
+            if path.is_file() and path.name.endswith(suffixes):
+                yield path
+
+
+def result_uid(path):
+    """
+    Return the job uid of one result file.
+    """
+    return path.name.split(".", 1)[0]
+
+
+def write_json(path, data):
+    """
+    Write one decoded result as compact JSON.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def convert_file(path, storage_format, compresslevel):
+    """
+    Rewrite one result file in storage_format and remove the source file.
+    """
+    target_path = result_path(str(path.parent.parent), result_uid(path), storage_format)
+    if storage_format == RESULT_FORMAT_NDJSON_GZ:
+        write_hosts(target_path, iter_result_hosts(path), compresslevel=compresslevel)
+    else:
+        write_json(target_path, read_result(path))
+    path.unlink()
+    return target_path
+
+
+def convert(json_folder, storage_format, compresslevel, dry_run=False):
+    """
+    Convert every result file not yet in storage_format.
+    """
+    converted = 0
+    failed = 0
+    bytes_before = 0
+    bytes_after = 0
+    for path in iter_result_files(json_folder):
+        if result_format_of(path) == storage_format:
+            continue
+        if dry_run:
+            converted += 1
+            continue
+        try:
+            size_before = path.stat().st_size
+            target_path = convert_file(path, storage_format, compresslevel)
+        except (OSError, ValueError) as error:
+            failed += 1
+            print(f"Skip {path}: {error}", flush=True)
+            continue
+        converted += 1
+        bytes_before += size_before
+        bytes_after += os.path.getsize(target_path)
+        if converted % 1000 == 0:
+            print(f"Converted {converted} files", flush=True)
+
+    if dry_run:
+        print(f"{converted} files to convert to {storage_format}")
+        return
+    print(
+        f"Converted {converted} files to {storage_format}, failed={failed}, "
+        f"bytes {bytes_before} -> {bytes_after}",
+        flush=True,
+    )
+
+
+def time_reads(paths, repeat):
+    """
+    Read every host of paths repeat times, return (best_seconds, hosts).
+    """
+    best_seconds = None
+    hosts = 0
+    for _ in range(max(repeat, 1)):
+        hosts = 0
+        start_time = time.perf_counter()
+        for path in paths:
+            for _host in iter_result_hosts(path):
+                hosts += 1
+        elapsed = time.perf_counter() - start_time
+        best_seconds = elapsed if best_seconds is None else min(best_seconds, elapsed)
+    return best_seconds, hosts
+
+
+def benchmark(json_folder, sample_size, repeat, compresslevel):
+    """
+    Print disk use and read time of a result sample in both formats.
+    """
+    paths = list(iter_result_files(json_folder))
+    if not paths:
+        raise SystemExit(f"No result file under {json_folder}")
+    paths = random.sample(paths, min(sample_size, len(paths)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_folder = Path(tmp_dir)
+        for shard in "1234567890abcdef":
+            (tmp_folder / shard).mkdir()
+        samples = {storage_format: [] for storage_format in RESULT_FORMATS}
+        for path in paths:
+            uid = result_uid(path)
+            data = read_result(path)
+            json_path = result_path(tmp_dir, uid, RESULT_FORMAT_JSON)
+            # Legacy sndjob output, pretty-printed.
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            ndjson_path = result_path(tmp_dir, uid, RESULT_FORMAT_NDJSON_GZ)
+            write_hosts(ndjson_path, iter_result_hosts(path), compresslevel)
+            samples[RESULT_FORMAT_JSON].append(json_path)
+            samples[RESULT_FORMAT_NDJSON_GZ].append(ndjson_path)
+
+        json_bytes = sum(os.path.getsize(path) for path in samples["json"])
+        print(f"files={len(paths)}")
+        print("format,bytes,ratio,best_ms,hosts,hosts_per_second")
+        for storage_format, format_paths in samples.items():
+            total_bytes = sum(os.path.getsize(path) for path in format_paths)
+            best_seconds, hosts = time_reads(format_paths, repeat)
+            print(
+                f"{storage_format},{total_bytes},"
+                f"{total_bytes / max(json_bytes, 1):.3f},"
+                f"{best_seconds * 1000:.2f},{hosts},"
+                f"{hosts / max(best_seconds, 1e-9):.0f}",
+                flush=True,
+            )
+
+
+def main(argv=None):
+    """
+    CLI entrypoint.
+    """
+    args = parse_args(argv)
+    json_folder = Path(args.json_folder).expanduser()
+    if not json_folder.is_dir():
+        raise SystemExit(f"{json_folder} is not a directory")
+    if not 1 <= args.compress_level <= 9:
+        raise SystemExit("--compress-level must be between 1 and 9")
+
+    if args.command == "convert":
+        convert(json_folder, args.format, args.compress_level, dry_run=args.dry_run)
+    elif args.command == "benchmark":
+        if args.sample <= 0:
+            raise SystemExit("--sample must be positive")
+        benchmark(json_folder, args.sample, args.repeat, args.compress_level)
+
+
+if __name__ == "__main__":
+    main()
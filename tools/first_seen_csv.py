@@ -4,7 +4,8 @@ Export and restore Kvrocks first_seen values.
 
 first_seen is historical state accumulated in Kvrocks. It is not fully
 reparsable from Meilisearch/Nmap documents, so this tool can preserve it across
-rebuilds.
+rebuilds. Both the doc:{uid} hash and the compact timestamp storage are
+supported.
 """
 
 import argparse
@@ -97,6 +98,49 @@ def count_doc_keys(redis_client, batch_size):
     return sum(1 for _key in redis_client.scan_iter(match="doc:*", count=batch_size))
 
 
+def is_compact_storage(redis_client):
+    """
+    True when timestamps only live in first_seen_index/last_seen_index.
+    """
+    storage = redis_client.get(KVrocksIndexer.TIMESTAMP_STORAGE_KEY)
+    return storage == KVrocksIndexer.TIMESTAMP_STORAGE_COMPACT
+
+
+def read_compact_batch(redis_client, batch):
+    """
+    Add IP and last_seen to (uid, first_seen) pairs read from first_seen_index.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for uid, _first_seen in batch:
+        pipe.get(f"uid:{uid}")
+        pipe.zscore("last_seen_index", uid)
+    values = pipe.execute()
+    for index, (uid, first_seen) in enumerate(batch):
+        yield uid, values[2 * index] or "", first_seen, values[2 * index + 1]
+
+
+def iter_seen_values(redis_client, batch_size, compact=False):
+    """
+    Iterate uid, ip, first_seen, last_seen from doc hashes or the seen indexes.
+    """
+    if not compact:
+        for key, uid in iter_doc_keys(redis_client, batch_size):
+            data = redis_client.hgetall(key)
+            yield uid, data.get("ip", ""), data.get("first_seen"), data.get("last_seen")
+        return
+
+    batch = []
+    for uid, first_seen in redis_client.zscan_iter(
+        "first_seen_index", count=batch_size
+    ):
+        batch.append((uid, first_seen))
+        if len(batch) >= batch_size:
+            yield from read_compact_batch(redis_client, batch)
+            batch = []
+    if batch:
+        yield from read_compact_batch(redis_client, batch)
+
+
 def count_csv_rows(csv_path):
     """
     Count data rows in a CSV file for progress reporting.
@@ -112,22 +156,27 @@ def export_first_seen(redis_client, csv_file, batch_size):
     exported = 0
     skipped = 0
     csv_path = Path(csv_file)
-    expected = count_doc_keys(redis_client, batch_size)
+    compact = is_compact_storage(redis_client)
+    if compact:
+        expected = redis_client.zcard("first_seen_index")
+    else:
+        expected = count_doc_keys(redis_client, batch_size)
     print(f"Export expected: {expected}", file=sys.stderr)
     with csv_path.open("w", encoding="utf-8", newline="") as handle:
         writer = csv.DictWriter(handle, fieldnames=CSV_FIELDS)
         writer.writeheader()
-        for key, uid in iter_doc_keys(redis_client, batch_size):
-            data = redis_client.hgetall(key)
-            first_seen = KVrocksIndexer.normalize_timestamp(data.get("first_seen"))
-            last_seen = KVrocksIndexer.normalize_timestamp(data.get("last_seen"))
+        for uid, ip, first_seen, last_seen in iter_seen_values(
+            redis_client, batch_size, compact=compact
+        ):
+            first_seen = KVrocksIndexer.normalize_timestamp(first_seen)
+            last_seen = KVrocksIndexer.normalize_timestamp(last_seen)
             if first_seen is None:
                 skipped += 1
                 continue
             writer.writerow(
                 {
                     "uid": uid,
-                    "ip": data.get("ip", ""),
+                    "ip": ip,
                     "first_seen": first_seen,
                     "last_seen": "" if last_seen is None else last_seen,
                 }
@@ -145,16 +194,19 @@ def export_first_seen(redis_client, csv_file, batch_size):
     )
 
 
-def flush_import_batch(redis_client, rows, dry_run):
+def flush_import_batch(redis_client, rows, dry_run, compact=False):
     """
     Apply one import batch to OUT Kvrocks.
     """
     if not rows:
         return {"updated": 0, "missing": 0}
 
+    # Compact timestamp storage has no doc:{uid} hash, uid:{uid} marks the
+    # indexed documents.
+    doc_prefix = "uid:" if compact else "doc:"
     pipe = redis_client.pipeline(transaction=False)
     for row in rows:
-        pipe.exists(f"doc:{row['uid']}")
+        pipe.exists(f"{doc_prefix}{row['uid']}")
     exists_values = pipe.execute()
 
     updated = 0
@@ -167,7 +219,8 @@ def flush_import_batch(redis_client, rows, dry_run):
         updated += 1
         if dry_run:
             continue
-        write_pipe.hset(f"doc:{row['uid']}", "first_seen", str(row["first_seen"]))
+        if not compact:
+            write_pipe.hset(f"doc:{row['uid']}", "first_seen", str(row["first_seen"]))
         write_pipe.zadd("first_seen_index", {row["uid"]: row["first_seen"]})
 
     if not dry_run:
@@ -182,6 +235,7 @@ def import_first_seen(redis_client, csv_file, batch_size, dry_run=False):
     csv_path = Path(csv_file)
     if not csv_path.is_file():
         raise FileNotFoundError(f"CSV file not found: {csv_path}")
+    compact = is_compact_storage(redis_client)
 
     expected = count_csv_rows(csv_path)
     print(f"Import expected: {expected}", file=sys.stderr)
@@ -212,7 +266,7 @@ def import_first_seen(redis_client, csv_file, batch_size, dry_run=False):
 
             rows.append({"uid": uid, "first_seen": first_seen})
             if len(rows) >= batch_size:
-                result = flush_import_batch(redis_client, rows, dry_run)
+                result = flush_import_batch(redis_client, rows, dry_run, compact)
                 updated += result["updated"]
                 missing += result["missing"]
                 rows = []
@@ -224,7 +278,7 @@ def import_first_seen(redis_client, csv_file, batch_size, dry_run=False):
                     file=sys.stderr,
                 )
 
-    result = flush_import_batch(redis_client, rows, dry_run)
+    result = flush_import_batch(redis_client, rows, dry_run, compact)
     updated += result["updated"]
     missing += result["missing"]
 
@@ -53,19 +53,24 @@ REBUILD_KEY_PATTERNS = [
 ]
 
 DEFAULT_BATCH_SIZE = 1000
+DEFAULT_IN_FLIGHT_BATCHES = 2
 DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) - 1)
 PROGRESS_EVERY = 1000
 config = {}
 KVROCKS_PORT = None
 KVROCKS_HOST = None
 BATCH_SIZE = DEFAULT_BATCH_SIZE
+IN_FLIGHT_BATCHES = DEFAULT_IN_FLIGHT_BATCHES
 PARSER_CONF = {}
 KVrocksIndexer = None
 parse_json = None
+hostname_cache_stats = None
+format_hostname_cache_stats = None
 fetch_tlds = None
 TAG_RUNTIME = {}
 WORKER_SEEN_SNAPSHOT = None
 WORKER_TAG_RULES = None
+WORKER_HOSTNAME_CACHE_STATS = {}
 STOP_REQUESTED = False
 
 
@@ -107,7 +112,8 @@ def load_config():
     """
     Load tool config after CLI parsing, so help can run without side effects.
     """
-    global config, KVROCKS_PORT, KVROCKS_HOST, BATCH_SIZE, PARSER_CONF
+    global config, KVROCKS_PORT, KVROCKS_HOST, BATCH_SIZE, IN_FLIGHT_BATCHES
+    global PARSER_CONF
 
     import yaml  # pylint: disable=import-outside-toplevel
 
@@ -117,6 +123,9 @@ def load_config():
     KVROCKS_PORT = config.get("OUT_KVROCKS_PORT")
     KVROCKS_HOST = config.get("OUT_KVROCKS_HOST")
     BATCH_SIZE = int(config.get("KVROCKS_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+    IN_FLIGHT_BATCHES = int(
+        config.get("KVROCKS_IN_FLIGHT_BATCHES", DEFAULT_IN_FLIGHT_BATCHES)
+    )
     PARSER_CONF = {
         "ONLINETLD": config.get("ONLINETLD", config.get("PARSER_ONLINETLD", False)),
         "TLDS": [],
@@ -130,6 +139,7 @@ def load_runtime_dependencies(retag=False):
     Import runtime dependencies after help handling.
     """
     global KVrocksIndexer, TAG_RUNTIME, parse_json, fetch_tlds
+    global hostname_cache_stats, format_hostname_cache_stats
 
     if retag:
         sys.path.insert(0, str(WEBAPP_DIR))
@@ -143,6 +153,8 @@ def load_runtime_dependencies(retag=False):
             fetch_tlds as runtime_fetch_tlds,
         )
         from app.utils.result_parser import (  # pylint: disable=import-outside-toplevel
+            format_hostname_cache_stats as runtime_format_hostname_cache_stats,
+            hostname_cache_stats as runtime_hostname_cache_stats,
             parse_json as runtime_parse_json,
         )
         from app.utils.tagrules import (  # pylint: disable=import-outside-toplevel
@@ -163,6 +175,8 @@ def load_runtime_dependencies(retag=False):
             fetch_tlds as runtime_fetch_tlds,
         )
         from result_parser import (  # pylint: disable=import-outside-toplevel
+            format_hostname_cache_stats as runtime_format_hostname_cache_stats,
+            hostname_cache_stats as runtime_hostname_cache_stats,
             parse_json as runtime_parse_json,
         )
 
@@ -170,6 +184,8 @@ def load_runtime_dependencies(retag=False):
 
     KVrocksIndexer = RuntimeKVrocksIndexer
     parse_json = runtime_parse_json
+    hostname_cache_stats = runtime_hostname_cache_stats
+    format_hostname_cache_stats = runtime_format_hostname_cache_stats
     fetch_tlds = runtime_fetch_tlds
 
 
@@ -268,36 +284,61 @@ def init_parse_worker(parser_conf, seen_snapshot, tag_rules):
 def parse_json_file_worker(json_file):
     """
     Parse one JSON dump file in a worker process.
+
+    Also returns the worker pid and hostname cache counters.
     """
+    parsed_doc, error = None, None
     try:
-        return (
-            json_import(
-                json_file,
-                seen_snapshot=WORKER_SEEN_SNAPSHOT,
-                tag_rules=WORKER_TAG_RULES,
-            ),
-            None,
+        parsed_doc = json_import(
+            json_file,
+            seen_snapshot=WORKER_SEEN_SNAPSHOT,
+            tag_rules=WORKER_TAG_RULES,
         )
-    except Exception as error:  # pylint: disable=broad-except
-        return None, f"[WARN] Unable to parse {json_file}: {error}"
+    except Exception as parse_error:  # pylint: disable=broad-except
+        error = f"[WARN] Unable to parse {json_file}: {parse_error}"
+    return parsed_doc, error, (os.getpid(), hostname_cache_stats())
 
 
 def parse_meili_document_worker(meili_doc):
     """
     Parse one Meilisearch document in a worker process.
+
+    Also returns the worker pid and hostname cache counters.
     """
+    parsed_doc, error = None, None
     try:
-        return (
-            parse_meili_document(
-                meili_doc,
-                seen_snapshot=WORKER_SEEN_SNAPSHOT,
-                tag_rules=WORKER_TAG_RULES,
-            ),
-            None,
+        parsed_doc = parse_meili_document(
+            meili_doc,
+            seen_snapshot=WORKER_SEEN_SNAPSHOT,
+            tag_rules=WORKER_TAG_RULES,
         )
-    except Exception as error:  # pylint: disable=broad-except
+    except Exception as parse_error:  # pylint: disable=broad-except
         doc_id = dict(meili_doc).get("id", "<unknown>")
-        return None, f"[WARN] Unable to parse Meili document {doc_id}: {error}"
+        error = f"[WARN] Unable to parse Meili document {doc_id}: {parse_error}"
+    return parsed_doc, error, (os.getpid(), hostname_cache_stats())
+
+
+def iter_worker_results(results):
+    """
+    Yield (parsed_doc, error) from worker results, keeping the latest
+    hostname cache counters of each worker.
+    """
+    for parsed_doc, error, (pid, cache_stats) in results:
+        WORKER_HOSTNAME_CACHE_STATS[pid] = cache_stats
+        yield parsed_doc, error
+
+
+def print_hostname_cache_stats():
+    """
+    Print the hostname cache counters summed over this process and workers.
+    """
+    totals = dict(hostname_cache_stats())
+    for pid, cache_stats in WORKER_HOSTNAME_CACHE_STATS.items():
+        if pid == os.getpid():
+            continue
+        for key in ("hits", "misses", "size"):
+            totals[key] += cache_stats[key]
+    print(format_hostname_cache_stats(totals), flush=True)
 
 
 def apply_seen_snapshot(parsed_doc, seen_snapshot):
@@ -449,7 +490,7 @@ def clean_tag_indexes(indexer):
     """
     print("Deleting existing Plum Kvrocks tag indexes", flush=True)
     deleted = 0
-    for pattern in ("tag:*", "tags:*"):
+    for pattern in ("tag:*", "tags:*", "vals:tag", indexer.FINGERPRINTS_KEY):
         deleted_for_pattern = delete_keys_by_pattern(indexer.r, pattern)
         deleted += deleted_for_pattern
         if deleted_for_pattern:
@@ -464,24 +505,32 @@ def rebuild_kvrocks(indexer, include_tags=False):
 
     Rebuilds keep doc:{uid} hashes in place so add_documents_batch() can merge
     first_seen/last_seen per batch. This avoids the slow full doc:* timestamp
-    snapshot on large Kvrocks datasets.
+    snapshot on large Kvrocks datasets. With compact timestamp storage the
+    seen sorted sets hold the timestamps and are preserved instead.
     """
-    print(
-        "Deleting known Plum Kvrocks index keys while preserving doc:{uid} hashes",
-        flush=True,
-    )
-    deleted = indexer.r.delete(
-        "all_ips",
-        "all_uids",
-        "first_seen_index",
-        "last_seen_index",
-    )
+    fixed_keys = ["all_ips", "all_uids", indexer.FINGERPRINTS_KEY]
+    if indexer.uses_compact_timestamps():
+        print(
+            "Deleting known Plum Kvrocks index keys while preserving "
+            "first_seen_index/last_seen_index",
+            flush=True,
+        )
+    else:
+        print(
+            "Deleting known Plum Kvrocks index keys while preserving doc:{uid} hashes",
+            flush=True,
+        )
+        fixed_keys.extend(["first_seen_index", "last_seen_index"])
+    deleted = indexer.r.delete(*fixed_keys)
     patterns = list(REBUILD_KEY_PATTERNS)
     for field in INDEX_FIELDS:
         if field == "tag" and not include_tags:
             continue
         patterns.append(f"{field}:*")
         patterns.append(f"{field}s:*")
+        patterns.append(f"vals:{field}")
+        patterns.append(f"tri:{field}:*")
+        patterns.append(f"tri_long:{field}")
 
     for pattern in patterns:
         deleted_for_pattern = delete_keys_by_pattern(indexer.r, pattern)
@@ -540,6 +589,15 @@ def parse_args(argv=None):
         default=None,
         help="Number of parsed documents to send per Kvrocks batch.",
     )
+    parser.add_argument(
+        "--in-flight-batches",
+        type=int,
+        default=None,
+        help=(
+            "Kvrocks batches read or written at once, bounds memory use. "
+            f"Default: KVROCKS_IN_FLIGHT_BATCHES or {DEFAULT_IN_FLIGHT_BATCHES}."
+        ),
+    )
     parser.add_argument(
         "--workers",
         type=int,
@@ -558,6 +616,8 @@ def parse_args(argv=None):
         parser.error("--retag requires --rebuild or --rebuild-from-meili")
     if args.workers < 1:
         parser.error("--workers must be >= 1")
+    if args.in_flight_batches is not None and args.in_flight_batches < 1:
+        parser.error("--in-flight-batches must be >= 1")
     return args
 
 
@@ -578,70 +638,75 @@ def index_parsed_documents(
     progress_label,
     total_count=None,
     include_tags=False,
+    in_flight_batches=None,
 ):
     """
     Index a stream of already parsed Kvrocks documents.
+
+    Batches go through a Kvrocks ingest stream, so parsing and the read phase
+    of the next batch overlap the write of the previous one.
     """
-    objects_to_index = []
     processed_count = 0
-    indexed_count = 0
+    if in_flight_batches is None:
+        in_flight_batches = IN_FLIGHT_BATCHES
 
-    try:
-        for parsed_doc in parsed_documents:
+    def counted_documents():
+        nonlocal processed_count
+        try:
+            for parsed_doc in parsed_documents:
+                if STOP_REQUESTED:
+                    break
+                processed_count += 1
+                if processed_count % PROGRESS_EVERY == 0:
+                    print(
+                        f"Processed "
+                        f"{format_progress_count(processed_count, total_count)} "
+                        f"{progress_label}",
+                        flush=True,
+                    )
+                yield parsed_doc
+                if STOP_REQUESTED:
+                    break
+        except KeyboardInterrupt:
             if STOP_REQUESTED:
-                break
-
-            processed_count += 1
-            objects_to_index.append(parsed_doc)
-
-            if processed_count % PROGRESS_EVERY == 0:
-                print(
-                    f"Processed {format_progress_count(processed_count, total_count)} "
-                    f"{progress_label}; "
-                    f"indexed={format_progress_count(indexed_count, total_count)}; "
-                    f"pending_batch={len(objects_to_index)}",
-                    flush=True,
-                )
+                raise
+            request_graceful_stop(None, None)
 
-            if len(objects_to_index) >= batch_size:
-                print(
-                    f"Indexing batch of {len(objects_to_index)} documents...",
-                    flush=True,
-                )
-                indexer.add_documents_batch(objects_to_index, include_tags=include_tags)
-                indexed_count += len(objects_to_index)
-                print(
-                    f"Indexed {format_progress_count(indexed_count, total_count)} "
-                    "documents",
-                    flush=True,
-                )
-                objects_to_index = []
-
-            if STOP_REQUESTED:
-                break
-    except KeyboardInterrupt:
         if STOP_REQUESTED:
-            raise
-        request_graceful_stop(None, None)
+            close_iterator = getattr(parsed_documents, "close", None)
+            if close_iterator:
+                close_iterator()
+            print(
+                "Graceful stop requested; flushing parsed pending documents.",
+                file=sys.stderr,
+                flush=True,
+            )
 
-    if STOP_REQUESTED:
-        close_iterator = getattr(parsed_documents, "close", None)
-        if close_iterator:
-            close_iterator()
+    def print_progress(stats):
         print(
-            "Graceful stop requested; flushing parsed pending documents.",
-            file=sys.stderr,
+            f"Indexed {format_progress_count(stats['documents'], total_count)} "
+            f"documents; reindexed={stats['reindexed']} "
+            f"seen_only={stats['seen_only']} unchanged={stats['unchanged']} "
+            f"docs/s={stats['docs_per_second']} read_ms={stats['read_ms']} "
+            f"write_ms={stats['write_ms']}",
             flush=True,
         )
 
-    if objects_to_index:
-        print(
-            f"Indexing final batch of {len(objects_to_index)} documents...", flush=True
-        )
-        indexer.add_documents_batch(objects_to_index, include_tags=include_tags)
-        indexed_count += len(objects_to_index)
-
-    return processed_count, indexed_count
+    stats = indexer.index_documents_stream(
+        counted_documents(),
+        batch_size=batch_size,
+        include_tags=include_tags,
+        max_in_flight_batches=in_flight_batches,
+        progress=print_progress,
+    )
+    print(
+        f"Ingest: docs/s={stats['docs_per_second']} batches={stats['batches']} "
+        f"read_ms={stats['read_ms']} (max {stats['read_ms_max']}) "
+        f"write_ms={stats['write_ms']} (max {stats['write_ms_max']}) "
+        f"wait_ms={stats['wait_ms']}",
+        flush=True,
+    )
+    return processed_count, stats["documents"]
 
 
 def multiprocessing_chunksize(batch_size, workers):
@@ -673,10 +738,12 @@ def parsed_documents_from_files(
             initializer=init_parse_worker,
             initargs=(PARSER_CONF, seen_snapshot, tag_rules),
         ) as pool:
-            yield from pool.imap_unordered(
-                parse_json_file_worker,
-                iter_json_files(input_dir),
-                chunksize=chunksize,
+            yield from iter_worker_results(
+                pool.imap_unordered(
+                    parse_json_file_worker,
+                    iter_json_files(input_dir),
+                    chunksize=chunksize,
+                )
             )
         return
 
@@ -731,10 +798,12 @@ def parsed_documents_from_meili(
             for page in iter_meili_pages(
                 index, batch_size, first_results=first_results
             ):
-                yield from pool.imap_unordered(
-                    parse_meili_document_worker,
-                    page,
-                    chunksize=chunksize,
+                yield from iter_worker_results(
+                    pool.imap_unordered(
+                        parse_meili_document_worker,
+                        page,
+                        chunksize=chunksize,
+                    )
                 )
         return
 
@@ -758,6 +827,7 @@ def index_documents_with_errors(
     progress_label,
     total_count=None,
     include_tags=False,
+    in_flight_batches=None,
 ):
     """
     Index parsed documents while counting parse errors from the source iterator.
@@ -787,6 +857,7 @@ def index_documents_with_errors(
         progress_label,
         total_count=total_count,
         include_tags=include_tags,
+        in_flight_batches=in_flight_batches,
     )
     return processed_count + error_count, indexed_count, error_count
 
@@ -802,6 +873,8 @@ def main():
     load_config()
     if args.batch_size is None:
         args.batch_size = BATCH_SIZE
+    if args.in_flight_batches is None:
+        args.in_flight_batches = IN_FLIGHT_BATCHES
     load_runtime_dependencies(retag=args.retag)
     suppress_connection_debug_logs()
 
@@ -816,6 +889,9 @@ def main():
         PARSER_CONF["TLDS"] = fetch_tlds()
     else:
         PARSER_CONF["TLDS"] = config.get("TLDS", config.get("PARSER_TLDS", []))
+    # Sets, so suffix checks do not scan the TLD list for every hostname.
+    PARSER_CONF["TLDS"] = frozenset(PARSER_CONF["TLDS"] or ())
+    PARSER_CONF["TLDADD"] = frozenset(PARSER_CONF["TLDADD"] or ())
     PARSER_CONF["HTTP_HEADER_COLLECTION"] = load_collected_header_collection()
 
     if args.retag:
@@ -877,6 +953,7 @@ def main():
         progress_label,
         total_count=total_count,
         include_tags=args.retag,
+        in_flight_batches=args.in_flight_batches,
     )
 
     print(
@@ -884,6 +961,7 @@ def main():
         f"processed={processed_count} indexed={indexed_count} errors={error_count}",
         flush=True,
     )
+    print_hostname_cache_stats()
     if STOP_REQUESTED:
         raise SystemExit(130)
 
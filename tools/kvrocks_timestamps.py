@@ -0,0 +1,202 @@
+#!/bin/env python
+"""
+Switch Kvrocks document timestamps between hash and compact storage.
+
+The hash storage keeps first_seen/last_seen in doc:{uid} hashes and in the
+first_seen_index/last_seen_index sorted sets. The compact storage keeps them
+in the sorted sets only and drops doc:{uid}, the IP stays in uid:{uid}.
+
+Stop the web application and the scheduler before switching.
+"""
+
+import argparse
+from pathlib import Path
+import sys
+
+import yaml
+
+BASE_DIR = Path(__file__).resolve().parent
+UTILS_DIR = BASE_DIR.parent / "webapp" / "app" / "utils"
+sys.path.append(str(UTILS_DIR))
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def load_config():
+    """
+    Load tool config without requiring the caller's working directory.
+    """
+    with open(BASE_DIR / "config.yaml", "r", encoding="utf-8") as config_file:
+        return yaml.safe_load(config_file) or {}
+
+
+def parse_args(argv=None):
+    """
+    Parse CLI options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Switch Kvrocks timestamps between hash and compact storage."
+    )
+    parser.add_argument(
+        "--target",
+        choices=("in", "out"),
+        default="out",
+        help="Kvrocks endpoint from tools/config.yaml. Default: out.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Documents per pipeline. Default: {DEFAULT_BATCH_SIZE}.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Keep timestamps in the seen sorted sets only and drop doc:{uid}.",
+    )
+    compact_parser.add_argument(
+        "--keep-hashes",
+        action="store_true",
+        help="Switch the storage mode but leave doc:{uid} hashes in place.",
+    )
+    subparsers.add_parser(
+        "expand",
+        help="Rebuild doc:{uid} hashes from the seen sorted sets and uid:{uid}.",
+    )
+    subparsers.add_parser("status", help="Show the timestamp storage mode.")
+    return parser.parse_args(argv)
+
+
+def connect_indexer(config, endpoint):
+    """
+    Return a KVrocksIndexer for the IN or OUT endpoint.
+    """
+    from kvrocks import KVrocksIndexer  # pylint: disable=import-outside-toplevel
+
+    prefix = "OUT" if endpoint == "out" else "IN"
+    kvrocks_host = config.get(f"{prefix}_KVROCKS_HOST", "localhost")
+    kvrocks_port = config.get(f"{prefix}_KVROCKS_PORT", 6666)
+    return KVrocksIndexer(kvrocks_host, kvrocks_port)
+
+
+def iter_batches(items, batch_size):
+    """
+    Yield lists of batch_size items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def compact(indexer, batch_size, keep_hashes=False):
+    """
+    Copy doc:{uid} timestamps into the seen sorted sets, switch to compact
+    storage, then delete the doc:{uid} hashes.
+    """
+    doc_keys = indexer.r.scan_iter(match="doc:*", count=batch_size)
+    copied = 0
+    for keys in iter_batches(doc_keys, batch_size):
+        pipe = indexer.r.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "first_seen", "last_seen")
+        write_pipe = indexer.r.pipeline(transaction=False)
+        for key, (first_seen, last_seen) in zip(keys, pipe.execute()):
+            first_seen, last_seen = indexer.normalize_seen_range(first_seen, last_seen)
+            if first_seen is None:
+                continue
+            uid = key.split("doc:", 1)[1]
+            write_pipe.zadd("first_seen_index", {uid: first_seen})
+            write_pipe.zadd("last_seen_index", {uid: last_seen})
+            copied += 1
+        write_pipe.execute()
+        print(f"Copied {copied} document timestamps", flush=True)
+
+    indexer.r.set(indexer.TIMESTAMP_STORAGE_KEY, indexer.TIMESTAMP_STORAGE_COMPACT)
+    print("Timestamp storage switched to compact", flush=True)
+    if keep_hashes:
+        return
+
+    deleted = 0
+    doc_keys = indexer.r.scan_iter(match="doc:*", count=batch_size)
+    for keys in iter_batches(doc_keys, batch_size):
+        deleted += indexer.r.delete(*keys)
+        print(f"Deleted {deleted} doc:{{uid}} hashes", flush=True)
+    print(f"Compact timestamp storage ready, deleted={deleted}", flush=True)
+
+
+def expand(indexer, batch_size):
+    """
+    Rebuild doc:{uid} hashes from the seen sorted sets, then switch back to
+    hash storage.
+    """
+    uids = (
+        uid
+        for uid, _score in indexer.r.zscan_iter("first_seen_index", count=batch_size)
+    )
+    written = 0
+    orphans = 0
+    for batch in iter_batches(uids, batch_size):
+        seen_ranges = indexer._read_seen_ranges(  # pylint: disable=protected-access
+            batch, compact=True
+        )
+        ips = indexer.r.mget([f"uid:{uid}" for uid in batch])
+        pipe = indexer.r.pipeline(transaction=False)
+        for uid, ip, (first_seen, last_seen) in zip(batch, ips, seen_ranges):
+            first_seen, last_seen = indexer.normalize_seen_range(first_seen, last_seen)
+            if not ip or first_seen is None:
+                orphans += 1
+                continue
+            pipe.hset(
+                f"doc:{uid}",
+                mapping={
+                    "ip": ip,
+                    "first_seen": str(first_seen),
+                    "last_seen": str(last_seen),
+                },
+            )
+            written += 1
+        pipe.execute()
+        print(f"Wrote {written} doc:{{uid}} hashes, skipped={orphans}", flush=True)
+
+    indexer.r.delete(indexer.TIMESTAMP_STORAGE_KEY)
+    print(
+        f"Timestamp storage switched to hash, written={written} skipped={orphans}",
+        flush=True,
+    )
+
+
+def print_status(indexer, batch_size):
+    """
+    Print storage mode, seen index sizes and remaining doc:{uid} hashes.
+    """
+    doc_count = sum(1 for _key in indexer.r.scan_iter(match="doc:*", count=batch_size))
+    print(f"storage={indexer.get_timestamp_storage()}")
+    print(f"first_seen_index={indexer.r.zcard('first_seen_index')}")
+    print(f"last_seen_index={indexer.r.zcard('last_seen_index')}")
+    print(f"doc_hashes={doc_count}")
+
+
+def main(argv=None):
+    """
+    CLI entrypoint.
+    """
+    args = parse_args(argv)
+    if args.batch_size <= 0:
+        raise SystemExit("--batch-size must be positive")
+    indexer = connect_indexer(load_config(), args.target)
+
+    if args.command == "compact":
+        compact(indexer, args.batch_size, keep_hashes=args.keep_hashes)
+    elif args.command == "expand":
+        expand(indexer, args.batch_size)
+    elif args.command == "status":
+        print_status(indexer, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
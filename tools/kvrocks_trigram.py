@@ -0,0 +1,287 @@
+#!/bin/env python
+"""
+Manage the optional Kvrocks trigram index used by .like searches.
+
+The index maps each 3-character gram of a field value to the values holding
+it (tri:{field}:{gram}). It is only worth its memory on high-cardinality text
+fields, so it is enabled per field.
+"""
+
+import argparse
+from pathlib import Path
+import sys
+import time
+
+import yaml
+
+BASE_DIR = Path(__file__).resolve().parent
+UTILS_DIR = BASE_DIR.parent / "webapp" / "app" / "utils"
+sys.path.append(str(UTILS_DIR))
+
+DEFAULT_TRIGRAM_FIELDS = ["banner", "http_title", "x509_subject", "http_headval"]
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BENCHMARK_REPEAT = 5
+
+
+def load_config():
+    """
+    Load tool config without requiring the caller's working directory.
+    """
+    with open(BASE_DIR / "config.yaml", "r", encoding="utf-8") as config_file:
+        return yaml.safe_load(config_file) or {}
+
+
+def parse_args(argv=None):
+    """
+    Parse CLI options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Build, drop, inspect or benchmark Kvrocks trigram indexes."
+    )
+    parser.add_argument(
+        "--target",
+        choices=("in", "out"),
+        default="out",
+        help="Kvrocks endpoint from tools/config.yaml. Default: out.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser(
+        "build",
+        help="Build trigram indexes from the vals:{field} dictionaries.",
+    )
+    build_parser.add_argument(
+        "fields",
+        nargs="*",
+        help=(
+            "Fields to index. Default: KVROCKS_TRIGRAM_FIELDS from "
+            f"tools/config.yaml, else {', '.join(DEFAULT_TRIGRAM_FIELDS)}."
+        ),
+    )
+    build_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Values per pipeline. Default: {DEFAULT_BATCH_SIZE}.",
+    )
+
+    drop_parser = subparsers.add_parser(
+        "drop", help="Drop trigram indexes and stop maintaining them."
+    )
+    drop_parser.add_argument("fields", nargs="+", help="Fields to drop.")
+
+    subparsers.add_parser("status", help="Show trigram index state per field.")
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark",
+        help="Compare one .like lookup through trigrams and through the scan path.",
+    )
+    benchmark_parser.add_argument("field", help="Indexed field, e.g. banner.")
+    benchmark_parser.add_argument(
+        "value",
+        help="Substring to search. For http_headval use header:value.",
+    )
+    benchmark_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_BENCHMARK_REPEAT,
+        help=f"Runs per lookup path. Default: {DEFAULT_BENCHMARK_REPEAT}.",
+    )
+    benchmark_parser.add_argument(
+        "--keyspace-scan",
+        action="store_true",
+        help="Also time the legacy SCAN {field}:* path, slow on big indexes.",
+    )
+    return parser.parse_args(argv)
+
+
+def connect_indexer(config, endpoint):
+    """
+    Return a KVrocksIndexer for the IN or OUT endpoint.
+    """
+    from kvrocks import KVrocksIndexer  # pylint: disable=import-outside-toplevel
+
+    prefix = "OUT" if endpoint == "out" else "IN"
+    kvrocks_host = config.get(f"{prefix}_KVROCKS_HOST", "localhost")
+    kvrocks_port = config.get(f"{prefix}_KVROCKS_PORT", 6666)
+    return KVrocksIndexer(kvrocks_host, kvrocks_port)
+
+
+def delete_keys_by_pattern(redis_client, pattern, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete keys matching one pattern without blocking on KEYS.
+    """
+    deleted = 0
+    batch = []
+    for key in redis_client.scan_iter(match=pattern, count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += redis_client.delete(*batch)
+            batch = []
+    if batch:
+        deleted += redis_client.delete(*batch)
+    return deleted
+
+
+def drop_field(indexer, field):
+    """
+    Remove one field trigram postings and its state entry.
+    """
+    indexer.r.hdel(indexer.TRIGRAM_FIELDS_KEY, field)
+    deleted = delete_keys_by_pattern(indexer.r, f"tri:{field}:*")
+    deleted += indexer.r.delete(f"tri_long:{field}")
+    return deleted
+
+
+def build_field(indexer, field, batch_size):
+    """
+    Rebuild one field trigram postings from vals:{field}.
+
+    The field is flagged building first so concurrent indexing keeps the
+    postings up to date, searches use it only once it is flagged ready.
+    """
+    # pylint: disable=protected-access
+    if not indexer._has_value_index(field):
+        print(
+            f"Skip {field}: vals:{field} is not ready, run migration 18 first",
+            flush=True,
+        )
+        return 0
+
+    drop_field(indexer, field)
+    indexer.r.hset(indexer.TRIGRAM_FIELDS_KEY, field, "building")
+
+    indexed = 0
+    batch = []
+    for value in indexer._iter_value_index_prefix(field):
+        batch.append(value)
+        if len(batch) >= batch_size:
+            indexer.add_trigram_values(field, batch)
+            indexed += len(batch)
+            batch = []
+            print(f"{field}: indexed {indexed} values", flush=True)
+    if batch:
+        indexer.add_trigram_values(field, batch)
+        indexed += len(batch)
+
+    indexer.r.hset(indexer.TRIGRAM_FIELDS_KEY, field, "ready")
+    print(f"{field}: trigram index ready with {indexed} values", flush=True)
+    return indexed
+
+
+def print_status(indexer):
+    """
+    Print field,state,values,long_values lines.
+    """
+    states = indexer.r.hgetall(indexer.TRIGRAM_FIELDS_KEY)
+    if not states:
+        print("No trigram index configured")
+        return
+    print("field,state,values,long_values")
+    for field in sorted(states):
+        values = indexer.r.zcard(indexer.value_index_key(field))
+        long_values = indexer.r.scard(f"tri_long:{field}")
+        print(f"{field},{states[field]},{values},{long_values}")
+
+
+def time_lookup(lookup, repeat):
+    """
+    Run one lookup repeat times and return (best_ms, result_count).
+    """
+    best_ms = None
+    result_count = 0
+    for _ in range(max(repeat, 1)):
+        start_time = time.perf_counter()
+        result_count = len(list(lookup()))
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        best_ms = elapsed_ms if best_ms is None else min(best_ms, elapsed_ms)
+    return best_ms, result_count
+
+
+def benchmark(indexer, field, value, repeat, keyspace_scan=False):
+    """
+    Compare trigram, dictionary and optional keyspace scan .like lookups.
+    """
+    # pylint: disable=protected-access
+    field = str(field).strip().lower()
+    value = str(value).strip().lower()
+    prefix = ""
+    search_value = value
+    if field == "http_headval":
+        if ":" not in value:
+            raise SystemExit("http_headval benchmark expects header:value")
+        header_name, search_value = value.split(":", 1)
+        prefix = f"{header_name}:"
+
+    if indexer._get_trigram_matches(field, search_value, prefix) is None:
+        raise SystemExit(
+            f"No ready trigram index for {field} or value shorter than 3 characters"
+        )
+
+    def dictionary_lookup():
+        if not prefix:
+            return indexer._iter_value_index_substring(field, search_value)
+        return (
+            indexed_value
+            for indexed_value in indexer._iter_value_index_prefix(field, prefix)
+            if search_value in indexed_value[len(prefix) :]
+        )
+
+    def keyspace_lookup():
+        key_prefix = f"{field}:{prefix}"
+        return (
+            key
+            for key in indexer.r.scan_iter(match=f"{field}:*", count=1000)
+            if key.startswith(key_prefix) and search_value in key[len(key_prefix) :]
+        )
+
+    lookups = [
+        (
+            "trigram",
+            lambda: indexer._get_trigram_matches(field, search_value, prefix),
+        ),
+        ("dictionary", dictionary_lookup),
+    ]
+    if keyspace_scan:
+        lookups.append(("keyspace_scan", keyspace_lookup))
+
+    print("path,best_ms,values")
+    for label, lookup in lookups:
+        best_ms, result_count = time_lookup(lookup, repeat)
+        print(f"{label},{best_ms:.2f},{result_count}", flush=True)
+
+
+def main(argv=None):
+    """
+    CLI entrypoint.
+    """
+    args = parse_args(argv)
+    config = load_config()
+    indexer = connect_indexer(config, args.target)
+
+    if args.command == "build":
+        if args.batch_size <= 0:
+            raise SystemExit("--batch-size must be positive")
+        fields = args.fields or config.get("KVROCKS_TRIGRAM_FIELDS")
+        fields = fields or DEFAULT_TRIGRAM_FIELDS
+        for field in fields:
+            build_field(indexer, str(field).strip().lower(), args.batch_size)
+    elif args.command == "drop":
+        for field in args.fields:
+            field = str(field).strip().lower()
+            deleted = drop_field(indexer, field)
+            print(f"{field}: dropped {deleted} trigram keys", flush=True)
+    elif args.command == "status":
+        print_status(indexer)
+    elif args.command == "benchmark":
+        benchmark(
+            indexer,
+            args.field,
+            args.value,
+            args.repeat,
+            keyspace_scan=args.keyspace_scan,
+        )
+
+
+if __name__ == "__main__":
+    main()
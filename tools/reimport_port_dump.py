@@ -708,6 +708,10 @@ def rebuild_kvrocks_from_dump(input_dir, batch_size, workers, total_count):
     deleted_doc_keys = index_kvrocks.delete_keys_by_pattern(indexer.r, "doc:*")
     if deleted_doc_keys:
         print(f"Deleted {deleted_doc_keys} keys matching doc:*", flush=True)
+    if indexer.uses_compact_timestamps():
+        # Compact timestamp storage keeps the seen ranges in these sets only.
+        indexer.r.delete("first_seen_index", "last_seen_index")
+        print("Deleted first_seen_index and last_seen_index", flush=True)
 
     source_docs = index_kvrocks.parsed_documents_from_files(
         input_dir,
@@ -290,6 +290,12 @@ def get_original_seen_times(kvrocks_client, source_doc):
         return {}
 
     data = kvrocks_client.hgetall(f"doc:{source_id}") or {}
+    if not data:
+        # Compact timestamp storage has no doc:{uid} hash.
+        for field in ("first_seen", "last_seen"):
+            score = kvrocks_client.zscore(f"{field}_index", source_id)
+            if score is not None:
+                data[field] = str(int(score))
     return {
         "source_id": source_id,
         "first_seen": data.get("first_seen"),
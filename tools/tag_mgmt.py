@@ -343,6 +343,7 @@ def flush_kvrocks_tag(indexer, raw_tag, dry_run=False, quiet=False):
             if remaining_count == 0
         ]
         deleted = indexer.r.delete(*empty_keys) if empty_keys else 0
+        indexer.forget_fingerprints(uid_batch)
         return removed, deleted
 
     for uid in indexer.r.sscan_iter(tag_key, count=TAG_FLUSH_BATCH_SIZE):
@@ -359,6 +360,7 @@ def flush_kvrocks_tag(indexer, raw_tag, dry_run=False, quiet=False):
         summary["inverse_deleted"] += deleted
 
     summary["tag_key_deleted"] = indexer.r.delete(tag_key)
+    indexer.r.zrem(indexer.value_index_key("tag"), tag)
     if not quiet:
         print(
             f"DELETE {tag_key} "
@@ -645,6 +647,9 @@ def load_reindex_runtime():
     )
     from app.utils.mutils import fetch_tlds  # pylint: disable=import-outside-toplevel
     from app.utils.result_parser import (  # pylint: disable=import-outside-toplevel
+        format_hostname_cache_stats,
+        hostname_cache_stats,
+        normalize_db_conf,
         parse_json,
     )
     from app.utils.tagrules import (  # pylint: disable=import-outside-toplevel
@@ -660,6 +665,9 @@ def load_reindex_runtime():
         "KVrocksIndexer": KVrocksIndexer,
         "fetch_tlds": fetch_tlds,
         "parse_json": parse_json,
+        "normalize_db_conf": normalize_db_conf,
+        "hostname_cache_stats": hostname_cache_stats,
+        "format_hostname_cache_stats": format_hostname_cache_stats,
         "compile_tag_rule_records": compile_tag_rule_records,
     }
 
@@ -771,7 +779,7 @@ def flush_existing_tag_indexes(indexer, batch_size):
     Remove all Kvrocks tag indexes before a full tag rebuild.
     """
     total_deleted = 0
-    for pattern in ("tag:*", "tags:*"):
+    for pattern in ("tag:*", "tags:*", "vals:tag", indexer.FINGERPRINTS_KEY):
         print(f"Flushing existing Kvrocks keys matching {pattern}", flush=True)
         deleted = delete_keys_by_pattern(indexer.r, pattern, batch_size)
         total_deleted += deleted
@@ -858,6 +866,9 @@ def reindex_tags(args):
     KVrocksIndexer = runtime["KVrocksIndexer"]
     fetch_tlds = runtime["fetch_tlds"]
     parse_json = runtime["parse_json"]
+    normalize_db_conf = runtime["normalize_db_conf"]
+    hostname_cache_stats = runtime["hostname_cache_stats"]
+    format_hostname_cache_stats = runtime["format_hostname_cache_stats"]
     compile_tag_rule_records = runtime["compile_tag_rule_records"]
 
     with app.app_context():
@@ -869,6 +880,8 @@ def reindex_tags(args):
             CollectedHeaders,
             ensure_default_collected_headers,
         )
+        # Normalized once, TLD lists become sets for every document.
+        parser_config = normalize_db_conf(app.config)
 
         active_rules = (
             db.session.query(TagRules)
@@ -928,7 +941,9 @@ def reindex_tags(args):
             processed_docs += 1
 
             try:
-                parsed_doc = parse_json(meili_doc, app.config, tag_rules=compiled_rules)
+                parsed_doc = parse_json(
+                    meili_doc, parser_config, tag_rules=compiled_rules
+                )
                 pending_docs.append(
                     {
                         "uid": parsed_doc["uid"],
@@ -959,6 +974,7 @@ def reindex_tags(args):
             f"processed={processed_docs}; updated={updated_docs}; errors={error_docs}",
             flush=True,
         )
+        print(format_hostname_cache_stats(hostname_cache_stats()), flush=True)
 
 
 def list_tags(args):
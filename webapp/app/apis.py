@@ -11,6 +11,7 @@ This module contains all code related to API's.
 # pylint: disable=too-many-lines
 
 import base64
+from datetime import timedelta
 import hashlib
 import os
 import json
@@ -22,10 +23,14 @@ from flask_appbuilder.api import API_RESULT_RES_KEY, BaseApi, expose, safe, prot
 from flask_appbuilder.filemanager import FileManager
 from flask import request
 
-from sqlalchemy import func, distinct
+import redis
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError, NoResultFound
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
 from werkzeug.security import check_password_hash
-from marshmallow import Schema, fields, validates, ValidationError
+from werkzeug.wsgi import get_input_stream
+from marshmallow import Schema, fields, validate, validates, ValidationError
 from .models import (
     Targets,
     Bots,
@@ -34,16 +39,45 @@ from .models import (
     Nses,
     Ports,
     Protos,
-    TargetScanStates,
-    assoc_jobs_targets,
 )
 from . import appbuilder, db
+from .utils.export_queue import get_export_queue
+from .utils.job_dispatcher import get_job_dispatcher
+from .utils.job_leases import compute_lease_seconds, extend_job_leases
+from .utils.result_storage import (
+    DEFAULT_MAX_RESULT_BYTES,
+    ResultTooLarge,
+    decode_body,
+    normalize_encoding,
+    store_result_stream,
+    write_result,
+)
 from .utils.mutils import is_valid_uuid, is_valid_ip, get_country, flat_marsh_error
 from .utils.timeutils import utcnow_naive, ensure_utc_naive
-from .utils.scan_cycles import reconcile_scanprofile_cycle
+from .utils.scan_cycles import complete_job_in_cycle
 from .views import TargetsView
 
 
+class JobResultSchema(Schema):
+    """
+    Schema for one job result of a batched sndjob query
+    """
+
+    JOB_UID = fields.String(required=True, metadata={"description": "Uid of the scan"})
+    RESULT = fields.String(
+        required=False,
+        metadata={"description": "Result of scan"},
+    )
+
+    @validates("JOB_UID")
+    def validate_job_uid(self, value, **_kwargs):
+        """
+        JOB_UID Validation
+        """
+        if len(value) != 36 or not is_valid_uuid(value):
+            raise ValidationError("Invalid JOB_UID")
+
+
 class BotInfoSchema(Schema):
     """
     Schema for the BOT beaconing query
@@ -84,6 +118,22 @@ class BotInfoSchema(Schema):
         values=fields.String(),
         metadata={"description": "Cached NSE SHA256 hashes keyed by NSE filename"},
     )
+    MAX_JOBS = fields.Integer(
+        required=False,
+        validate=validate.Range(min=1),
+        metadata={"description": "Jobs the agent can run at once"},
+    )
+    JOBS = fields.List(
+        fields.Nested(JobResultSchema),
+        required=False,
+        metadata={"description": "Results of several scans"},
+    )
+    RUNNING_JOBS = fields.List(
+        fields.String(),
+        required=False,
+        validate=validate.Length(max=256),
+        metadata={"description": "Uids of the scans the agent is still running"},
+    )
 
     # Custom validator for the parameters
     @validates("UID")
@@ -102,6 +152,15 @@ class BotInfoSchema(Schema):
         if len(value) != 36 or not is_valid_uuid(value):
             raise ValidationError("Invalid JOB_UID")
 
+    @validates("RUNNING_JOBS")
+    def validate_running_jobs(self, value, **_kwargs):
+        """
+        RUNNING_JOBS Validation
+        """
+        for job_uid in value:
+            if len(job_uid) != 36 or not is_valid_uuid(job_uid):
+                raise ValidationError("Invalid RUNNING_JOBS")
+
     @validates("EXT_IP")
     def validate_ext_ip(self, value, **_kwargs):
         """
@@ -159,6 +218,10 @@ PRIORITY_WEIGHTS = {
     0: 5,
 }
 MIN_JOB_RUNTIME_SECONDS = 1.0
+# Bound on the ids popped per claimed job, stale ids included.
+MAX_DISPATCH_POPS = 32
+DEFAULT_SNDJOB_MAX_UPLOAD_BYTES = 256 * 1024 * 1024
+DEFAULT_GETJOB_MAX_JOBS_PER_BOT = 8
 
 
 def _nse_file_path(nse):
@@ -180,6 +243,123 @@ def _get_bot_by_uid(bot_uid):
     )
 
 
+def _get_sndjob_limits():
+    """
+    Return the (request bytes, decoded result bytes) limits of sndjob.
+    """
+    return (
+        int(
+            db.app.config.get(
+                "SNDJOB_MAX_UPLOAD_BYTES", DEFAULT_SNDJOB_MAX_UPLOAD_BYTES
+            )
+        ),
+        int(db.app.config.get("SNDJOB_MAX_RESULT_BYTES", DEFAULT_MAX_RESULT_BYTES)),
+    )
+
+
+def _get_max_jobs_per_bot():
+    """
+    Return the number of active jobs one bot can hold through getjob batches.
+    """
+    return int(
+        db.app.config.get("GETJOB_MAX_JOBS_PER_BOT", DEFAULT_GETJOB_MAX_JOBS_PER_BOT)
+    )
+
+
+def _count_active_jobs(bot_id, exclude_job_id=None):
+    """
+    Return the number of active jobs leased to one bot.
+    """
+    query = db.session.query(func.count(Jobs.id)).filter(
+        Jobs.bot_id == bot_id, Jobs.active == True
+    )
+    if exclude_job_id is not None:
+        query = query.filter(Jobs.id != exclude_job_id)
+    return query.scalar() or 0
+
+
+def _load_sndjob_request(max_upload_bytes, max_result_bytes):
+    """
+    Return the sndjob metadata and the uploaded result files, if any.
+
+    Agents either post one JSON document holding RESULT, optionally with a
+    gzip or zstd Content-Encoding, or a multipart/form-data request with the
+    metadata JSON in a `metadata` field and the result file in a `result`
+    part, or in `result.<JOB_UID>` parts for a JOBS batch. Werkzeug spools
+    multipart files to disk, so the results are never held in memory. Both
+    paths stop reading after max_upload_bytes, chunked requests included.
+    """
+    if request.mimetype == "multipart/form-data":
+        _stream, form, files = parse_form_data(
+            request.environ, max_content_length=max_upload_bytes
+        )
+        data = json.loads(form.get("metadata") or "{}")
+        return data, files
+
+    body = decode_body(
+        get_input_stream(request.environ, max_content_length=max_upload_bytes),
+        request.content_encoding,
+        max_result_bytes,
+    )
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        data = json.loads(data)  # Convert to Dict (for content type missing requests)
+    return data, {}
+
+
+def _get_sndjob_results(botinfo, files):
+    """
+    Return [(job uid, RESULT, result upload, upload format)] of a sndjob.
+
+    A JOBS list completes several jobs in one request, otherwise the single
+    JOB_UID/RESULT of former agents is used.
+    """
+    if botinfo.get("JOBS") is not None:
+        entries = [
+            (
+                entry["JOB_UID"],
+                entry.get("RESULT"),
+                files.get(f"result.{entry['JOB_UID']}"),
+            )
+            for entry in botinfo["JOBS"]
+        ]
+    else:
+        entries = [(botinfo.get("JOB_UID"), botinfo.get("RESULT"), files.get("result"))]
+    return [
+        (
+            job_uid,
+            result_payload,
+            result_upload,
+            (
+                _get_result_upload_format(result_upload)
+                if result_upload is not None
+                else None
+            ),
+        )
+        for job_uid, result_payload, result_upload in entries
+    ]
+
+
+def _get_result_upload_format(result_upload):
+    """
+    Return the (content encoding, is NDJSON) of an uploaded result file.
+
+    The encoding comes from the part Content-Encoding header, else from the
+    .gz/.zst file name suffix.
+    """
+    filename = (result_upload.filename or "").lower()
+    content_encoding = result_upload.headers.get("Content-Encoding")
+    if not content_encoding:
+        if filename.endswith(".gz"):
+            content_encoding = "gzip"
+        elif filename.endswith(".zst"):
+            content_encoding = "zstd"
+    is_ndjson = (
+        result_upload.mimetype == "application/x-ndjson" or ".ndjson" in filename
+    )
+    return normalize_encoding(content_encoding), is_ndjson
+
+
 def _build_job_nse_payload(scan_nses, agent_nse_hashes):
     """
     Build the job NSE payload and only include file contents when the agent cache
@@ -302,6 +482,118 @@ def _select_weighted_priority(available_priorities):
     return [selected_priority] + fallback_priorities
 
 
+def _dispatched_priority_order(dispatcher):
+    """
+    Return the weighted order of the non-empty dispatcher queues.
+    """
+    depths = dispatcher.depths()
+    return _select_weighted_priority(
+        priority
+        for priority, depth in depths.items()
+        if depth and priority in PRIORITY_WEIGHTS
+    )
+
+
+def _claim_dispatched_job(dispatcher, prio_list, bot_id, now):
+    """
+    Claim the next queued job popped from the job dispatcher.
+
+    prio_list is the queue order of the request, queues found empty are
+    removed from it. Returns (job, priority), or (None, None) when no queued
+    job is left. Ids whose job is no longer waiting are skipped. Raises
+    redis.RedisError when Kvrocks is unavailable.
+    """
+    pops = 0
+    for prio in list(prio_list):
+        while pops < MAX_DISPATCH_POPS:
+            job_id = dispatcher.pop(prio)
+            if job_id is None:
+                prio_list.remove(prio)
+                break
+            pops += 1
+            if _claim_job_for_bot(job_id, bot_id, now) == 1:
+                return db.session.get(Jobs, job_id), prio
+            dispatcher.record_stale()
+    return None, None
+
+
+def _requeue_dispatched_job(priority, job_id):
+    """
+    Put back a dispatched job whose claim was rolled back.
+    """
+    try:
+        get_job_dispatcher(db.app.config).requeue(priority, job_id)
+    except redis.RedisError as error:
+        logger.warning("Unable to requeue job %s in the dispatcher: %s", job_id, error)
+
+
+def _claim_queued_job_from_db(prio_list, bot_id, now):
+    """
+    Claim the oldest queued job by scanning the jobs table.
+
+    Used when the job dispatcher is unavailable, prio_list being the queue
+    order of the request. A lost claim race updates no row, so the jobs
+    already claimed by the request are kept.
+    """
+    for prio in prio_list:
+        candidate = (
+            db.session.query(Jobs)
+            .filter(Jobs.active == False, Jobs.finished == False, Jobs.priority == prio)
+            .order_by(Jobs.job_creation.asc())  # oldest first
+            .first()
+        )
+        if not candidate:
+            continue
+
+        if _claim_job_for_bot(candidate.id, bot_id, now) != 1:
+            continue
+        return candidate
+    return None
+
+
+def _claim_jobs_for_bot(bot_id, now, count):
+    """
+    Claim up to count queued jobs for one bot.
+
+    Returns [(job, priority)]. The priority is the dispatcher queue the job
+    was popped from, None for jobs found by the database fallback.
+    """
+    claimed = []
+    try:
+        dispatcher = get_job_dispatcher(db.app.config)
+        prio_list = _dispatched_priority_order(dispatcher)
+        while len(claimed) < count:
+            job, prio = _claim_dispatched_job(dispatcher, prio_list, bot_id, now)
+            if job is None:
+                break
+            claimed.append((job, prio))
+    except redis.RedisError as error:
+        logger.warning("Job dispatcher unavailable, scanning queued jobs: %s", error)
+        prio_list = _select_weighted_priority(_get_available_job_priorities())
+        while len(claimed) < count:
+            job = _claim_queued_job_from_db(prio_list, bot_id, now)
+            if job is None:
+                break
+            claimed.append((job, None))
+    return claimed
+
+
+def _build_job_payload(job, nse_payload, lease_seconds):
+    """
+    Return the getjob description of one claimed job.
+    """
+    nmap_nse, nse_scripts = nse_payload
+    return {
+        "job": job.job,
+        "job_uid": job.uid,
+        "nmap_nse": nmap_nse,
+        "nse_scripts": nse_scripts,
+        "nmap_ports": job.scan_ports.split(",") if job.scan_ports else [],
+        "lease_expires": job.lease_expires.isoformat(timespec="seconds") + "Z",
+        "lease_seconds": lease_seconds,
+    }
+
+
 class PublicTargetsApi(ModelRestApi):
     """
     This class implement the API access for the Target definition
@@ -454,6 +746,9 @@ class Api(BaseApi):
         """
         Bot to Island connection health check
 
+        Agents can list the JOB_UID of the scans they still run in
+        RUNNING_JOBS to renew their leases.
+
         Example;
         curl -X POST \
             http://localhost:5000/bot_api/beacon \
@@ -495,7 +790,6 @@ class Api(BaseApi):
         db.session.add(new_bot)
         try:
             db.session.commit()
-            return self.response(200, message="ready")
         except IntegrityError:
             # We Update bot info, IP / Last Seen at each beacon.
             db.session.rollback()
@@ -510,7 +804,22 @@ class Api(BaseApi):
                 synchronize_session="fetch",
             )  # 'fetch' So SQLAlchemy keep correct session state
             db.session.commit()
-            return self.response(200, message="ready")
+
+        if botinfo.get("RUNNING_JOBS"):
+            # Heartbeat of the scans still running on the agent.
+            beacon_bot = _get_bot_by_uid(botinfo.get("UID"))
+            if beacon_bot is not None:
+                extended = extend_job_leases(
+                    beacon_bot.id,
+                    botinfo.get("RUNNING_JOBS"),
+                    utcnow_naive(),
+                    db.app.config,
+                )
+                db.session.commit()
+                logger.debug(
+                    "UID %s renewed %s job leases", botinfo.get("UID"), extended
+                )
+        return self.response(200, message="ready")
 
     @expose("/getjob", methods=["POST"])
     @safe
@@ -518,7 +827,7 @@ class Api(BaseApi):
         """
         Bot to Island connection to fetch new a scanning job .
 
-        Return a JobTodo.
+        Return a JobTodo, or a list of JobTodo when the agent sends MAX_JOBS.
         """
 
         try:
@@ -548,65 +857,78 @@ class Api(BaseApi):
             )
             return self.response(403, message="forbidden")
 
-        # Get one job to do using smooth weighted round-robin over non-empty
+        # Get the jobs to do using smooth weighted round-robin over non-empty
         # priority queues. Priority 4 gets the largest share when present, but
         # lower queues inherit capacity when higher queues are empty.
-        prio_list = _select_weighted_priority(_get_available_job_priorities())
-        job_todo = None
-        for prio in prio_list:
-            candidate = (
-                db.session.query(Jobs)
-                .filter(
-                    Jobs.active == False, Jobs.finished == False, Jobs.priority == prio
-                )
-                .order_by(Jobs.job_creation.asc())  # oldest first
-                .first()
+        # The queues are Kvrocks lists refilled by the scheduler, the jobs
+        # table is only scanned when Kvrocks is unavailable.
+        # Agents sending MAX_JOBS get a list of jobs, capped so the bot never
+        # holds more than GETJOB_MAX_JOBS_PER_BOT active jobs.
+        # Each job is leased for a time sized from its addresses and ports.
+        max_jobs = botinfo.get("MAX_JOBS")
+        batch_size = 1
+        if max_jobs is not None:
+            batch_size = min(max_jobs, _get_max_jobs_per_bot()) - _count_active_jobs(
+                job_bot.id
             )
-            if not candidate:
-                continue
-
-            now = utcnow_naive()
-            if _claim_job_for_bot(candidate.id, job_bot.id, now) != 1:
-                db.session.rollback()
-                continue
 
-            job_todo = candidate
+        now = utcnow_naive()
+        claimed = []
+        if batch_size > 0:
+            claimed = _claim_jobs_for_bot(job_bot.id, now, batch_size)
+
+        lease_seconds = {}
+        for job_todo, _job_prio in claimed:
+            lease_seconds[job_todo.id] = compute_lease_seconds(
+                job_todo.scan_unit_count, job_todo.scan_ports, db.app.config
+            )
             job_todo.active = True
             job_todo.job_start = now
+            job_todo.lease_expires = now + timedelta(seconds=lease_seconds[job_todo.id])
             job_todo.bot_id = job_bot.id
+            db.session.add(job_todo)
+        if claimed:
             job_bot.running = True  # Set the Bot to Active too
             job_bot.last_seen = now
             db.session.add(job_bot)
-            db.session.add(job_todo)
-            if job_todo:
-                break  # A soon as a Job is found... return.
-
-        # Now whe have maybe a job to launch.
-        if job_todo:
-            try:
-                nmap_nse, nse_scripts = _build_job_nse_payload(
-                    job_todo.scan_nses,
-                    botinfo.get("NSE_HASHES"),
-                )
-            except OSError as error:
-                db.session.rollback()
-                logger.exception(
-                    "Unable to prepare NSE payloads for job %s", job_todo.uid
-                )
-                return self.response_400(
-                    message=f"Unable to prepare NSE payloads: {error}"
-                )
 
-            ret_msg = {
-                "message": "ready",
-                "job": job_todo.job,
-                "job_uid": job_todo.uid,
-                "nmap_nse": nmap_nse,
-                "nse_scripts": nse_scripts,
-                "nmap_ports": (
-                    job_todo.scan_ports.split(",") if job_todo.scan_ports else []
-                ),
-            }
+        # Now whe have maybe jobs to launch.
+        jobs_payload = []
+        nse_payloads = {}
+        failing_job = None
+        try:
+            for job_todo, _job_prio in claimed:
+                failing_job = job_todo
+                if job_todo.scan_nses not in nse_payloads:
+                    nse_payloads[job_todo.scan_nses] = _build_job_nse_payload(
+                        job_todo.scan_nses,
+                        botinfo.get("NSE_HASHES"),
+                    )
+                jobs_payload.append(
+                    _build_job_payload(
+                        job_todo,
+                        nse_payloads[job_todo.scan_nses],
+                        lease_seconds[job_todo.id],
+                    )
+                )
+        except OSError as error:
+            logger.exception(
+                "Unable to prepare NSE payloads for job %s", failing_job.uid
+            )
+            requeued = [
+                (job_prio, claimed_job.id)
+                for claimed_job, job_prio in reversed(claimed)
+                if job_prio is not None
+            ]
+            db.session.rollback()
+            for job_prio, job_id in requeued:
+                _requeue_dispatched_job(job_prio, job_id)
+            return self.response_400(message=f"Unable to prepare NSE payloads: {error}")
+
+        if max_jobs is not None:
+            ret_msg = {"message": "ready", "jobs": jobs_payload}
+        elif jobs_payload:
+            ret_msg = {"message": "ready", **jobs_payload[0]}
         else:
             ret_msg = {"message": "ready", "job": ""}
 
@@ -620,25 +942,29 @@ class Api(BaseApi):
         """
         Bot to Island connection to give back a job that was scanned
 
+        Agents holding several jobs can give back a JOBS list of results,
+        each job is then completed on its own.
         Return a JobTodo.
         """
         request_started = time.perf_counter()
+        max_upload_bytes, max_result_bytes = _get_sndjob_limits()
         try:
-            data = request.get_json(force=True)
-            if not isinstance(data, dict):
-                data = json.loads(
-                    data
-                )  # Convert to Dict (for content type missing requests)
+            data, files = _load_sndjob_request(max_upload_bytes, max_result_bytes)
 
             botinfoschema = BotInfoSchema()
             botinfo = botinfoschema.load(
                 data,
             )  # Validate Request data and format
+            job_results = _get_sndjob_results(botinfo, files)
 
         except ValidationError as err:
             return self.response_400(
                 message=f"Invalid input: {flat_marsh_error(err.messages)}"
             )
+        except (RequestEntityTooLarge, ResultTooLarge):
+            return self.response(413, message="result too large")
+        except ValueError as err:
+            return self.response_400(message=f"Invalid input: {err}")
 
         logger.debug("Agent UID %s send back a JOB", botinfo.get("UID"))
 
@@ -647,186 +973,186 @@ class Api(BaseApi):
             logger.warning(
                 "Unknown or inactive bot %s submitted job %s",
                 botinfo.get("UID"),
-                botinfo.get("JOB_UID"),
+                ", ".join(str(job_uid) for job_uid, *_result in job_results),
             )
             return self.response(403, message="forbidden")
 
+        completed = []
+        for job_uid, result_payload, result_upload, upload_format in job_results:
+            status, message = self._complete_job(
+                botinfo.get("UID"),
+                submitting_bot,
+                job_uid,
+                (result_payload, result_upload, upload_format),
+                max_result_bytes,
+            )
+            completed.append({"job_uid": job_uid, "status": status, "message": message})
+        logger.debug(
+            "sndjob debug: %s jobs completed in %.2fs",
+            len(completed),
+            time.perf_counter() - request_started,
+        )
+
+        if botinfo.get("JOBS") is None:
+            return self.response(
+                completed[0]["status"], message=completed[0]["message"]
+            )
+        return self.response(200, message={"message": "ready", "jobs": completed})
+
+    @staticmethod
+    def _complete_job(bot_uid, submitting_bot, job_uid, result, max_result_bytes):
+        """
+        Store the result of one job and mark it finished.
+
+        result is (RESULT payload, result upload, upload format). Returns the
+        (HTTP status, message) of the job, its changes are committed or
+        rolled back before returning.
+        """
+        job_started = time.perf_counter()
+        result_payload, result_upload, result_upload_format = result
+
         # Tell the JOB that we finished
         lookup_started = time.perf_counter()
-        job_bot = (
-            db.session.query(Jobs)
-            .filter(Jobs.uid == botinfo.get("JOB_UID"))
-            .limit(1)
-            .scalar()
-        )
+        job_bot = db.session.query(Jobs).filter(Jobs.uid == job_uid).limit(1).scalar()
         logger.debug(
             "sndjob debug: loaded job %s in %.2fs",
-            botinfo.get("JOB_UID"),
+            job_uid,
             time.perf_counter() - lookup_started,
         )
         if job_bot is None:
-            logger.warning(
-                "Bot %s submitted unknown job %s",
-                botinfo.get("UID"),
-                botinfo.get("JOB_UID"),
-            )
-            return self.response(404, message="job not found")
+            logger.warning("Bot %s submitted unknown job %s", bot_uid, job_uid)
+            return 404, "job not found"
 
         if job_bot.finished and not job_bot.active:
             logger.info(
                 "Bot %s resubmitted already completed job %s assigned to bot_id %s; returning idempotent success",
-                botinfo.get("UID"),
+                bot_uid,
                 job_bot.uid,
                 job_bot.bot_id,
             )
-            submitting_bot.running = False
+            submitting_bot.running = _count_active_jobs(submitting_bot.id) > 0
             submitting_bot.last_seen = utcnow_naive()
             db.session.commit()
-            return self.response(200, message="ready")
+            return 200, "ready"
 
         if job_bot.bot_id != submitting_bot.id:
             logger.warning(
                 "Bot %s tried to submit job %s assigned to bot_id %s",
-                botinfo.get("UID"),
+                bot_uid,
                 job_bot.uid,
                 job_bot.bot_id,
             )
-            return self.response(403, message="forbidden")
+            return 403, "forbidden"
 
         if not job_bot.active or job_bot.finished:
             logger.warning(
                 "Bot %s submitted job %s in invalid state active=%s finished=%s",
-                botinfo.get("UID"),
+                bot_uid,
                 job_bot.uid,
                 job_bot.active,
                 job_bot.finished,
             )
-            return self.response(409, message="job is not active")
+            return 409, "job is not active"
 
         job_start = ensure_utc_naive(job_bot.job_start)
         now = utcnow_naive()
         if job_start is None:
             logger.warning(
                 "Bot %s submitted job %s without start time",
-                botinfo.get("UID"),
+                bot_uid,
                 job_bot.uid,
             )
-            return self.response(409, message="job is not active")
+            return 409, "job is not active"
 
         elapsed_seconds = (now - job_start).total_seconds()
         if elapsed_seconds < MIN_JOB_RUNTIME_SECONDS:
             logger.warning(
                 "Bot %s submitted job %s too quickly after %.3fs",
-                botinfo.get("UID"),
+                bot_uid,
                 job_bot.uid,
                 elapsed_seconds,
             )
-            return self.response(429, message="job submitted too quickly")
+            return 429, "job submitted too quickly"
 
         # Write the result file BEFORE mutating ORM state.
         # If the write fails (disk full, OSError, malformed JSON), the job
         # must not be marked finished — the agent can retry and resubmit.
-        result_payload = botinfo.get("RESULT")
-        if result_payload is None:
+        if result_payload is None and result_upload is None:
             logger.warning(
                 "Bot %s submitted job %s without RESULT payload",
-                botinfo.get("UID"),
-                botinfo.get("JOB_UID"),
+                bot_uid,
+                job_uid,
             )
             db.session.rollback()
-            return self.response(400, message="missing result")
+            return 400, "missing result"
 
-        base = os.path.join(
-            db.app.config.get("JSON_FOLDER"),
-            botinfo.get("JOB_UID")[0],
-            f"{botinfo.get('JOB_UID')}.json",
-        )
         try:
-            result_data = json.loads(result_payload)
-            with open(base, "w", encoding="utf-8") as f:
-                json.dump(result_data, f, indent=2)
-        except (OSError, TypeError, json.JSONDecodeError):
-            logger.exception(
-                "Failed to write result file for job %s", botinfo.get("JOB_UID")
+            if result_upload is not None:
+                content_encoding, is_ndjson = result_upload_format
+                store_result_stream(
+                    db.app.config.get("JSON_FOLDER"),
+                    job_uid,
+                    result_upload.stream,
+                    db.app.config.get("RESULT_STORAGE_FORMAT"),
+                    content_encoding=content_encoding,
+                    ndjson=is_ndjson,
+                    max_bytes=max_result_bytes,
+                )
+            else:
+                if len(result_payload) > max_result_bytes:
+                    raise ResultTooLarge(f"RESULT exceeds {max_result_bytes} bytes")
+                write_result(
+                    db.app.config.get("JSON_FOLDER"),
+                    job_uid,
+                    result_payload,
+                    db.app.config.get("RESULT_STORAGE_FORMAT"),
+                )
+        except ResultTooLarge:
+            logger.warning(
+                "Bot %s submitted job %s with a result over %s bytes",
+                bot_uid,
+                job_uid,
+                max_result_bytes,
             )
             db.session.rollback()
-            return self.response(500, message="result storage failed")
+            return 413, "result too large"
+        except (OSError, TypeError, ValueError):
+            logger.exception("Failed to write result file for job %s", job_uid)
+            db.session.rollback()
+            return 500, "result storage failed"
 
         job_bot.finished = True
         job_bot.active = False
         job_bot.job_end = now
-        submitting_bot.running = False
+        job_bot.lease_expires = None
+        submitting_bot.running = (
+            _count_active_jobs(submitting_bot.id, exclude_job_id=job_bot.id) > 0
+        )
         submitting_bot.last_seen = now
-
         logger.debug("job_bot: %s", job_bot)
         # Check if we release the Target as Ready for a new Turn
         # Tell the JOB that we finished
 
         sync_started = time.perf_counter()
-        with db.session.no_autoflush:
-            logger.debug(
-                "sndjob debug: syncing %s targets for job %s",
-                len(job_bot.targets),
-                job_bot.uid,
-            )
-            for target in job_bot.targets:
-                logger.debug("target_id candidate to clean: %s", target.id)
-                logger.debug("target_id candidate last scan %s", target.last_scan)
-                previous_scan = ensure_utc_naive(target.last_scan)
-                # Alias for association table
-                assoc = assoc_jobs_targets.alias()
-
-                # requete SQLAlchemy
-                count_query = (
-                    db.session.query(func.count(distinct(Jobs.id)))
-                    .select_from(assoc)
-                    .join(Jobs, assoc.c.job_id == Jobs.id, isouter=True)
-                    .filter(
-                        assoc.c.target_id == target.id,
-                        Jobs.id != job_bot.id,
-                        Jobs.finished == False,
-                        Jobs.scanprofile_id == job_bot.scanprofile_id,
-                    )
-                )
-
-                scan_state = (
-                    db.session.query(TargetScanStates)
-                    .filter(
-                        TargetScanStates.target_id == target.id,
-                        TargetScanStates.scanprofile_id == job_bot.scanprofile_id,
-                    )
-                    .one_or_none()
-                )
-
-                if count_query.scalar() == 0:
-                    completion_time = utcnow_naive()
-                    if scan_state is not None:
-                        scan_state.working = False
-                        scan_state.last_previous_scan = ensure_utc_naive(
-                            scan_state.last_scan
-                        )
-                        scan_state.last_scan = completion_time
-                    target.last_previous_scan = previous_scan
-                    target.last_scan = completion_time
-
-                target.working = any(state.working for state in target.scan_states)
-                db.session.merge(target)  # ensure attached
+        completed_states = complete_job_in_cycle(job_bot, now)
         logger.debug(
-            "sndjob debug: target sync for job %s completed in %.2fs",
+            "sndjob debug: target sync for job %s completed %s states in %.2fs",
             job_bot.uid,
+            completed_states,
             time.perf_counter() - sync_started,
         )
-        if job_bot.scanprofile_id is not None:
-            reconcile_scanprofile_cycle(job_bot.scanprofile_id)
         commit_started = time.perf_counter()
         db.session.commit()
         logger.debug(
-            "sndjob debug: commit for job %s completed in %.2fs (total_request=%.2fs)",
+            "sndjob debug: commit for job %s completed in %.2fs (total_job=%.2fs)",
             job_bot.uid,
             time.perf_counter() - commit_started,
-            time.perf_counter() - request_started,
+            time.perf_counter() - job_started,
         )
-        return self.response(200, message="ready")
+        # Hand the committed job to the export thread, the recovery sweep
+        # exports it anyway if the queue loses it.
+        get_export_queue(db.app.config).push(job_bot.id)
+        return 200, "ready"
 
 
 class NsesApi(BaseApi):
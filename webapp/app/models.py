@@ -138,6 +138,8 @@ class Jobs(Model):
     job_end = Column(DateTime, default=None)  # Last job termination.
     job_start = Column(DateTime, default=None)  # Last job Start time
     job_creation = Column(DateTime, default=utcnow_naive)  # Timestamp of job creation
+    lease_expires = Column(DateTime, default=None)  # Deadline of the agent lease
+    lease_retries = Column(Integer, default=0, nullable=False)  # Expired leases
     priority = Column(Integer, default=0)  # Priority, by default LOW
     scanprofile_id = Column(Integer, ForeignKey("scanprofiles.id"), nullable=True)
     scanprofile_cycle_id = Column(
@@ -337,6 +339,29 @@ class Jobs(Model):
         else:
             return "oo"
 
+    def lease_html(self):
+        """
+        Display the agent lease time left and the requeues after expiry.
+        """
+        html = ""
+        if self.active and self.lease_expires:
+            seconds = int((self.lease_expires - utcnow_naive()).total_seconds())
+            if seconds < 0:
+                html += '<span class="label label-danger">expired</span> '
+            else:
+                minutes, seconds = divmod(seconds, 60)
+                hours, minutes = divmod(minutes, 60)
+                html += (
+                    f'<span class="label label-default">'
+                    f"{hours:02d}:{minutes:02d}:{seconds:02d}</span> "
+                )
+        if self.lease_retries:
+            html += (
+                f'<span class="label label-warning">'
+                f"{int(self.lease_retries)} requeued</span>"
+            )
+        return Esc(html)
+
 
 class Protos(Model):
     """
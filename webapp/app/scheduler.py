@@ -6,17 +6,15 @@ import os
 import logging
 import shutil
 import uuid
-import json
 import time
-import copy
-import re
-from collections import defaultdict
+import threading
+from collections import defaultdict, deque
 from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
 from netaddr import IPNetwork, cidr_merge
 import meilisearch
-from meilisearch.errors import MeilisearchApiError
-from nmap2json.smarthash import port_smart_hash
+from meilisearch.errors import MeilisearchApiError, MeilisearchTimeoutError
+import redis
 from requests.exceptions import HTTPError
 from sqlalchemy import text
 from sqlalchemy.orm import joinedload
@@ -26,8 +24,22 @@ from .models import Reports
 from .models import CollectedHeaders, ensure_default_collected_headers
 from .models import TagRules
 from .utils.mutils import compute_scan_unit_count_list, is_valid_fqdn, fetch_tlds
+from .utils.export_manifest import (
+    MANIFEST_STATUS_FAILED,
+    MANIFEST_STATUS_PARSED,
+    ExportManifest,
+)
+from .utils.export_parser import iter_parsed_export_jobs
+from .utils.export_queue import count_export_backlog, get_export_queue
+from .utils.job_dispatcher import get_job_dispatcher
+from .utils.job_leases import (
+    DEFAULT_JOB_LEASE_EXPIRY_BATCH_SIZE,
+    DEFAULT_JOB_LEASE_MAX_RETRIES,
+    requeue_expired_jobs,
+)
 from .utils.kvrocks import KVrocksIndexer
-from .utils.result_parser import parse_json
+from .utils.result_parser import PARSER_CONFIG_KEYS, normalize_db_conf
+from .utils.result_storage import RESULT_FORMATS, result_paths
 from .utils.reports import (
     build_report_markdown,
     compute_new_open_ports,
@@ -59,117 +71,19 @@ DEFAULT_MAX_NEW_JOBS_PER_TICK = 1024
 DEFAULT_ORPHAN_SWEEP_INTERVAL_SECONDS = 900
 DEFAULT_ORPHAN_SWEEP_BATCH_SIZE = 2000
 DEFAULT_PRIORITY_RETAG_BATCH_SIZE = 1000
-UNKNOWN_FAVICON_MD5_RE = re.compile(
-    r"\bUnknown\s+favicon\s+MD5\s*:\s*([0-9a-fA-F]{32})\b",
-    re.IGNORECASE,
-)
-
-
-def _clean_banner_outputs(port):
-    """
-    Remove accidental newlines inside banner NSE output strings.
-    """
-    for script in port.get("scripts") or []:
-        if script.get("id") != "banner":
-            continue
-        output = script.get("output")
-        if isinstance(output, str):
-            script["output"] = output.replace("\n", "")
-
-
-def _normalize_unknown_favicon_outputs(port):
-    """
-    Convert legacy http-favicon unknown-MD5 output to http-mm-sha-favicon shape.
-    """
-    for script in port.get("scripts") or []:
-        output = script.get("output")
-        if not isinstance(output, str):
-            continue
-        match = UNKNOWN_FAVICON_MD5_RE.search(output)
-        if not match:
-            continue
-
-        favicon_md5 = match.group(1).lower()
-        script["id"] = "http-mm-sha-favicon"
-        script["favicon_md5"] = favicon_md5
-        script["output"] = f"\n favicon_md5: {favicon_md5}"
-
-
-def _add_port_hash(port):
-    """
-    Return a deep-copied port object with computed hsh256.
-    """
-    port_copy = copy.deepcopy(port)
-    _clean_banner_outputs(port_copy)
-    _normalize_unknown_favicon_outputs(port_copy)
-    port_hash = port_smart_hash(port_copy)
-    hashed_port = {}
-    hash_inserted = False
-    for key, value in port_copy.items():
-        if key == "hsh256":
-            continue
-        hashed_port[key] = value
-        if key == "portid":
-            hashed_port["hsh256"] = port_hash
-            hash_inserted = True
-    if not hash_inserted:
-        hashed_port["hsh256"] = port_hash
-    return hashed_port
-
-
-def _strip_port_hash(port):
-    """
-    Return a port copy without the internal hsh256 helper field.
-    """
-    public_port = copy.deepcopy(port)
-    public_port.pop("hsh256", None)
-    return public_port
-
-
-def _port_document_uuid(ip, port):
-    """
-    Return deterministic UUID for one IP/port/hash report.
-    """
-    port_id = str(port.get("portid") or "").strip()
-    port_hash = str(port.get("hsh256") or "").strip()
-    if not ip or not port_id or not port_hash:
-        return None
-    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{ip}:{port_id}:{port_hash}"))
-
-
-def _split_scan_result_by_port(scan_result):
-    """
-    Build one Meilisearch document per port from one scanner result.
-    """
-    if not isinstance(scan_result, dict):
-        return []
-
-    ip = scan_result.get("addr")
-    ports = scan_result.get("ports") or []
-    if not ip or not isinstance(ports, list):
-        return []
-
-    port_documents = []
-    for port in ports:
-        if not isinstance(port, dict):
-            continue
-        hashed_port = _add_port_hash(port)
-        doc_id = _port_document_uuid(ip, hashed_port)
-        if not doc_id:
-            continue
-
-        port_hash = hashed_port["hsh256"]
-        body = copy.deepcopy(scan_result)
-        body["ports"] = [_strip_port_hash(hashed_port)]
-        body["hsh256"] = port_hash
-        port_documents.append(
-            {
-                "id": doc_id,
-                "ip": ip,
-                "body": body,
-            }
-        )
-    return port_documents
+DEFAULT_EXPORT_PARSE_WORKERS = 1
+DEFAULT_EXPORT_SWEEP_INTERVAL_SECONDS = 600
+DEFAULT_EXPORT_QUEUE_POLL_SECONDS = 5
+DEFAULT_MEILI_MAX_TASKS_IN_FLIGHT = 4
+DEFAULT_EXPORT_MANIFEST_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MEILI_TASK_TIMEOUT_MS = 300000
+MEILI_TASK_POLL_INTERVAL_MS = 100
+DEFAULT_EXPORT_WORKER_MAX_JOBS_PER_PASS = 500
+DEFAULT_EXPORT_WORKER_MAX_RUN_SECONDS = 300
+DEFAULT_EXPORT_WORKER_RETRY_BASE_SECONDS = 30
+DEFAULT_EXPORT_WORKER_RETRY_MAX_SECONDS = 600
+# Serializes the queued exports and the recovery sweep.
+EXPORT_LOCK = threading.Lock()
 
 
 def _run_scheduler_step(step_label, step_func):
@@ -218,11 +132,11 @@ def task_master_of_puppets():
     db.session.remove()
     try:
         step_durations = {
+            "job_leases": _run_scheduler_step("job_leases", task_requeue_expired_jobs),
             "create_jobs": _run_scheduler_step("create_jobs", task_create_jobs),
             "priority_retag": _run_scheduler_step(
                 "priority_retag", task_retag_queued_job_priorities
             ),
-            "export_to_dbs": _run_scheduler_step("export_to_dbs", task_export_to_dbs),
             "reports": _run_scheduler_step("reports", task_run_due_reports),
             "cleanup_jobs": _run_scheduler_step("cleanup_jobs", task_cleanup_jobs),
             "cleanup_search_sessions": _run_scheduler_step(
@@ -234,11 +148,14 @@ def task_master_of_puppets():
         }
         total_elapsed = time.perf_counter() - scheduler_started_at
         logger.info(
-            "Scheduler TASK: tick complete in %.2fs (create_jobs=%.2fs, priority_retag=%.2fs, export_to_dbs=%.2fs, reports=%.2fs, cleanup_jobs=%.2fs, cleanup_search_sessions=%.2fs, cleanup_export_jobs=%.2fs)",
+            "Scheduler TASK: tick complete in %.2fs (job_leases=%.2fs, "
+            "create_jobs=%.2fs, priority_retag=%.2fs, reports=%.2fs, "
+            "cleanup_jobs=%.2fs, cleanup_search_sessions=%.2fs, "
+            "cleanup_export_jobs=%.2fs)",
             total_elapsed,
+            step_durations["job_leases"]["elapsed"],
             step_durations["create_jobs"]["elapsed"],
             step_durations["priority_retag"]["elapsed"],
-            step_durations["export_to_dbs"]["elapsed"],
             step_durations["reports"]["elapsed"],
             step_durations["cleanup_jobs"]["elapsed"],
             step_durations["cleanup_search_sessions"]["elapsed"],
@@ -258,7 +175,7 @@ def check_json_storage(json_folder):
 
     # Smart migration from json to subfolders if needed.
     for filename in os.listdir(json_folder):
-        if filename.endswith(".json"):
+        if filename.endswith(tuple(f".{fmt}" for fmt in RESULT_FORMATS)):
             logger.debug("Moving %s to sub json foler", filename)
             shutil.move(
                 os.path.join(json_folder, filename),
@@ -489,6 +406,27 @@ def _get_waiting_job_counts_by_profile():
     return waiting_counts
 
 
+def _refill_job_dispatcher():
+    """
+    Rebuild the getjob dispatcher queues from the queued jobs in the DB.
+
+    Returns the number of queued job ids, or None when Kvrocks is down and
+    getjob falls back to scanning the jobs table.
+    """
+    queued_jobs = (
+        db.session.query(Jobs.id, Jobs.priority)
+        .filter(Jobs.active == False, Jobs.finished == False)
+        .order_by(Jobs.job_creation.asc(), Jobs.id.asc())
+        .all()
+    )
+    try:
+        depths = get_job_dispatcher(db.app.config).refill(queued_jobs)
+    except redis.RedisError as error:
+        logger.warning("Job dispatcher refill failed: %s", error)
+        return None
+    return sum(depths.values())
+
+
 def _rotate_profiles_for_tick(profiles):
     """
     Rotate profile evaluation order across ticks to avoid starving later profiles.
@@ -869,8 +807,9 @@ def task_create_jobs():
     )
 
     # Step 3: refresh running cycle metadata from durable target/profile state.
-    # This catches app restarts, target/profile edits, and completed jobs before
-    # the scheduler decides whether more jobs are needed.
+    # This catches app restarts, target/profile edits, and drift of the
+    # counters sndjob advances incrementally, before the scheduler decides
+    # whether more jobs are needed.
     cycle_started = time.perf_counter()
     cycles_checked = reconcile_running_scanprofile_cycles(now=utcnow_naive())
     cycles_pruned = prune_all_scanprofile_cycles()
@@ -1103,6 +1042,15 @@ def task_create_jobs():
 
     if profile_summaries:
         logger.info("Create Job TASK profiles: %s", "; ".join(profile_summaries))
+
+    # Step 16: hand the queued jobs, new ones included, to getjob.
+    dispatch_started = time.perf_counter()
+    dispatch_queued = _refill_job_dispatcher()
+    logger.debug(
+        "Create Job TASK debug: job dispatcher refilled in %.2fs (queued=%s)",
+        time.perf_counter() - dispatch_started,
+        dispatch_queued,
+    )
     logger.debug(
         "Create Job TASK debug: total create_jobs runtime %.2fs",
         time.perf_counter() - started_at,
@@ -1119,9 +1067,38 @@ def task_create_jobs():
         "cycles_pruned": cycles_pruned,
         "orphan_states_checked": orphan_release["checked_states"],
         "orphan_states_released": orphan_release["released_states"],
+        "dispatch_queued": dispatch_queued,
     }
 
 
+def task_requeue_expired_jobs():
+    """
+    Requeue active jobs whose agent let the lease expire.
+
+    Runs before task_create_jobs, whose dispatcher refill hands the requeued
+    jobs to getjob again.
+    """
+    batch_size = _get_scheduler_int_config(
+        "JOB_LEASE_EXPIRY_BATCH_SIZE",
+        DEFAULT_JOB_LEASE_EXPIRY_BATCH_SIZE,
+    )
+    max_retries = _get_scheduler_int_config(
+        "JOB_LEASE_MAX_RETRIES",
+        DEFAULT_JOB_LEASE_MAX_RETRIES,
+        minimum=0,
+    )
+    summary = requeue_expired_jobs(utcnow_naive(), batch_size, max_retries)
+    if summary["expired_jobs"]:
+        logger.warning(
+            "Job lease TASK: %s expired jobs; %s requeued; %s dropped after %s requeues",
+            summary["expired_jobs"],
+            summary["requeued_jobs"],
+            summary["abandoned_jobs"],
+            max_retries,
+        )
+    return summary
+
+
 def task_retag_queued_job_priorities():
     """
     Gradually converge queued job priorities to their scan profile priority.
@@ -1195,6 +1172,10 @@ def task_retag_queued_job_priorities():
             bool(has_remaining),
         )
 
+    if total_retagged:
+        # Move the retagged jobs to their new priority queue.
+        _refill_job_dispatcher()
+
     logger.info(
         "Priority retag TASK: retagged %s queued jobs across %s profiles; completed_profiles=%s; batch_size=%s; elapsed=%.2fs",
         total_retagged,
@@ -1211,9 +1192,12 @@ def task_retag_queued_job_priorities():
     }
 
 
-def task_export_to_dbs():
+def task_export_to_dbs(max_jobs=None, job_ids=None):
     """
     Export Local Json to external DB
+
+    At most max_jobs finished jobs are exported, oldest first, when set.
+    job_ids restricts the export to these jobs instead of scanning the table.
     """
     # Reuse the connections.
     meili_idx = db.app.config.get("MEILI_IDX")
@@ -1222,26 +1206,21 @@ def task_export_to_dbs():
     input_dir = os.path.expanduser(db.app.config.get("JSON_FOLDER"))
 
     job_snapshots = []
-    active_tag_rules = compile_tag_rule_records(
-        db.session.query(TagRules).filter(TagRules.active == True).all()
-    )
-    parser_config = dict(db.app.config)
-    ensure_default_collected_headers(db.session)
-    parser_config["HTTP_HEADER_COLLECTION"] = {
-        str(row.header_name or "").strip().lower(): bool(row.collect_value)
-        for row in db.session.query(CollectedHeaders).all()
-        if str(row.header_name or "").strip()
-    }
     # Select "All" Json
-    for job_data in (
+    job_query = (
         db.session.query(Jobs.id, Jobs.uid)
         .filter(
             Jobs.active == False,
             Jobs.exported == False,
             Jobs.finished == True,
         )
-        .yield_per(100)
-    ):
+        .order_by(Jobs.id.asc())
+    )
+    if job_ids is not None:
+        job_query = job_query.filter(Jobs.id.in_(job_ids))
+    if max_jobs:
+        job_query = job_query.limit(max_jobs)
+    for job_data in job_query.yield_per(100):
         job_snapshots.append({"id": job_data.id, "uid": job_data.uid})
 
     if not job_snapshots:
@@ -1253,71 +1232,208 @@ def task_export_to_dbs():
             "jobs_marked_exported": 0,
         }
 
+    active_tag_rules = compile_tag_rule_records(
+        db.session.query(TagRules).filter(TagRules.active == True).all()
+    )
+    # Only the parser keys: the app config holds KVROCKS_IDX and other
+    # unpicklable objects, and the config goes to the parser workers.
+    parser_config = {
+        key: db.app.config[key] for key in PARSER_CONFIG_KEYS if key in db.app.config
+    }
+    ensure_default_collected_headers(db.session)
+    parser_config["HTTP_HEADER_COLLECTION"] = {
+        str(row.header_name or "").strip().lower(): bool(row.collect_value)
+        for row in db.session.query(CollectedHeaders).all()
+        if str(row.header_name or "").strip()
+    }
+    # Normalized once, so the TLD lists are sets for every parsed document.
+    parser_config = normalize_db_conf(parser_config)
+
     # Release the read transaction before spending time on IO/exports to avoid long locks.
     db.session.commit()
     db.session.remove()
 
+    # Jobs left by a failed pass resume from their checkpoint, a job whose
+    # documents were all flushed only needs to be marked exported.
+    export_manifest = ExportManifest(
+        kvrocks_idx.r,
+        ttl_seconds=_get_scheduler_int_config(
+            "EXPORT_MANIFEST_TTL_SECONDS", DEFAULT_EXPORT_MANIFEST_TTL_SECONDS
+        ),
+    )
+    manifest_states = export_manifest.get_states(job["id"] for job in job_snapshots)
+    resumed_jobs = set()
+    jobs_to_parse = []
+    for job in job_snapshots:
+        state = manifest_states.get(job["id"])
+        if (
+            state
+            and state["status"] == MANIFEST_STATUS_PARSED
+            and len(state["flushed"]) >= state["documents"]
+        ):
+            resumed_jobs.add(job["id"])
+            continue
+        if state:
+            job["flushed_ids"] = state["flushed"]
+        jobs_to_parse.append(job)
+
     batch_size = 2500  # How many Document we flush at once to backend.
     pending_meili = []
     pending_kvrocks = []
-    pending_job_refs = []
+    pending_doc_refs = []
     outstanding_docs = defaultdict(int)
-    completed_jobs = set()
-    ready_jobs = set()
+    completed_jobs = set(resumed_jobs)
+    ready_jobs = set(resumed_jobs)
     total_documents = 0
+    skipped_documents = 0
+    failed_parse_jobs = 0
     batch_count = 0
+    parse_workers = _get_scheduler_int_config(
+        "EXPORT_PARSE_WORKERS", DEFAULT_EXPORT_PARSE_WORKERS
+    )
+    # Worker stages are summed over the workers, parse_wait is the time the
+    # flushers waited for the next parsed job.
+    stage_seconds = defaultdict(float)
+    # Kvrocks writes overlap the parsing and the Meili upload of the next
+    # batch, jobs are only marked exported once the stream is flushed.
+    kvrocks_stream = kvrocks_idx.open_ingest_stream(
+        batch_size=batch_size,
+        max_in_flight_batches=int(db.app.config.get("KVROCKS_IN_FLIGHT_BATCHES", 2)),
+    )
+    # Meili tasks are confirmed oldest first once more than
+    # MEILI_MAX_TASKS_IN_FLIGHT are queued. A job counts as exported once
+    # the tasks of all its documents succeeded.
+    meili_tasks = deque()
+    meili_max_tasks = _get_scheduler_int_config(
+        "MEILI_MAX_TASKS_IN_FLIGHT", DEFAULT_MEILI_MAX_TASKS_IN_FLIGHT
+    )
+    meili_task_timeout_ms = _get_scheduler_int_config(
+        "MEILI_TASK_TIMEOUT_MS", DEFAULT_MEILI_TASK_TIMEOUT_MS
+    )
+    meili_task_seconds = []
+    meili_queue_depth_max = 0
+    failed_meili_tasks = 0
+    worker_stats = _get_export_worker_stats()
+
+    def confirm_oldest_meili_task():
+        """
+        Wait for the oldest queued Meili task and release its documents.
+        """
+        nonlocal failed_meili_tasks
+        task_uid, doc_refs, kvrocks_writes, enqueued_at = meili_tasks.popleft()
+        wait_started_at = time.perf_counter()
+        task = meili_idx.wait_for_task(
+            task_uid,
+            timeout_in_ms=meili_task_timeout_ms,
+            interval_in_ms=MEILI_TASK_POLL_INTERVAL_MS,
+        )
+        finished_at = time.perf_counter()
+        stage_seconds["meili"] += finished_at - wait_started_at
+        meili_task_seconds.append(finished_at - enqueued_at)
+        worker_stats["meili_tasks_in_flight"] = len(meili_tasks)
+        status = getattr(task, "status", None)
+        if status != "succeeded":
+            # The jobs of this batch keep outstanding documents and stay
+            # unexported, the next pass exports them again.
+            failed_meili_tasks += 1
+            logger.error(
+                "Meili task %s ended with status=%s: %s",
+                task_uid,
+                status,
+                getattr(task, "error", None),
+            )
+            return
+        for write_future in kvrocks_writes:
+            write_future.result()
+        export_manifest.mark_flushed(doc_refs)
+        for job_id, _doc_id in doc_refs:
+            outstanding_docs[job_id] -= 1
+            if outstanding_docs[job_id] == 0 and job_id in completed_jobs:
+                ready_jobs.add(job_id)
 
     def flush_batch():
         """
         This subprocedure flush reports (per IP)
         """
-        nonlocal batch_count, total_documents
+        nonlocal batch_count, total_documents, meili_queue_depth_max
         if not pending_meili:
             return
         batch_count += 1
-        meili_idx.add_documents(pending_meili)
-        kvrocks_idx.add_documents_batch(pending_kvrocks)
-        for job_id in pending_job_refs:
-            outstanding_docs[job_id] -= 1
-            if outstanding_docs[job_id] == 0 and job_id in completed_jobs:
-                ready_jobs.add(job_id)
+        meili_started_at = time.perf_counter()
+        task_info = meili_idx.add_documents(pending_meili)
+        stage_seconds["meili"] += time.perf_counter() - meili_started_at
+        kvrocks_writes = kvrocks_stream.submit(pending_kvrocks)
+        meili_tasks.append(
+            (
+                task_info.task_uid,
+                list(pending_doc_refs),
+                kvrocks_writes,
+                meili_started_at,
+            )
+        )
+        meili_queue_depth_max = max(meili_queue_depth_max, len(meili_tasks))
+        worker_stats["meili_tasks_in_flight"] = len(meili_tasks)
         total_documents += len(pending_meili)
         pending_meili.clear()
         pending_kvrocks.clear()
-        pending_job_refs.clear()
-
+        pending_doc_refs.clear()
+        while len(meili_tasks) > meili_max_tasks:
+            confirm_oldest_meili_task()
+
+    parsed_jobs = iter_parsed_export_jobs(
+        jobs_to_parse,
+        input_dir,
+        parser_config,
+        active_tag_rules,
+        parse_workers,
+    )
     try:
-        for job in job_snapshots:
-            filepath = os.path.join(input_dir, job["uid"][0], job["uid"] + ".json")
-
-            with open(filepath, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, dict):
-                    scan_results = [data]
-                elif isinstance(data, list):
-                    scan_results = data
-                else:
-                    scan_results = []
-                for item in scan_results:
-                    for object_to_save in _split_scan_result_by_port(item):
-                        parsed_doc = parse_json(
-                            object_to_save,
-                            parser_config,
-                            tag_rules=active_tag_rules,
-                        )
-                        pending_meili.append(object_to_save)
-                        pending_kvrocks.append(parsed_doc)
-                        pending_job_refs.append(job["id"])
-                        outstanding_docs[job["id"]] += 1
-
-                        if len(pending_meili) >= batch_size:
-                            flush_batch()
+        while True:
+            wait_started_at = time.perf_counter()
+            job, documents, manifest, timings = next(
+                parsed_jobs, (None, None, None, None)
+            )
+            stage_seconds["parse_wait"] += time.perf_counter() - wait_started_at
+            if job is None:
+                break
+            for stage, seconds in timings.items():
+                stage_seconds[stage] += seconds
+            if manifest_states.get(job["id"], {}).get("status") != manifest["status"]:
+                export_manifest.record(
+                    job["id"],
+                    manifest["status"],
+                    manifest["documents"],
+                    skipped=manifest["skipped"],
+                    error_message=manifest["error"],
+                )
+            if manifest["status"] == MANIFEST_STATUS_FAILED:
+                # The job stays unexported, the next sweep retries it.
+                failed_parse_jobs += 1
+                logger.error(
+                    "Export TASK: unable to read the result of job %s: %s",
+                    job["uid"],
+                    manifest["error"],
+                )
+                continue
+            skipped_documents += manifest["skipped"]
+            for object_to_save, parsed_doc in documents:
+                pending_meili.append(object_to_save)
+                pending_kvrocks.append(parsed_doc)
+                pending_doc_refs.append((job["id"], object_to_save["id"]))
+                outstanding_docs[job["id"]] += 1
+
+                if len(pending_meili) >= batch_size:
+                    flush_batch()
 
             completed_jobs.add(job["id"])
             if outstanding_docs[job["id"]] == 0:
                 ready_jobs.add(job["id"])
 
         flush_batch()
+        while meili_tasks:
+            confirm_oldest_meili_task()
+        kvrocks_stream.close()
+        kvrocks_stats = kvrocks_stream.get_stats()
         updated_rows = 0
 
         if ready_jobs:
@@ -1338,6 +1454,7 @@ def task_export_to_dbs():
                     updated_rows,
                 )
             db.session.commit()
+            export_manifest.clear(ready_jobs)
         logger.info(
             "Export TASK: %s jobs scanned, %s documents exported in %s batches, %s jobs marked exported",
             len(job_snapshots),
@@ -1345,13 +1462,36 @@ def task_export_to_dbs():
             batch_count,
             updated_rows,
         )
-        return {
+        summary = {
             "jobs_scanned": len(job_snapshots),
             "documents_exported": total_documents,
             "batches": batch_count,
             "jobs_marked_exported": updated_rows,
+            "jobs_resumed": len(resumed_jobs),
+            "jobs_parse_failed": failed_parse_jobs,
+            "documents_skipped": skipped_documents,
+            "parse_workers": parse_workers,
+            **{
+                f"{stage}_s": round(stage_seconds[stage], 2)
+                for stage in ("load", "split", "parse", "parse_wait", "meili")
+            },
+            "meili_tasks": len(meili_task_seconds),
+            "meili_failed_tasks": failed_meili_tasks,
+            "meili_queue_depth_max": meili_queue_depth_max,
+            "meili_task_ms": round(
+                sum(meili_task_seconds) * 1000 / max(len(meili_task_seconds), 1), 2
+            ),
+            "meili_task_ms_max": round(max(meili_task_seconds, default=0) * 1000, 2),
+            "kvrocks_docs_per_second": kvrocks_stats["docs_per_second"],
+            "kvrocks_read_ms": kvrocks_stats["read_ms"],
+            "kvrocks_write_ms": kvrocks_stats["write_ms"],
+            "kvrocks_wait_ms": kvrocks_stats["wait_ms"],
         }
-    except (MeilisearchApiError, HTTPError):
+        if failed_meili_tasks:
+            summary["errors"] = failed_meili_tasks
+            summary["error"] = f"{failed_meili_tasks} Meilisearch tasks failed"
+        return summary
+    except (MeilisearchApiError, MeilisearchTimeoutError, HTTPError):
         db.session.rollback()
         logger.error("Unable to export to Meili database")
         return {
@@ -1362,9 +1502,185 @@ def task_export_to_dbs():
             "errors": 1,
         }
     finally:
+        worker_stats["meili_tasks_in_flight"] = 0
+        parsed_jobs.close()
+        kvrocks_stream.close()
         db.session.remove()
 
 
+def _get_export_worker_stats():
+    """
+    Return the export worker counters shared with the Stats view.
+    """
+    return db.app.config.setdefault(
+        "EXPORT_WORKER_STATS",
+        {
+            "runs": 0,
+            "passes": 0,
+            "jobs_exported": 0,
+            "queued_jobs_exported": 0,
+            "documents_exported": 0,
+            "failures": 0,
+            "consecutive_failures": 0,
+            "next_retry_at": 0,
+            "last_error": "",
+            "last_run_at": "",
+            "last_run_seconds": 0.0,
+            "backlog": 0,
+            "meili_tasks_in_flight": 0,
+            "last_pass": {},
+        },
+    )
+
+
+def task_export_worker():
+    """
+    Recovery sweep exporting every finished job left unexported, outside the
+    scheduler tick. Jobs queued by sndjob are exported by the export thread.
+
+    Each run exports passes of at most EXPORT_WORKER_MAX_JOBS_PER_PASS jobs
+    until the backlog is empty or EXPORT_WORKER_MAX_RUN_SECONDS is spent.
+    A failed pass leaves its jobs unexported and delays the next run with an
+    exponential backoff.
+    """
+    stats = _get_export_worker_stats()
+    if time.time() < stats["next_retry_at"]:
+        return stats
+
+    max_jobs = _get_scheduler_int_config(
+        "EXPORT_WORKER_MAX_JOBS_PER_PASS", DEFAULT_EXPORT_WORKER_MAX_JOBS_PER_PASS
+    )
+    max_run_seconds = _get_scheduler_int_config(
+        "EXPORT_WORKER_MAX_RUN_SECONDS", DEFAULT_EXPORT_WORKER_MAX_RUN_SECONDS
+    )
+    started_at = time.perf_counter()
+    stats["runs"] += 1
+    stats["last_run_at"] = utcnow_aware().isoformat(timespec="seconds")
+    db.session.remove()
+    try:
+        while True:
+            summary = _run_export_pass(stats, max_jobs=max_jobs)
+            if summary.get("errors"):
+                break
+            if (
+                summary["jobs_scanned"] < max_jobs
+                or not summary["jobs_marked_exported"]
+                or time.perf_counter() - started_at >= max_run_seconds
+            ):
+                break
+    finally:
+        stats["last_run_seconds"] = round(time.perf_counter() - started_at, 2)
+        try:
+            stats["backlog"] = count_export_backlog()
+        finally:
+            db.session.remove()
+
+    if stats["passes"] and stats["last_pass"].get("jobs_scanned"):
+        logger.info(
+            "Export worker: %s jobs and %s documents exported so far, backlog=%s, run=%.2fs",
+            stats["jobs_exported"],
+            stats["documents_exported"],
+            stats["backlog"],
+            stats["last_run_seconds"],
+        )
+    return stats
+
+
+def _run_export_pass(stats, max_jobs, job_ids=None):
+    """
+    Run one export pass under EXPORT_LOCK and update the worker counters.
+    """
+    with EXPORT_LOCK:
+        try:
+            summary = task_export_to_dbs(max_jobs=max_jobs, job_ids=job_ids)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("Export worker: pass failed")
+            summary = {"errors": 1, "error": str(error)}
+        stats["passes"] += 1
+        stats["last_pass"] = summary
+        if summary.get("errors"):
+            _record_export_worker_failure(
+                stats, summary.get("error") or "Meilisearch export failed"
+            )
+            return summary
+
+        stats["consecutive_failures"] = 0
+        stats["next_retry_at"] = 0
+        stats["jobs_exported"] += summary["jobs_marked_exported"]
+        stats["documents_exported"] += summary["documents_exported"]
+        return summary
+
+
+def task_export_queued_jobs(export_queue):
+    """
+    Export the jobs queued by sndjob, in passes of at most
+    EXPORT_WORKER_MAX_JOBS_PER_PASS jobs.
+
+    The ids of a failed pass are queued again once the retry backoff is over.
+    """
+    stats = _get_export_worker_stats()
+    max_jobs = _get_scheduler_int_config(
+        "EXPORT_WORKER_MAX_JOBS_PER_PASS", DEFAULT_EXPORT_WORKER_MAX_JOBS_PER_PASS
+    )
+    try:
+        while time.time() >= stats["next_retry_at"]:
+            job_ids = export_queue.pop_batch(max_jobs)
+            if not job_ids:
+                break
+            summary = _run_export_pass(stats, max_jobs, job_ids=job_ids)
+            if summary.get("errors"):
+                export_queue.push(*job_ids)
+                break
+            stats["queued_jobs_exported"] += summary["jobs_marked_exported"]
+    finally:
+        db.session.remove()
+
+
+def _run_export_queue_consumer():
+    """
+    Export thread body: wait for sndjob pushes and export them right away.
+
+    The queue is also polled every EXPORT_QUEUE_POLL_SECONDS for ids pushed
+    by other processes or left in Kvrocks by a restart.
+    """
+    export_queue = get_export_queue(db.app.config)
+    poll_seconds = _get_scheduler_int_config(
+        "EXPORT_QUEUE_POLL_SECONDS", DEFAULT_EXPORT_QUEUE_POLL_SECONDS
+    )
+    while True:
+        stats = _get_export_worker_stats()
+        retry_in = stats["next_retry_at"] - time.time()
+        export_queue.wait(max(poll_seconds, retry_in))
+        with db.app.app_context():
+            try:
+                task_export_queued_jobs(export_queue)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Export queue: unable to export queued jobs")
+
+
+def _record_export_worker_failure(stats, error):
+    """
+    Count one failed export pass and schedule the retry.
+    """
+    retry_base = _get_scheduler_int_config(
+        "EXPORT_WORKER_RETRY_BASE_SECONDS", DEFAULT_EXPORT_WORKER_RETRY_BASE_SECONDS
+    )
+    retry_max = _get_scheduler_int_config(
+        "EXPORT_WORKER_RETRY_MAX_SECONDS", DEFAULT_EXPORT_WORKER_RETRY_MAX_SECONDS
+    )
+    stats["failures"] += 1
+    stats["consecutive_failures"] += 1
+    stats["last_error"] = error
+    delay = min(retry_max, retry_base * 2 ** (stats["consecutive_failures"] - 1))
+    stats["next_retry_at"] = time.time() + delay
+    logger.error(
+        "Export worker: pass failed (%s), %s consecutive failures, retry in %ss",
+        error,
+        stats["consecutive_failures"],
+        delay,
+    )
+
+
 def _build_due_report(report, run_at):
     """
     Execute a report query and return its Markdown body.
@@ -1380,8 +1696,8 @@ def _build_due_report(report, run_at):
     if not results.get("status"):
         raise ValueError(results.get("msg_error") or "Invalid report query")
 
-    indexer = db.app.config.get("KVROCKS_IDX") or KVrocksIndexer(
-        db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
+    indexer = db.app.config.get("KVROCKS_IDX") or KVrocksIndexer.from_config(
+        db.app.config
     )
     per_ip_ports, port_counter = collect_report_ports(
         indexer,
@@ -1504,19 +1820,21 @@ def task_cleanup_jobs():
     )
 
     for job_data in job_snapshots:
-        filepath = os.path.join(
-            json_folder,
-            job_data.uid[0],
-            f"{job_data.uid}.json",
-        )
-        try:
-            os.remove(filepath)
+        found_job_file = False
+        for filepath in result_paths(json_folder, job_data.uid):
+            try:
+                os.remove(filepath)
+                found_job_file = True
+            except FileNotFoundError:
+                continue
+            except OSError as err:
+                found_job_file = True
+                file_delete_errors += 1
+                logger.error("Unable to delete job file %s: %s", filepath, err)
+        if found_job_file:
             deleted_job_files += 1
-        except FileNotFoundError:
+        else:
             missing_job_files += 1
-        except OSError as err:
-            file_delete_errors += 1
-            logger.error("Unable to delete job file %s: %s", filepath, err)
 
     stale_job_ids = [job_data.id for job_data in job_snapshots]
     if stale_job_ids:
@@ -1607,10 +1925,10 @@ def task_cleanup_search_sessions():
 check_json_storage(db.app.config.get("JSON_FOLDER"))
 
 # Connect to the Kvrocks and keep this index for all indexing.
-db.app.config["KVROCKS_IDX"] = KVrocksIndexer(
-    host=db.app.config.get("KVROCKS_HOST", "localhost"),
-    port=db.app.config.get("KVROCKS_PORT", 6666),
-)
+# It shares the process-wide connection pool with the views.
+db.app.config["KVROCKS_IDX"] = KVrocksIndexer.from_config(db.app.config)
+# A new index needs no value dictionary backfill.
+db.app.config["KVROCKS_IDX"].mark_empty_value_indexes_ready()
 
 # Connect to the Mieili DB ( if the index is not present create IT)
 client = meilisearch.Client(
@@ -1625,6 +1943,10 @@ if db.app.config["ONLINETLD"]:
     db.app.config["TLDS"] = fetch_tlds()
 db.app.config["TLDS"] += db.app.config["TLDADD"]  # Append to the list the custom TLDs.
 
+# Rebuild the getjob dispatcher queues, they may be stale after a restart.
+_refill_job_dispatcher()
+db.session.remove()
+
 client.create_index("plum")
 index = client.index("plum")
 # Save the client Index to the global config.
@@ -1651,4 +1973,20 @@ scheduler.add_job(
     max_instances=1,
     minutes=db.app.config.get("SCHEDULER_DELAY"),
 )
+# Export finished jobs on their own cadence, so slow indexing never delays
+# job creation in the tick above. sndjob queues finished jobs for the export
+# thread, the interval job only sweeps the jobs the queue missed.
+scheduler.add_job(
+    func=task_export_worker,
+    trigger="interval",
+    max_instances=1,
+    coalesce=True,
+    seconds=_get_scheduler_int_config(
+        "EXPORT_SWEEP_INTERVAL_SECONDS", DEFAULT_EXPORT_SWEEP_INTERVAL_SECONDS
+    ),
+    next_run_time=utcnow_aware(),
+)
 scheduler.start()
+threading.Thread(
+    target=_run_export_queue_consumer, name="export-queue", daemon=True
+).start()
@@ -0,0 +1,148 @@
+"""
+Per-job export manifest and flush checkpoint.
+
+The exporter records the documents of each parsed job and which of them are
+already in Meilisearch and Kvrocks. A failed or interrupted pass is resumed
+by the next one: flushed documents are neither parsed nor sent again, and
+a job whose documents were all flushed is marked exported without reading
+its result file.
+"""
+
+import logging
+
+import redis
+
+try:
+    from .timeutils import utcnow_iso
+except ImportError:
+    from timeutils import utcnow_iso
+
+logger = logging.getLogger("flask_appbuilder")
+
+MANIFEST_STATUS_PARSED = "parsed"
+MANIFEST_STATUS_FAILED = "failed"
+
+
+class ExportManifest:
+    """
+    Export state of unexported jobs, kept in Kvrocks.
+
+    export:manifest:{job_id} holds the parse status and document count,
+    export:manifest:{job_id}:docs maps each document id to its port hash and
+    export:flushed:{job_id} is the set of document ids written to both
+    backends. The keys are dropped once the job is marked exported and
+    expire after ttl_seconds otherwise.
+
+    The checkpoint is an optimization only: on a Kvrocks error it is
+    skipped and the job is exported in full.
+    """
+
+    MANIFEST_PREFIX = "export:manifest:"
+    FLUSHED_PREFIX = "export:flushed:"
+    WRITE_CHUNK_SIZE = 1000
+
+    def __init__(self, redis_client, ttl_seconds=7 * 24 * 3600):
+        self.r = redis_client
+        self.ttl_seconds = ttl_seconds
+
+    def _keys(self, job_id):
+        return (
+            f"{self.MANIFEST_PREFIX}{job_id}",
+            f"{self.MANIFEST_PREFIX}{job_id}:docs",
+            f"{self.FLUSHED_PREFIX}{job_id}",
+        )
+
+    def get_states(self, job_ids):
+        """
+        Return {job_id: {"status", "documents", "flushed"}} for known jobs.
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for job_id in job_ids:
+                manifest_key, _docs_key, flushed_key = self._keys(job_id)
+                pipe.hmget(manifest_key, "status", "documents")
+                pipe.smembers(flushed_key)
+            replies = pipe.execute()
+        except redis.RedisError as error:
+            logger.warning("Export manifest: Kvrocks read failed: %s", error)
+            return {}
+
+        states = {}
+        for index, job_id in enumerate(job_ids):
+            (status, documents), flushed = replies[2 * index : 2 * index + 2]
+            if status is None and not flushed:
+                continue
+            states[job_id] = {
+                "status": status,
+                "documents": int(documents or 0),
+                "flushed": set(flushed),
+            }
+        return states
+
+    def record(self, job_id, status, documents, skipped=0, error_message=""):
+        """
+        Store the parse result of one job.
+
+        documents is the list of (document id, port hash) of the job.
+        """
+        manifest_key, docs_key, _flushed_key = self._keys(job_id)
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            pipe.hset(
+                manifest_key,
+                mapping={
+                    "status": status,
+                    "documents": len(documents),
+                    "skipped": skipped,
+                    "parsed_at": utcnow_iso(),
+                    "error": str(error_message or "")[:500],
+                },
+            )
+            pipe.delete(docs_key)
+            for start in range(0, len(documents), self.WRITE_CHUNK_SIZE):
+                pipe.hset(
+                    docs_key,
+                    mapping=dict(documents[start : start + self.WRITE_CHUNK_SIZE]),
+                )
+            pipe.expire(manifest_key, self.ttl_seconds)
+            pipe.expire(docs_key, self.ttl_seconds)
+            pipe.execute()
+        except redis.RedisError as error:
+            logger.warning(
+                "Export manifest: Kvrocks write failed for job %s: %s", job_id, error
+            )
+
+    def mark_flushed(self, doc_refs):
+        """
+        Checkpoint (job_id, document id) pairs written to both backends.
+        """
+        doc_ids_by_job = {}
+        for job_id, doc_id in doc_refs:
+            doc_ids_by_job.setdefault(job_id, []).append(doc_id)
+        if not doc_ids_by_job:
+            return
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for job_id, doc_ids in doc_ids_by_job.items():
+                flushed_key = self._keys(job_id)[2]
+                pipe.sadd(flushed_key, *doc_ids)
+                pipe.expire(flushed_key, self.ttl_seconds)
+            pipe.execute()
+        except redis.RedisError as error:
+            logger.warning("Export manifest: Kvrocks checkpoint failed: %s", error)
+
+    def clear(self, job_ids):
+        """
+        Drop the manifest and checkpoint of exported jobs.
+        """
+        keys = [key for job_id in job_ids for key in self._keys(job_id)]
+        if not keys:
+            return
+        try:
+            for start in range(0, len(keys), self.WRITE_CHUNK_SIZE):
+                self.r.delete(*keys[start : start + self.WRITE_CHUNK_SIZE])
+        except redis.RedisError as error:
+            logger.warning("Export manifest: Kvrocks cleanup failed: %s", error)
@@ -0,0 +1,162 @@
+"""
+Parse the result files of finished jobs for the export.
+
+The export runs these functions in worker processes when
+EXPORT_PARSE_WORKERS > 1. The module only imports its sibling helpers, never
+the app package, so spawned workers load it from the utils directory
+without building a second Flask app or starting a second scheduler.
+"""
+
+import importlib
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+try:
+    from .export_manifest import MANIFEST_STATUS_FAILED, MANIFEST_STATUS_PARSED
+    from .port_documents import split_scan_result_by_port
+    from .result_parser import parse_json
+    from .result_storage import find_result_path, iter_result_hosts
+except ImportError:
+    from export_manifest import MANIFEST_STATUS_FAILED, MANIFEST_STATUS_PARSED
+    from port_documents import split_scan_result_by_port
+    from result_parser import parse_json
+    from result_storage import find_result_path, iter_result_hosts
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORT_PARSE_WORKER_STATE = {}
+_END_OF_RESULT = object()
+
+
+def parse_export_job(job, input_dir, parser_config, tag_rules):
+    """
+    Load, split and parse the result file of one finished job.
+
+    Documents listed in job["flushed_ids"] were exported by an earlier pass
+    and are not parsed again. Returns the job, its (Meili document, Kvrocks
+    document) pairs, its manifest and the load/split/parse durations in
+    seconds. The manifest lists the (document id, port hash) of every
+    document of the job, an unreadable result file gives a failed manifest
+    and no documents.
+    """
+    started_at = time.perf_counter()
+    flushed_ids = job.get("flushed_ids") or ()
+    manifest = {
+        "status": MANIFEST_STATUS_PARSED,
+        "documents": [],
+        "skipped": 0,
+        "error": "",
+    }
+    documents = []
+    load_seconds = 0.0
+    split_seconds = 0.0
+    try:
+        filepath = find_result_path(input_dir, job["uid"])
+        if filepath is None:
+            raise FileNotFoundError(f"No result file for job {job['uid']}")
+
+        # NDJSON results are decoded one host at a time, so the host being
+        # parsed is the only one held in memory.
+        scan_results = iter_result_hosts(filepath)
+        while True:
+            load_started_at = time.perf_counter()
+            item = next(scan_results, _END_OF_RESULT)
+            load_seconds += time.perf_counter() - load_started_at
+            if item is _END_OF_RESULT:
+                break
+            split_started_at = time.perf_counter()
+            objects_to_save = split_scan_result_by_port(item)
+            split_seconds += time.perf_counter() - split_started_at
+            for object_to_save in objects_to_save:
+                manifest["documents"].append(
+                    (object_to_save["id"], object_to_save["body"]["hsh256"])
+                )
+                if object_to_save["id"] in flushed_ids:
+                    manifest["skipped"] += 1
+                    continue
+                parsed_doc = parse_json(
+                    object_to_save,
+                    parser_config,
+                    tag_rules=tag_rules,
+                )
+                documents.append((object_to_save, parsed_doc))
+    except (OSError, EOFError, ValueError) as error:
+        documents = []
+        manifest = {
+            "status": MANIFEST_STATUS_FAILED,
+            "documents": [],
+            "skipped": 0,
+            "error": str(error),
+        }
+    timings = {
+        "load": load_seconds,
+        "split": split_seconds,
+        "parse": time.perf_counter() - started_at - load_seconds - split_seconds,
+    }
+    return job, documents, manifest, timings
+
+
+def init_export_parse_worker(input_dir, parser_config, tag_rules):
+    """
+    Initialize one export parser process with read-only parser state.
+
+    The state is passed as initargs, so it reaches spawned workers too.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    EXPORT_PARSE_WORKER_STATE["input_dir"] = input_dir
+    EXPORT_PARSE_WORKER_STATE["parser_config"] = parser_config
+    EXPORT_PARSE_WORKER_STATE["tag_rules"] = tag_rules
+
+
+def parse_export_job_worker(job):
+    """
+    Parse one job result file in an export parser process.
+    """
+    return parse_export_job(
+        job,
+        EXPORT_PARSE_WORKER_STATE["input_dir"],
+        EXPORT_PARSE_WORKER_STATE["parser_config"],
+        EXPORT_PARSE_WORKER_STATE["tag_rules"],
+    )
+
+
+def _load_worker_export_parser():
+    """
+    Return this module imported as the top-level export_parser module.
+
+    Workers unpickle the pool functions by module name: under its app.utils
+    name they would import the app package first. The utils directory is
+    added to sys.path, which the workers inherit from this process.
+    """
+    if UTILS_DIR not in sys.path:
+        sys.path.append(UTILS_DIR)
+    return importlib.import_module("export_parser")
+
+
+def iter_parsed_export_jobs(jobs, input_dir, parser_config, tag_rules, workers):
+    """
+    Yield parse_export_job results in job order, in worker processes when
+    workers > 1.
+
+    parser_config and tag_rules are pickled to the workers, parser_config
+    should come from result_parser.normalize_db_conf.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield parse_export_job(job, input_dir, parser_config, tag_rules)
+        return
+
+    # Workers come from a forkserver, not from a fork of the multi-threaded
+    # scheduler process, so they never inherit a lock held by another thread.
+    # The server preloads the parser once, the parser state goes in initargs.
+    worker_parser = _load_worker_export_parser()
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["export_parser"])
+    with context.Pool(
+        processes=min(workers, len(jobs)),
+        initializer=worker_parser.init_export_parse_worker,
+        initargs=(input_dir, parser_config, tag_rules),
+    ) as pool:
+        yield from pool.imap(worker_parser.parse_export_job_worker, jobs)
@@ -0,0 +1,146 @@
+"""
+Queue of finished job ids waiting for export.
+
+sndjob pushes the id of each finished job, the scheduler export thread pops
+them right away instead of waiting for the next scan of the jobs table.
+"""
+
+from collections import deque
+import logging
+import threading
+
+import redis
+
+from .. import db
+from ..models import Jobs
+from .kvrocks import KVrocksIndexer
+
+logger = logging.getLogger("flask_appbuilder")
+
+_export_queue = None
+_export_queue_lock = threading.Lock()
+
+
+class ExportQueue:
+    """
+    Job ids handed from sndjob to the export thread.
+
+    Ids go to the export:pending Kvrocks list, so they survive a restart and
+    can be pushed by another process, and an in-process event wakes the
+    export thread at once. Ids are kept in memory while Kvrocks is down.
+    Ids lost in a crash are picked up by the export recovery sweep.
+    """
+
+    KVROCKS_KEY = "export:pending"
+
+    def __init__(self, redis_client):
+        self.r = redis_client
+        self._local = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.pushed_total = 0
+        self.fallback_total = 0
+
+    def push(self, *job_ids):
+        """
+        Queue finished job ids and wake the export thread.
+        """
+        if not job_ids:
+            return
+        try:
+            self.r.rpush(self.KVROCKS_KEY, *job_ids)
+        except redis.RedisError as error:
+            logger.warning(
+                "Export queue: Kvrocks push failed, keeping %s jobs in memory: %s",
+                len(job_ids),
+                error,
+            )
+            with self._lock:
+                self._local.extend(job_ids)
+                self.fallback_total += len(job_ids)
+        with self._lock:
+            self.pushed_total += len(job_ids)
+        self._wakeup.set()
+
+    def wait(self, timeout):
+        """
+        Block until a push or timeout seconds, return True when woken by a push.
+        """
+        woken = self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return woken
+
+    def pop_batch(self, max_jobs):
+        """
+        Pop up to max_jobs distinct job ids, in-memory ones first.
+        """
+        with self._lock:
+            job_ids = [
+                self._local.popleft() for _ in range(min(max_jobs, len(self._local)))
+            ]
+        if len(job_ids) < max_jobs:
+            try:
+                job_ids.extend(
+                    self.r.lpop(self.KVROCKS_KEY, max_jobs - len(job_ids)) or []
+                )
+            except redis.RedisError as error:
+                logger.warning("Export queue: Kvrocks pop failed: %s", error)
+
+        unique_ids = []
+        seen = set()
+        for job_id in job_ids:
+            try:
+                job_id = int(job_id)
+            except (TypeError, ValueError):
+                continue
+            if job_id not in seen:
+                seen.add(job_id)
+                unique_ids.append(job_id)
+        return unique_ids
+
+    def stats(self):
+        """
+        Return the queue depth and push counters.
+        """
+        with self._lock:
+            local_depth = len(self._local)
+            pushed_total = self.pushed_total
+            fallback_total = self.fallback_total
+        try:
+            kvrocks_depth = self.r.llen(self.KVROCKS_KEY)
+        except redis.RedisError:
+            kvrocks_depth = None
+        return {
+            "depth": local_depth + (kvrocks_depth or 0),
+            "kvrocks_depth": kvrocks_depth,
+            "memory_depth": local_depth,
+            "pushed": pushed_total,
+            "memory_fallbacks": fallback_total,
+        }
+
+
+def get_export_queue(config):
+    """
+    Return the process-wide ExportQueue on the configured Kvrocks.
+    """
+    global _export_queue
+
+    with _export_queue_lock:
+        if _export_queue is None:
+            _export_queue = ExportQueue(KVrocksIndexer.from_config(config).r)
+        return _export_queue
+
+
+def count_export_backlog():
+    """
+    Count finished jobs waiting for export.
+    """
+    return (
+        db.session.query(Jobs.id)
+        .filter(
+            Jobs.active == False,
+            Jobs.exported == False,
+            Jobs.finished == True,
+        )
+        .count()
+    )
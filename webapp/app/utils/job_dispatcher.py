@@ -0,0 +1,148 @@
+"""
+Per-priority FIFO queues of the job ids waiting for an agent.
+
+The scheduler refills the queues from the jobs table, getjob pops one id in
+O(1) instead of scanning the queued jobs on every agent poll.
+"""
+
+import logging
+import threading
+
+import redis
+
+from .kvrocks import KVrocksIndexer
+
+logger = logging.getLogger("flask_appbuilder")
+
+# Job priorities accepted by Jobs.validate_priority.
+JOB_PRIORITIES = (0, 1, 2, 3, 4)
+
+_job_dispatcher = None
+_job_dispatcher_lock = threading.Lock()
+
+
+class JobDispatcher:
+    """
+    Queued job ids kept in one Kvrocks list per priority.
+
+    jobs:queue:{priority} holds the ids in job_creation order. LPOP hands
+    each id to a single agent, even across processes. The jobs table stays
+    the source of truth: getjob still claims the popped id with a
+    conditional UPDATE, so ids of jobs claimed, deleted or retagged since
+    the last refill are skipped, and jobs missing from the lists are added
+    back by the next refill.
+    """
+
+    KEY_PREFIX = "jobs:queue:"
+    WRITE_CHUNK_SIZE = 1000
+
+    def __init__(self, redis_client):
+        self.r = redis_client
+        self._lock = threading.Lock()
+        self.popped_total = 0
+        self.stale_total = 0
+        self.refills_total = 0
+
+    def _key(self, priority):
+        return f"{self.KEY_PREFIX}{priority}"
+
+    def depths(self):
+        """
+        Return {priority: queued ids} in one round trip.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for priority in JOB_PRIORITIES:
+            pipe.llen(self._key(priority))
+        return dict(zip(JOB_PRIORITIES, (int(depth) for depth in pipe.execute())))
+
+    def pop(self, priority):
+        """
+        Pop the oldest queued job id of one priority, None when empty.
+        """
+        job_id = self.r.lpop(self._key(priority))
+        if job_id is None:
+            return None
+        with self._lock:
+            self.popped_total += 1
+        return int(job_id)
+
+    def push(self, priority, *job_ids):
+        """
+        Append job ids to the tail of one priority queue.
+        """
+        if job_ids:
+            self.r.rpush(self._key(priority), *job_ids)
+
+    def requeue(self, priority, job_id):
+        """
+        Put back a popped job id at the head of its queue.
+        """
+        self.r.lpush(self._key(priority), job_id)
+
+    def record_stale(self):
+        """
+        Count a popped id whose job was no longer waiting.
+        """
+        with self._lock:
+            self.stale_total += 1
+
+    def refill(self, queued_jobs):
+        """
+        Replace the queues with (job id, priority) pairs in FIFO order.
+
+        The lists are swapped in one MULTI transaction, so getjob never sees
+        a half-filled queue. Returns {priority: queued ids}.
+        """
+        job_ids_by_priority = {priority: [] for priority in JOB_PRIORITIES}
+        for job_id, priority in queued_jobs:
+            try:
+                priority = int(priority)
+            except (TypeError, ValueError):
+                continue
+            if priority in job_ids_by_priority:
+                job_ids_by_priority[priority].append(job_id)
+
+        pipe = self.r.pipeline(transaction=True)
+        for priority, job_ids in job_ids_by_priority.items():
+            key = self._key(priority)
+            pipe.delete(key)
+            for start in range(0, len(job_ids), self.WRITE_CHUNK_SIZE):
+                pipe.rpush(key, *job_ids[start : start + self.WRITE_CHUNK_SIZE])
+        pipe.execute()
+        with self._lock:
+            self.refills_total += 1
+        return {
+            priority: len(job_ids) for priority, job_ids in job_ids_by_priority.items()
+        }
+
+    def stats(self):
+        """
+        Return the queue depths and dispatch counters.
+        """
+        with self._lock:
+            counters = {
+                "popped": self.popped_total,
+                "stale": self.stale_total,
+                "refills": self.refills_total,
+            }
+        try:
+            depths = self.depths()
+        except redis.RedisError:
+            depths = None
+        return {
+            "depth": sum(depths.values()) if depths is not None else None,
+            "depths": depths,
+            **counters,
+        }
+
+
+def get_job_dispatcher(config):
+    """
+    Return the process-wide JobDispatcher on the configured Kvrocks.
+    """
+    global _job_dispatcher
+
+    with _job_dispatcher_lock:
+        if _job_dispatcher is None:
+            _job_dispatcher = JobDispatcher(KVrocksIndexer.from_config(config).r)
+        return _job_dispatcher
@@ -0,0 +1,225 @@
+"""
+Agent leases of active jobs.
+
+getjob leases every claimed job until Jobs.lease_expires, for a time sized
+from the job addresses and ports. Agents extend the leases of the jobs they
+still run through /bot_api/beacon, and the scheduler requeues the jobs whose
+agent let the lease expire, so their targets do not stay working forever.
+"""
+
+# pylint: disable=no-name-in-module
+
+from datetime import timedelta
+
+from sqlalchemy import case, func, text
+
+from .. import db
+from ..models import Jobs, assoc_jobs_targets
+from .scan_cycles import release_orphaned_scan_states_for_profile
+
+DEFAULT_JOB_LEASE_SECONDS = 3600
+DEFAULT_JOB_LEASE_SECONDS_PER_PROBE = 0.01
+DEFAULT_JOB_LEASE_MAX_SECONDS = 86400
+DEFAULT_JOB_LEASE_MAX_RETRIES = 3
+DEFAULT_JOB_LEASE_EXPIRY_BATCH_SIZE = 1000
+# Nmap scans its top 1000 ports when a job has no port list.
+DEFAULT_NMAP_PORT_COUNT = 1000
+
+
+def count_scan_ports(scan_ports):
+    """
+    Return the number of ports probed by a job port list.
+    """
+    ports = [port for port in (scan_ports or "").split(",") if port.strip()]
+    return len(ports) or DEFAULT_NMAP_PORT_COUNT
+
+
+def compute_lease_seconds(scan_unit_count, scan_ports, config):
+    """
+    Return the lease of a job, in seconds.
+
+    JOB_LEASE_SECONDS plus JOB_LEASE_SECONDS_PER_PROBE for every address and
+    port pair of the job, capped by JOB_LEASE_MAX_SECONDS.
+    """
+    base_seconds = int(config.get("JOB_LEASE_SECONDS", DEFAULT_JOB_LEASE_SECONDS))
+    per_probe = float(
+        config.get("JOB_LEASE_SECONDS_PER_PROBE", DEFAULT_JOB_LEASE_SECONDS_PER_PROBE)
+    )
+    max_seconds = int(
+        config.get("JOB_LEASE_MAX_SECONDS", DEFAULT_JOB_LEASE_MAX_SECONDS)
+    )
+    probes = max(int(scan_unit_count or 1), 1) * count_scan_ports(scan_ports)
+    return max(min(int(base_seconds + probes * per_probe), max_seconds), base_seconds)
+
+
+def extend_job_leases(bot_id, job_uids, now, config):
+    """
+    Renew the leases of the listed active jobs held by one bot.
+
+    Returns the number of renewed leases. Jobs of other bots, or no longer
+    active, are ignored.
+    """
+    job_uids = sorted({str(job_uid) for job_uid in job_uids or []})
+    if not job_uids:
+        return 0
+
+    jobs = (
+        db.session.query(Jobs)
+        .filter(
+            Jobs.uid.in_(job_uids),
+            Jobs.bot_id == bot_id,
+            Jobs.active == True,
+            Jobs.finished == False,
+        )
+        .all()
+    )
+    for job in jobs:
+        lease_seconds = compute_lease_seconds(
+            job.scan_unit_count, job.scan_ports, config
+        )
+        job.lease_expires = now + timedelta(seconds=lease_seconds)
+    return len(jobs)
+
+
+def requeue_expired_jobs(now, batch_size, max_retries):
+    """
+    Put back in queue a bounded batch of active jobs whose lease expired.
+
+    Each requeue increments Jobs.lease_retries. A job whose lease expires
+    again after max_retries requeues is deleted instead and its target states
+    released, so the next jobs of the profile group those targets anew.
+    The changes are committed.
+    """
+    expired_rows = (
+        db.session.query(
+            Jobs.id,
+            Jobs.bot_id,
+            Jobs.scanprofile_id,
+            Jobs.lease_retries,
+        )
+        .filter(
+            Jobs.active == True,
+            Jobs.finished == False,
+            Jobs.lease_expires < now,
+        )
+        .order_by(Jobs.lease_expires.asc())
+        .limit(batch_size)
+        .all()
+    )
+    if not expired_rows:
+        return {"expired_jobs": 0, "requeued_jobs": 0, "abandoned_jobs": 0}
+
+    still_expired = (
+        Jobs.active == True,
+        Jobs.finished == False,
+        Jobs.lease_expires < now,
+    )
+    retry_ids = [
+        row.id for row in expired_rows if (row.lease_retries or 0) < max_retries
+    ]
+    abandon_ids = [
+        row.id for row in expired_rows if (row.lease_retries or 0) >= max_retries
+    ]
+
+    requeued_jobs = 0
+    if retry_ids:
+        # The guard skips jobs completed since the select above.
+        requeued_jobs = (
+            db.session.query(Jobs)
+            .filter(Jobs.id.in_(retry_ids), *still_expired)
+            .update(
+                {
+                    Jobs.active: False,
+                    Jobs.job_start: None,
+                    Jobs.lease_expires: None,
+                    Jobs.lease_retries: func.coalesce(Jobs.lease_retries, 0) + 1,
+                },
+                synchronize_session=False,
+            )
+            or 0
+        )
+
+    abandoned_jobs = 0
+    if abandon_ids:
+        abandon_ids = [
+            row.id
+            for row in db.session.query(Jobs.id).filter(
+                Jobs.id.in_(abandon_ids), *still_expired
+            )
+        ]
+    if abandon_ids:
+        profile_by_job = {row.id: row.scanprofile_id for row in expired_rows}
+        target_ids_by_profile = {}
+        for job_id, target_id in db.session.query(
+            assoc_jobs_targets.c.job_id, assoc_jobs_targets.c.target_id
+        ).filter(assoc_jobs_targets.c.job_id.in_(abandon_ids)):
+            profile_id = profile_by_job.get(job_id)
+            if profile_id is not None:
+                target_ids_by_profile.setdefault(profile_id, set()).add(target_id)
+
+        db.session.execute(
+            assoc_jobs_targets.delete().where(
+                assoc_jobs_targets.c.job_id.in_(abandon_ids)
+            )
+        )
+        abandoned_jobs = (
+            db.session.query(Jobs)
+            .filter(Jobs.id.in_(abandon_ids))
+            .delete(synchronize_session=False)
+        )
+        for profile_id, target_ids in target_ids_by_profile.items():
+            release_orphaned_scan_states_for_profile(profile_id, target_ids)
+
+    bot_ids = sorted({row.bot_id for row in expired_rows if row.bot_id is not None})
+    for bot_id in bot_ids:
+        db.session.execute(
+            text("""
+                UPDATE bots
+                   SET running = 0
+                 WHERE id = :bot_id
+                   AND running = 1
+                   AND NOT EXISTS (
+                        SELECT 1
+                          FROM jobs
+                         WHERE jobs.bot_id = bots.id
+                           AND jobs.active = 1
+                   )
+                """),
+            {"bot_id": bot_id},
+        )
+    db.session.commit()
+    return {
+        "expired_jobs": len(expired_rows),
+        "requeued_jobs": requeued_jobs,
+        "abandoned_jobs": abandoned_jobs,
+    }
+
+
+def get_job_lease_stats(now):
+    """
+    Return lease counters for the Jobs view.
+    """
+    leased, expired, next_expiry = (
+        db.session.query(
+            func.count(Jobs.id),
+            func.coalesce(func.sum(case((Jobs.lease_expires < now, 1), else_=0)), 0),
+            func.min(Jobs.lease_expires),
+        )
+        .filter(Jobs.active == True)
+        .one()
+    )
+    retried_jobs, retries = (
+        db.session.query(
+            func.count(Jobs.id),
+            func.coalesce(func.sum(Jobs.lease_retries), 0),
+        )
+        .filter(Jobs.finished == False, Jobs.lease_retries > 0)
+        .one()
+    )
+    return {
+        "leased": leased,
+        "expired": expired,
+        "next_expiry": next_expiry,
+        "retried_jobs": retried_jobs,
+        "retries": retries,
+    }
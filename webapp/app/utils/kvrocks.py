@@ -9,10 +9,17 @@ try:
     from .timeutils import utcnow_iso
 except ImportError:
     from timeutils import utcnow_iso
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+import hashlib
 import ipaddress
+import json
 import logging
 import re
+import threading
+import time
+import uuid
 import redis
 from netaddr import IPNetwork
 
@@ -20,14 +27,361 @@ logger = logging.getLogger("flask_appbuilder")
 HTTP_HEADER_NAME_RE = re.compile(r"^[!#$%&'*+\-.^_`|~0-9a-z]+$")
 
 
+class KVrocksConnectionPool(redis.BlockingConnectionPool):
+    """
+    Thread-safe blocking pool that also counts created connections and waits.
+
+    A wait is a request that found every connection of the pool in use.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self.created_total = 0
+        self.waits_total = 0
+        super().__init__(*args, **kwargs)
+
+    def make_connection(self):
+        with self._stats_lock:
+            self.created_total += 1
+        return super().make_connection()
+
+    def get_connection(self, *args, **kwargs):
+        if self.pool.empty():
+            with self._stats_lock:
+                self.waits_total += 1
+        return super().get_connection(*args, **kwargs)
+
+    def stats(self):
+        """
+        Return max_connections, open, in_use, idle, created and waits counters.
+        """
+        open_connections = len(self._connections)
+        idle = sum(1 for connection in list(self.pool.queue) if connection)
+        return {
+            "max_connections": self.max_connections,
+            "open": open_connections,
+            "in_use": open_connections - idle,
+            "idle": idle,
+            "created": self.created_total,
+            "waits": self.waits_total,
+        }
+
+
+class KVrocksIngestStream:
+    """
+    Pipelined ingest of parsed documents into one KVrocksIndexer.
+
+    The read phase of the next batches runs on a small thread pool while the
+    previous batch is written, writes stay in submission order on one thread.
+    At most max_in_flight_batches submitted batches are held, which bounds the
+    memory and the pipelined commands in flight. A batch sharing a UID with an
+    in-flight batch waits for it to be written, so it reads the written state.
+    """
+
+    def __init__(
+        self,
+        indexer,
+        batch_size=10000,
+        include_tags=True,
+        max_in_flight_batches=2,
+        read_workers=1,
+        progress=None,
+    ):
+        if batch_size < 1 or max_in_flight_batches < 1 or read_workers < 1:
+            raise ValueError(
+                "batch_size, max_in_flight_batches and read_workers must be >= 1"
+            )
+        self.indexer = indexer
+        self.batch_size = batch_size
+        self.max_in_flight_batches = max_in_flight_batches
+        self.progress = progress
+        # pylint: disable-next=protected-access
+        self._context = indexer._index_context(include_tags)
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(indexer.INDEX_COUNTERS, 0)
+        self._stats.update(
+            {
+                "batches": 0,
+                "read_ms": 0.0,
+                "read_ms_max": 0.0,
+                "write_ms": 0.0,
+                "write_ms_max": 0.0,
+                "wait_ms": 0.0,
+            }
+        )
+        self._in_flight = deque()
+        self._read_pool = ThreadPoolExecutor(
+            max_workers=read_workers, thread_name_prefix="kvrocks-ingest-read"
+        )
+        self._write_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="kvrocks-ingest-write"
+        )
+        self._started_at = time.perf_counter()
+        self._closed_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, docs):
+        """
+        Queue documents for indexing, blocking while the in-flight cap is hit.
+
+        The documents are copied, the caller may reuse its list. Returns the
+        write futures of the queued batches, done once they are written.
+        """
+        if self._closed_at is not None:
+            raise RuntimeError("Ingest stream is closed")
+        write_futures = []
+        for i in range(0, len(docs), self.batch_size):
+            batch = list(docs[i : i + self.batch_size])
+            uids = {doc["uid"] for doc in batch}
+            while self._in_flight and (
+                len(self._in_flight) >= self.max_in_flight_batches
+                or any(not uids.isdisjoint(pending) for pending, _ in self._in_flight)
+            ):
+                self._collect_oldest()
+            read_future = self._read_pool.submit(self._read_phase, batch)
+            write_future = self._write_pool.submit(
+                self._write_phase, batch, read_future
+            )
+            self._in_flight.append((uids, write_future))
+            write_futures.append(write_future)
+        return write_futures
+
+    def flush(self):
+        """
+        Wait until every submitted document is written.
+        """
+        while self._in_flight:
+            self._collect_oldest()
+
+    def close(self):
+        """
+        Flush the stream and stop its threads.
+        """
+        if self._closed_at is not None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._read_pool.shutdown(wait=True)
+            self._write_pool.shutdown(wait=True)
+            self._closed_at = time.perf_counter()
+
+    def get_stats(self):
+        """
+        Return the document counters, docs_per_second and phase latencies.
+
+        read_ms/write_ms are the average per batch, *_ms_max the slowest
+        batch and wait_ms the total time submit() and flush() were blocked.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        elapsed = (self._closed_at or time.perf_counter()) - self._started_at
+        batches = stats["batches"]
+        stats["elapsed_seconds"] = round(elapsed, 3)
+        stats["docs_per_second"] = (
+            round(stats["documents"] / elapsed, 1) if elapsed else 0.0
+        )
+        for phase in ("read", "write"):
+            stats[f"{phase}_ms"] = round(
+                stats[f"{phase}_ms"] / batches if batches else 0.0, 2
+            )
+            stats[f"{phase}_ms_max"] = round(stats[f"{phase}_ms_max"], 2)
+        stats["wait_ms"] = round(stats["wait_ms"], 2)
+        return stats
+
+    def _record(self, phase, started_at):
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        with self._stats_lock:
+            self._stats[f"{phase}_ms"] += elapsed_ms
+            if f"{phase}_ms_max" in self._stats:
+                self._stats[f"{phase}_ms_max"] = max(
+                    self._stats[f"{phase}_ms_max"], elapsed_ms
+                )
+
+    def _collect_oldest(self):
+        _uids, write_future = self._in_flight.popleft()
+        started_at = time.perf_counter()
+        try:
+            write_future.result()
+        finally:
+            self._record("wait", started_at)
+
+    def _read_phase(self, batch):
+        # pylint: disable=protected-access
+        started_at = time.perf_counter()
+        state = self.indexer._read_index_state(batch, self._context)
+        self._record("read", started_at)
+        return state
+
+    def _write_phase(self, batch, read_future):
+        # pylint: disable=protected-access
+        state = read_future.result()
+        started_at = time.perf_counter()
+        batch_stats = self.indexer._write_index_batch(batch, state, self._context)
+        self._record("write", started_at)
+        with self._stats_lock:
+            for key, value in batch_stats.items():
+                self._stats[key] += value
+            self._stats["batches"] += 1
+        if self.progress:
+            self.progress(self.get_stats())
+
+
 class KVrocksIndexer:
     """
     Class for using Kvrock as search engine.w
 
     """
 
-    def __init__(self, host="localhost", port=6666):
-        self.r = redis.Redis(host=host, port=port, decode_responses=True, db=0)
+    QUERY_TMP_PREFIX = "tmp:query:"
+    QUERY_TMP_TTL_SECONDS = 60
+    QUERY_CHUNK_SIZE = 1000
+    TRIGRAM_FIELDS_KEY = "tri:fields"
+    # field -> "building" or "ready", readers only use ready dictionaries.
+    VALUE_INDEX_FIELDS_KEY = "vals:fields"
+    TRIGRAM_MAX_VALUE_LENGTH = 256
+    QUERY_CACHE_PREFIX = "cache:query:"
+    QUERY_CACHE_GENERATION_KEY = "cache:query:generation"
+    QUERY_CACHE_STATS_KEY = "cache:query:stats"
+    QUERY_CACHE_TTL_SECONDS = 120
+    QUERY_CACHE_MAX_UIDS = 200000
+    # Stored in every cached set so an empty result still has a key.
+    QUERY_CACHE_MARKER = "-"
+    # "compact" keeps first_seen/last_seen in the seen ZSETs only, without
+    # doc:{uid} hashes. Switched by tools/kvrocks_timestamps.py.
+    TIMESTAMP_STORAGE_KEY = "schema:timestamp_storage"
+    TIMESTAMP_STORAGE_HASH = "hash"
+    TIMESTAMP_STORAGE_COMPACT = "compact"
+    # Generic fields written by add_documents_batch.
+    INDEX_FIELDS = [
+        # "ip",
+        "net",
+        # "as",
+        # "as_number",
+        # "as_name",
+        # "as_description",
+        # "as_country",
+        "fqdn",
+        "fqdn_requested",
+        "host",
+        "domain",
+        "domain_requested",
+        "tld",
+        "tag",
+        # "url_path",
+        "port",
+        # "protocol",
+        "http_title",
+        "http_favicon_path",
+        "http_favicon_mmhash",
+        "http_favicon_md5",
+        "http_favicon_sha256",
+        # "http_filename",
+        "http_cookiename",
+        "http_etag",
+        "http_header",
+        "http_headval",
+        "http_server",
+        # "email",
+        "x509_issuer",
+        "x509_md5",
+        "x509_sha1",
+        "x509_sha256",
+        "x509_subject",
+        "x509_san",
+        # "time_filter_before_after",
+        # "ssh_fingerprint",
+        # "ttl_count",
+        # "hsh"
+        "banner",
+    ]
+    INDEX_COUNTERS = ("documents", "reindexed", "seen_only", "unchanged")
+    # uid -> digest of the indexed values, see document_fingerprint.
+    FINGERPRINTS_KEY = "doc_fingerprints"
+    # Defaults of the process-wide connection pool, see pool_options_from_config.
+    POOL_OPTIONS = {
+        "max_connections": 50,
+        "timeout": 20,
+        "socket_timeout": 60,
+        "socket_connect_timeout": 5,
+        "health_check_interval": 30,
+    }
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, host="localhost", port=6666, pool_options=None):
+        self.r = redis.Redis(
+            connection_pool=self.get_connection_pool(host, port, pool_options)
+        )
+
+    @classmethod
+    def get_connection_pool(cls, host="localhost", port=6666, pool_options=None):
+        """
+        Return the process-wide connection pool of one Kvrocks endpoint.
+
+        Every KVrocksIndexer of the process shares it, pool_options only apply
+        when the pool is created by the first indexer of the endpoint.
+        """
+        pool_key = (str(host), int(port))
+        with cls._pools_lock:
+            pool = cls._pools.get(pool_key)
+            if pool is None:
+                options = {**cls.POOL_OPTIONS, **(pool_options or {})}
+                pool = KVrocksConnectionPool(
+                    host=pool_key[0],
+                    port=pool_key[1],
+                    db=0,
+                    decode_responses=True,
+                    **options,
+                )
+                cls._pools[pool_key] = pool
+            return pool
+
+    @classmethod
+    def pool_options_from_config(cls, config):
+        """
+        Read KVROCKS_POOL_* settings from a Flask config or any mapping.
+        """
+        config_names = {
+            "max_connections": "KVROCKS_POOL_MAX_CONNECTIONS",
+            "timeout": "KVROCKS_POOL_TIMEOUT",
+            "socket_timeout": "KVROCKS_SOCKET_TIMEOUT",
+            "socket_connect_timeout": "KVROCKS_SOCKET_CONNECT_TIMEOUT",
+            "health_check_interval": "KVROCKS_HEALTH_CHECK_INTERVAL",
+        }
+        options = {}
+        for option, config_name in config_names.items():
+            value = config.get(config_name)
+            if value in (None, ""):
+                continue
+            try:
+                options[option] = max(1, int(value))
+            except (TypeError, ValueError):
+                logger.warning("Ignoring invalid %s=%r", config_name, value)
+        return options
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build an indexer on the shared pool from KVROCKS_HOST/PORT and
+        KVROCKS_POOL_* settings.
+        """
+        return cls(
+            config.get("KVROCKS_HOST", "localhost"),
+            config.get("KVROCKS_PORT", 6666),
+            pool_options=cls.pool_options_from_config(config),
+        )
+
+    def get_pool_stats(self):
+        """
+        Return the connection pool counters of this indexer.
+        """
+        return self.r.connection_pool.stats()
 
     @staticmethod
     def now_rfc():
@@ -88,6 +442,42 @@ class KVrocksIndexer:
             first_seen, last_seen = last_seen, first_seen
         return first_seen, last_seen
 
+    def get_timestamp_storage(self):
+        """
+        Return the timestamp storage mode: hash (default) or compact.
+        """
+        return self.r.get(self.TIMESTAMP_STORAGE_KEY) or self.TIMESTAMP_STORAGE_HASH
+
+    def uses_compact_timestamps(self):
+        """
+        True when timestamps are only stored in first_seen_index/last_seen_index.
+        """
+        return self.get_timestamp_storage() == self.TIMESTAMP_STORAGE_COMPACT
+
+    def _read_seen_ranges(self, uids, compact=None):
+        """
+        Return raw (first_seen, last_seen) pairs in uids order.
+
+        Values come from doc:{uid} with HMGET, or from the seen ZSETs with
+        ZMSCORE in compact mode, QUERY_CHUNK_SIZE UIDs per pipeline.
+        """
+        if compact is None:
+            compact = self.uses_compact_timestamps()
+        seen_ranges = []
+        for i in range(0, len(uids), self.QUERY_CHUNK_SIZE):
+            chunk = uids[i : i + self.QUERY_CHUNK_SIZE]
+            pipe = self.r.pipeline(transaction=False)
+            if compact:
+                pipe.zmscore("first_seen_index", chunk)
+                pipe.zmscore("last_seen_index", chunk)
+                first_scores, last_scores = pipe.execute()
+                seen_ranges.extend(zip(first_scores, last_scores))
+            else:
+                for uid in chunk:
+                    pipe.hmget(f"doc:{uid}", "first_seen", "last_seen")
+                seen_ranges.extend(tuple(values) for values in pipe.execute())
+        return seen_ranges
+
     def flushdb(self):
         """
         This method will drop the index database
@@ -113,6 +503,14 @@ class KVrocksIndexer:
             return []
 
         prefix = str(prefix or "").strip().lower()
+        if self._has_value_index(field):
+            values = []
+            for value in self._iter_value_index_prefix(field, prefix):
+                values.append(value)
+                if len(values) >= limit:
+                    break
+            return values
+
         pattern = f"{field}:{prefix}*" if prefix else f"{field}:*"
         values = []
         seen = set()
@@ -133,152 +531,218 @@ class KVrocksIndexer:
           uid, ip, parsed search fields
 
         it does "batch insertions", up to 10K per insert by default
+
+        Returns the count of documents, reindexed ones, seen_only ones whose
+        fields are unchanged, and unchanged ones (same seen range too).
+        Use open_ingest_stream() to overlap the batches of a long import.
         """
+        context = self._index_context(include_tags)
+        stats = dict.fromkeys(self.INDEX_COUNTERS, 0)
+        for i in range(0, len(docs), batch_size):
+            batch = docs[i : i + batch_size]
+            state = self._read_index_state(batch, context)
+            for key, value in self._write_index_batch(batch, state, context).items():
+                stats[key] += value
+        return stats
+
+    def open_ingest_stream(
+        self,
+        batch_size=10000,
+        include_tags=True,
+        max_in_flight_batches=2,
+        read_workers=1,
+        progress=None,
+    ):
+        """
+        Return a KVrocksIngestStream feeding this indexer, see its docstring.
+        """
+        return KVrocksIngestStream(
+            self,
+            batch_size=batch_size,
+            include_tags=include_tags,
+            max_in_flight_batches=max_in_flight_batches,
+            read_workers=read_workers,
+            progress=progress,
+        )
 
-        keywords = [
-            # "ip",
-            "net",
-            # "as",
-            # "as_number",
-            # "as_name",
-            # "as_description",
-            # "as_country",
-            "fqdn",
-            "fqdn_requested",
-            "host",
-            "domain",
-            "domain_requested",
-            "tld",
-            "tag",
-            # "url_path",
-            "port",
-            # "protocol",
-            "http_title",
-            "http_favicon_path",
-            "http_favicon_mmhash",
-            "http_favicon_md5",
-            "http_favicon_sha256",
-            # "http_filename",
-            "http_cookiename",
-            "http_etag",
-            "http_header",
-            "http_headval",
-            "http_server",
-            # "email",
-            "x509_issuer",
-            "x509_md5",
-            "x509_sha1",
-            "x509_sha256",
-            "x509_subject",
-            "x509_san",
-            # "time_filter_before_after",
-            # "ssh_fingerprint",
-            # "ttl_count",
-            # "hsh"
-            "banner",
-        ]
+    def index_documents_stream(self, docs, batch_size=10000, **stream_options):
+        """
+        Index an iterator of parsed documents through an ingest stream.
+
+        Returns the stream stats, see KVrocksIngestStream.get_stats().
+        """
+        with self.open_ingest_stream(batch_size=batch_size, **stream_options) as stream:
+            batch = []
+            for doc in docs:
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    stream.submit(batch)
+                    batch = []
+            if batch:
+                stream.submit(batch)
+        return stream.get_stats()
+
+    def _index_context(self, include_tags=True):
+        """
+        Return the settings shared by the batches of one import.
+        """
+        keywords = list(self.INDEX_FIELDS)
         if not include_tags:
             keywords.remove("tag")
+        return {
+            "keywords": keywords,
+            "trigram_fields": self.get_trigram_fields(),
+            "compact_timestamps": self.uses_compact_timestamps(),
+        }
 
-        for i in range(0, len(docs), batch_size):
-            batch = docs[i : i + batch_size]
-            existing_pipe = self.r.pipeline(transaction=False)
-            for doc in batch:
-                existing_pipe.hgetall(f"doc:{doc['uid']}")
-            existing_docs = existing_pipe.execute()
-
-            existing_values_pipe = self.r.pipeline(transaction=False)
-            for doc in batch:
-                uid = doc["uid"]
-                for field in keywords:
-                    existing_values_pipe.smembers(f"{field}s:{uid}")
-            existing_values = existing_values_pipe.execute()
+    def _read_index_state(self, batch, context):
+        """
+        Read phase of one batch: seen ranges, fingerprints and forward sets.
+        """
+        keywords = context["keywords"]
+        uids = [doc["uid"] for doc in batch]
+        existing_docs = self._read_seen_ranges(
+            uids, compact=context["compact_timestamps"]
+        )
 
-            pipe = self.r.pipeline(transaction=False)
-            existing_values_iter = iter(existing_values)
-            for doc, existing in zip(batch, existing_docs):
-                uid = doc["uid"]
-                ip = doc["ip"]
+        # An indexed UID with the same fingerprint only needs its seen
+        # range updated, its field indexes are left untouched.
+        fingerprints = [self.document_fingerprint(doc, keywords) for doc in batch]
+        state_pipe = self.r.pipeline(transaction=False)
+        state_pipe.smismember("all_uids", uids)
+        state_pipe.hmget(self.FINGERPRINTS_KEY, uids)
+        indexed_flags, stored_fingerprints = state_pipe.execute()
+        seen_only_flags = [
+            bool(indexed) and stored == fingerprint
+            for indexed, stored, fingerprint in zip(
+                indexed_flags, stored_fingerprints, fingerprints
+            )
+        ]
 
-                # http_servers = doc.get("http_servers, [])
-                # http_cookies = doc.get("http_cookies", [])
-                # http_titles = doc.get("http_titles", [])
-                last_seen = doc.get("last_seen")  # Document last time scanned.
+        existing_values_pipe = self.r.pipeline(transaction=False)
+        for doc, seen_only in zip(batch, seen_only_flags):
+            if seen_only:
+                continue
+            uid = doc["uid"]
+            for field in keywords:
+                existing_values_pipe.smembers(f"{field}s:{uid}")
+        existing_values = existing_values_pipe.execute()
+        return existing_docs, fingerprints, seen_only_flags, existing_values
 
-                uid_key = f"doc:{uid}"
-                first_seen = doc.get("first_seen", last_seen)
-                first_seen, last_seen = self.normalize_seen_range(first_seen, last_seen)
+    def _write_index_batch(self, batch, state, context):
+        """
+        Write phase of one batch, returns its INDEX_COUNTERS.
+        """
+        keywords = context["keywords"]
+        trigram_fields = context["trigram_fields"]
+        compact_timestamps = context["compact_timestamps"]
+        existing_docs, fingerprints, seen_only_flags, existing_values = state
+        stats = dict.fromkeys(self.INDEX_COUNTERS, 0)
 
-                if existing:
-                    # For the same UID ( meaning same scan result hsh256)
-                    # we recompute last seen and first seen.
-                    # We do like that because if case of insert bulk
-                    existing_first_seen = self.normalize_timestamp(
-                        existing.get("first_seen")
-                    )
-                    existing_last_seen = self.normalize_timestamp(
-                        existing.get("last_seen")
+        pipe = self.r.pipeline(transaction=False)
+        existing_values_iter = iter(existing_values)
+        removed_values = []
+        trigram_slots = []
+        for doc, existing, fingerprint, seen_only in zip(
+            batch, existing_docs, fingerprints, seen_only_flags
+        ):
+            uid = doc["uid"]
+            ip = doc["ip"]
+            stats["documents"] += 1
+
+            # http_servers = doc.get("http_servers, [])
+            # http_cookies = doc.get("http_cookies", [])
+            # http_titles = doc.get("http_titles", [])
+            last_seen = doc.get("last_seen")  # Document last time scanned.
+
+            uid_key = f"doc:{uid}"
+            first_seen = doc.get("first_seen", last_seen)
+            first_seen, last_seen = self.normalize_seen_range(first_seen, last_seen)
+
+            if any(value is not None for value in existing):
+                # For the same UID ( meaning same scan result hsh256)
+                # we recompute last seen and first seen.
+                # We do like that because if case of insert bulk
+                existing_first_seen = self.normalize_timestamp(existing[0])
+                existing_last_seen = self.normalize_timestamp(existing[1])
+                if existing_first_seen is not None:
+                    first_seen = (
+                        existing_first_seen
+                        if first_seen is None
+                        else min(existing_first_seen, first_seen)
                     )
-                    if existing_first_seen is not None:
-                        first_seen = (
-                            existing_first_seen
-                            if first_seen is None
-                            else min(existing_first_seen, first_seen)
-                        )
-                    if existing_last_seen is not None:
-                        last_seen = (
-                            existing_last_seen
-                            if last_seen is None
-                            else max(existing_last_seen, last_seen)
-                        )
-                    first_seen, last_seen = self.normalize_seen_range(
-                        first_seen, last_seen
+                if existing_last_seen is not None:
+                    last_seen = (
+                        existing_last_seen
+                        if last_seen is None
+                        else max(existing_last_seen, last_seen)
                     )
+                first_seen, last_seen = self.normalize_seen_range(first_seen, last_seen)
 
-                # Set the "LastSeen/FirstSeen" Index
-                if first_seen is not None and last_seen is not None:
-                    pipe.zadd("last_seen_index", {uid: last_seen})
-                    pipe.zadd("first_seen_index", {uid: first_seen})
+            if seen_only:
+                if (first_seen, last_seen) == self.normalize_seen_range(*existing):
+                    stats["unchanged"] += 1
+                    continue
+                stats["seen_only"] += 1
+            else:
+                stats["reindexed"] += 1
 
-                # Store hashset uid
+            # Set the "LastSeen/FirstSeen" Index
+            if first_seen is not None and last_seen is not None:
+                pipe.zadd("last_seen_index", {uid: last_seen})
+                pipe.zadd("first_seen_index", {uid: first_seen})
+
+            # Store hashset uid, the compact mode relies on uid:{uid} and
+            # the seen indexes only.
+            if not compact_timestamps:
                 doc_mapping = {"ip": ip}
                 if first_seen is not None and last_seen is not None:
                     doc_mapping["first_seen"] = str(first_seen)
                     doc_mapping["last_seen"] = str(last_seen)
                 pipe.hset(uid_key, mapping=doc_mapping)
 
-                # Index IP
-                pipe.sadd("all_ips", ip)  # Generic Spaces all IP
-                pipe.sadd("all_uids", uid)  # Generic Space all UID's
-
-                pipe.sadd(f"ip:{ip}", uid)  # Create a Set of many UID per IP
-                pipe.set(
-                    f"uid:{uid}", ip
-                )  # Create a hash of One UID that give only one IP
-
-                # Index network from 16 down to 24
-                for mask in range(16, 25):
-                    network = str(IPNetwork(f"{ip}/{mask}").network) + f"/{mask}"
-                    pipe.sadd(f"net:{network}", uid)
-                # Generic indexing for any othe keyword
-                # uid = unique identifier for the entry
-                for field in keywords:
-                    previous_values = next(existing_values_iter, set()) or set()
-                    for previous_value in previous_values:
-                        if previous_value:
-                            pipe.srem(f"{field}:{previous_value}", uid)
-                    pipe.delete(f"{field}s:{uid}")
-
-                    values = doc.get(field, [])
-                    # print(f"{field} - {values} - {uid}")
-                    # We have still NONE in table
-                    for v in values:
-                        if v:
-                            v = v.lower()
-                            # print(f"{field} - {v} - {uid}")
-                            pipe.sadd(f"{field}:{v}", uid)
-                            pipe.sadd(f"{field}s:{uid}", v)
-            pipe.execute()
+            if seen_only:
+                continue
+
+            # Index IP
+            pipe.sadd("all_ips", ip)  # Generic Spaces all IP
+            pipe.sadd("all_uids", uid)  # Generic Space all UID's
+
+            pipe.sadd(f"ip:{ip}", uid)  # Create a Set of many UID per IP
+            pipe.set(f"uid:{uid}", ip)  # Create a hash of One UID that give only one IP
+
+            # Index network from 16 down to 24
+            for mask in range(16, 25):
+                network = str(IPNetwork(f"{ip}/{mask}").network) + f"/{mask}"
+                pipe.sadd(f"net:{network}", uid)
+            # Generic indexing for any othe keyword
+            # uid = unique identifier for the entry
+            # Only the values added or removed since the last indexing
+            # are written.
+            for field in keywords:
+                previous_values = next(existing_values_iter, set()) or set()
+                previous_values = {value for value in previous_values if value}
+                values = doc.get(field, [])
+                # We have still NONE in table
+                new_values = {v.lower() for v in values if v}
+                for value in previous_values - new_values:
+                    pipe.srem(f"{field}:{value}", uid)
+                    pipe.srem(f"{field}s:{uid}", value)
+                    removed_values.append((field, value))
+                for value in new_values - previous_values:
+                    pipe.sadd(f"{field}:{value}", uid)
+                    pipe.sadd(f"{field}s:{uid}", value)
+                    if field in trigram_fields:
+                        trigram_slots.append((len(pipe), field, value))
+                    pipe.zadd(self.value_index_key(field), {value: 0})
+            pipe.hset(self.FINGERPRINTS_KEY, uid, fingerprint)
+        if not len(pipe):
+            return stats
+        pipe.incr(self.QUERY_CACHE_GENERATION_KEY)
+        results = pipe.execute()
+        self._index_new_trigram_values(results, trigram_slots)
+        self._prune_value_index(removed_values)
+        return stats
 
     def replace_field_values_batch(self, field, docs, batch_size=10000):
         """
@@ -291,6 +755,7 @@ class KVrocksIndexer:
         if not field:
             raise ValueError("Field name is required")
 
+        trigram_fields = self.get_trigram_fields()
         for i in range(0, len(docs), batch_size):
             normalized_batch = []
             for doc in docs[i : i + batch_size]:
@@ -322,18 +787,230 @@ class KVrocksIndexer:
             existing_values = existing_pipe.execute()
 
             pipe = self.r.pipeline(transaction=False)
+            removed_values = []
+            trigram_slots = []
             for doc, previous_values in zip(normalized_batch, existing_values):
                 uid = doc["uid"]
                 for value in previous_values or []:
                     candidate = str(value).strip().lower()
                     if candidate:
                         pipe.srem(f"{field}:{candidate}", uid)
+                        if candidate not in doc[field]:
+                            removed_values.append((field, candidate))
 
                 pipe.delete(f"{field}s:{uid}")
                 for value in doc[field]:
                     pipe.sadd(f"{field}:{value}", uid)
                     pipe.sadd(f"{field}s:{uid}", value)
-            pipe.execute()
+                    if field in trigram_fields:
+                        trigram_slots.append((len(pipe), field, value))
+                    pipe.zadd(self.value_index_key(field), {value: 0})
+                # The field changed outside add_documents_batch.
+                pipe.hdel(self.FINGERPRINTS_KEY, uid)
+            pipe.incr(self.QUERY_CACHE_GENERATION_KEY)
+            results = pipe.execute()
+            self._index_new_trigram_values(results, trigram_slots)
+            self._prune_value_index(removed_values)
+
+    @staticmethod
+    def document_fingerprint(doc, fields):
+        """
+        Digest of the IP and the lowercase indexed values of doc for fields.
+
+        A UID is a content hash, a document indexed again with the same
+        fingerprint only needs its seen range updated.
+        """
+        payload = [str(doc.get("ip") or "")]
+        for field in fields:
+            values = doc.get(field, []) or []
+            payload.append(sorted({str(value).lower() for value in values if value}))
+        return hashlib.blake2b(
+            json.dumps(payload).encode("utf-8"), digest_size=8
+        ).hexdigest()
+
+    def forget_fingerprints(self, uids=None):
+        """
+        Drop document fingerprints, all of them when uids is None, so the next
+        add_documents_batch reindexes the fields of these documents.
+        """
+        if uids is None:
+            return self.r.delete(self.FINGERPRINTS_KEY)
+        uids = list(uids)
+        if not uids:
+            return 0
+        return self.r.hdel(self.FINGERPRINTS_KEY, *uids)
+
+    @staticmethod
+    def value_index_key(field):
+        """
+        Return the lex sorted set listing every indexed value of one field.
+        """
+        return f"vals:{field}"
+
+    def mark_empty_value_indexes_ready(self):
+        """
+        Flag every value dictionary ready on an index without documents.
+
+        A dictionary is complete when every indexed value went through
+        add_documents_batch, older indexes wait for the sql_upd backfill.
+        Fields already listed, a backfill in progress included, are kept.
+        """
+        if self.r.exists("all_uids"):
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for field in self.INDEX_FIELDS:
+            pipe.hsetnx(self.VALUE_INDEX_FIELDS_KEY, field, "ready")
+        pipe.execute()
+
+    def _prune_value_index(self, removed_values):
+        """
+        Drop (field, value) pairs from vals:{field} once {field}:{value} is empty.
+        """
+        removed_values = list(dict.fromkeys(removed_values))
+        if not removed_values:
+            return
+
+        count_pipe = self.r.pipeline(transaction=False)
+        for field, value in removed_values:
+            count_pipe.scard(f"{field}:{value}")
+        counts = count_pipe.execute()
+
+        pipe = self.r.pipeline(transaction=False)
+        pruned_values = {}
+        for (field, value), count in zip(removed_values, counts):
+            if not count:
+                pipe.zrem(self.value_index_key(field), value)
+                pruned_values.setdefault(field, []).append(value)
+        pipe.execute()
+
+        trigram_fields = self.get_trigram_fields() if pruned_values else set()
+        for field, values in pruned_values.items():
+            if field in trigram_fields:
+                self.remove_trigram_values(field, values)
+
+    @staticmethod
+    def value_trigrams(value):
+        """
+        Return the distinct 3-character grams of one indexed value.
+        """
+        value = str(value or "")
+        return {value[i : i + 3] for i in range(len(value) - 2)}
+
+    def get_trigram_fields(self, ready_only=False):
+        """
+        Return fields with a trigram index, building or ready.
+
+        Writers maintain every listed field, readers only use ready ones.
+        """
+        states = self.r.hgetall(self.TRIGRAM_FIELDS_KEY)
+        return {
+            field
+            for field, state in states.items()
+            if not ready_only or state == "ready"
+        }
+
+    def add_trigram_values(self, field, values):
+        """
+        Add values to the tri:{field}:{gram} postings of one field.
+
+        Values longer than TRIGRAM_MAX_VALUE_LENGTH are kept in tri_long:{field}
+        and always verified, so big banners do not blow up the index.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for value in values:
+            if len(value) > self.TRIGRAM_MAX_VALUE_LENGTH:
+                pipe.sadd(f"tri_long:{field}", value)
+                continue
+            for gram in self.value_trigrams(value):
+                pipe.sadd(f"tri:{field}:{gram}", value)
+        pipe.execute()
+
+    def remove_trigram_values(self, field, values):
+        """
+        Remove values from the tri:{field}:{gram} postings of one field.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for value in values:
+            if len(value) > self.TRIGRAM_MAX_VALUE_LENGTH:
+                pipe.srem(f"tri_long:{field}", value)
+                continue
+            for gram in self.value_trigrams(value):
+                pipe.srem(f"tri:{field}:{gram}", value)
+        pipe.execute()
+
+    def _index_new_trigram_values(self, results, trigram_slots):
+        """
+        Add trigrams for values whose vals:{field} ZADD created a new member.
+        """
+        new_values = {}
+        for slot, field, value in trigram_slots:
+            if results[slot]:
+                new_values.setdefault(field, []).append(value)
+        for field, values in new_values.items():
+            self.add_trigram_values(field, values)
+
+    def _get_trigram_matches(self, field, search_value, prefix=""):
+        """
+        Return field values containing search_value using the trigram postings.
+
+        prefix restricts matches to values starting with it, the substring is
+        then searched after the prefix (used by http_headval header scoping).
+        Return None when the field has no ready trigram index or the search
+        value is shorter than a trigram.
+        """
+        search_value = str(search_value)
+        grams = self.value_trigrams(search_value)
+        if not grams or field not in self.get_trigram_fields(ready_only=True):
+            return None
+
+        pipe = self.r.pipeline(transaction=False)
+        pipe.sinter([f"tri:{field}:{gram}" for gram in sorted(grams)])
+        pipe.smembers(f"tri_long:{field}")
+        candidates, long_values = pipe.execute()
+        return sorted(
+            value
+            for value in set(candidates) | set(long_values)
+            if value.startswith(prefix) and search_value in value[len(prefix) :]
+        )
+
+    def _has_value_index(self, field):
+        """
+        Return whether vals:{field} is flagged ready in vals:fields.
+
+        New documents create vals:{field} before older indexes are
+        backfilled, so the key existing does not make it complete.
+        """
+        return self.r.hget(self.VALUE_INDEX_FIELDS_KEY, field) == "ready"
+
+    def _iter_value_index_prefix(self, field, prefix=""):
+        """
+        Yield vals:{field} values starting with prefix with ZRANGEBYLEX pages.
+        """
+        key = self.value_index_key(field)
+        prefix = str(prefix or "").encode()
+        lower = b"[" + prefix if prefix else "-"
+        # UTF-8 never contains 0xff, every value starting with prefix is below.
+        upper = b"[" + prefix + b"\xff" if prefix else "+"
+        while True:
+            values = self.r.zrangebylex(
+                key, lower, upper, start=0, num=self.QUERY_CHUNK_SIZE
+            )
+            yield from values
+            if len(values) < self.QUERY_CHUNK_SIZE:
+                break
+            lower = b"(" + values[-1].encode()
+
+    def _iter_value_index_substring(self, field, search_value):
+        """
+        Yield vals:{field} values containing search_value with ZSCAN MATCH.
+        """
+        search_value = str(search_value)
+        pattern = f"*{self._escape_redis_glob(search_value)}*"
+        for value, _score in self.r.zscan_iter(
+            self.value_index_key(field), match=pattern, count=self.QUERY_CHUNK_SIZE
+        ):
+            if search_value in value:
+                yield value
 
     def get_uids_by_time_range(self, from_ts, to_ts):
         """
@@ -439,13 +1116,13 @@ class KVrocksIndexer:
         """
         return "".join(f"\\{char}" if char in "\\*?[]" else char for char in str(value))
 
-    def _get_uids_for_http_headval(self, raw_value, suffix="", scoped_uids=None):
+    def _get_http_headval_keys(self, raw_value, suffix=""):
         """
-        Resolve http_headval:header[.modifier]:value against exact header names.
+        Return the http_headval:header:value keys matching one headval term.
         """
         raw_value = str(raw_value or "").strip().lower()
         if ":" not in raw_value:
-            return set()
+            return []
 
         header_name, search_value = raw_value.split(":", 1)
         header_name = header_name.strip()
@@ -456,32 +1133,211 @@ class KVrocksIndexer:
             or len(header_name) > 128
             or not HTTP_HEADER_NAME_RE.fullmatch(header_name)
         ):
-            return set()
+            return []
 
-        scoped_uids = set(scoped_uids) if scoped_uids is not None else None
         if not suffix:
-            uids = set(self.r.smembers(f"http_headval:{header_name}:{search_value}"))
-            return uids.intersection(scoped_uids) if scoped_uids is not None else uids
+            return [f"http_headval:{header_name}:{search_value}"]
 
         if suffix not in ("like", "lk", "begin", "bg"):
-            return set()
+            return []
 
-        matching_uids = set()
+        if suffix in ("like", "lk"):
+            values = self._get_trigram_matches(
+                "http_headval", search_value, prefix=f"{header_name}:"
+            )
+            if values is not None:
+                return [f"http_headval:{value}" for value in values]
+
+        if self._has_value_index("http_headval"):
+            if suffix in ("begin", "bg"):
+                values = self._iter_value_index_prefix(
+                    "http_headval", f"{header_name}:{search_value}"
+                )
+            else:
+                values = (
+                    value
+                    for value in self._iter_value_index_prefix(
+                        "http_headval", f"{header_name}:"
+                    )
+                    if search_value in value[len(header_name) + 1 :]
+                )
+            return [f"http_headval:{value}" for value in values]
+
+        matching_keys = []
         key_prefix = f"http_headval:{header_name}:"
         escaped_prefix = f"http_headval:{self._escape_redis_glob(header_name)}:"
         for key in self.r.scan_iter(match=f"{escaped_prefix}*"):
             if not key.startswith(key_prefix):
                 continue
             indexed_value = key[len(key_prefix) :]
-            if not self._modifier_matches(indexed_value, search_value, suffix):
-                continue
+            if self._modifier_matches(indexed_value, search_value, suffix):
+                matching_keys.append(key)
+        return matching_keys
+
+    def _get_uids_for_http_headval(self, raw_value, suffix="", scoped_uids=None):
+        """
+        Resolve http_headval:header[.modifier]:value against exact header names.
+        """
+        scoped_uids = set(scoped_uids) if scoped_uids is not None else None
+        matching_uids = set()
+        for key in self._get_http_headval_keys(raw_value, suffix):
             key_uids = set(self.r.smembers(key))
             if scoped_uids is not None:
                 key_uids.intersection_update(scoped_uids)
             matching_uids.update(key_uids)
         return matching_uids
 
-    def get_uids_by_criteria(self, criteria: dict):
+    def _get_keys_for_modifier(self, base_field, value, suffix):
+        """
+        Return the reverse index keys matching one field.modifier:value term.
+        """
+        if base_field == "http_headval":
+            return self._get_http_headval_keys(value, suffix)
+
+        value = str(value)
+        if suffix in ("like", "lk"):
+            values = self._get_trigram_matches(base_field, value)
+            if values is not None:
+                return [f"{base_field}:{indexed_value}" for indexed_value in values]
+
+        if self._has_value_index(base_field):
+            if suffix in ("begin", "bg"):
+                values = self._iter_value_index_prefix(base_field, value)
+            elif suffix in ("like", "lk"):
+                values = self._iter_value_index_substring(base_field, value)
+            else:
+                values = []
+            return [f"{base_field}:{indexed_value}" for indexed_value in values]
+
+        matching_keys = []
+        for key in self.r.scan_iter(f"{base_field}:*", count=1000):
+            indexed_value = key.split(":", 1)[1]
+            if self._modifier_matches(indexed_value, value, suffix):
+                matching_keys.append(key)
+        return matching_keys
+
+    def _store_uids(self, key, uids):
+        """
+        Write a Python UID set into a temporary query key.
+        """
+        uids = list(uids)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.delete(key)
+        for i in range(0, len(uids), self.QUERY_CHUNK_SIZE):
+            pipe.sadd(key, *uids[i : i + self.QUERY_CHUNK_SIZE])
+        pipe.expire(key, self.QUERY_TMP_TTL_SECONDS)
+        pipe.execute()
+        return len(uids)
+
+    def _union_store(self, key, source_keys):
+        """
+        SUNIONSTORE source keys into a temporary query key, chunked by key count.
+        """
+        self.r.delete(key)
+        for i in range(0, len(source_keys), self.QUERY_CHUNK_SIZE):
+            self.r.sunionstore(key, [key, *source_keys[i : i + self.QUERY_CHUNK_SIZE]])
+        self.r.expire(key, self.QUERY_TMP_TTL_SECONDS)
+        return self.r.scard(key)
+
+    def _intersect_store(self, dest_key, source_keys):
+        """
+        SINTERSTORE source keys into a temporary query key and return its size.
+        """
+        cardinality = self.r.sinterstore(dest_key, source_keys)
+        self.r.expire(dest_key, self.QUERY_TMP_TTL_SECONDS)
+        return cardinality
+
+    @staticmethod
+    def canonical_criteria_groups(criteria_groups):
+        """
+        Return OR query groups in a stable form: sorted fields, sorted unique
+        lowercase values, sorted groups.
+        """
+        canonical_groups = []
+        for criteria in criteria_groups or []:
+            canonical_group = []
+            for field, values in (criteria or {}).items():
+                if not isinstance(values, (list, tuple, set)):
+                    values = [values]
+                canonical_values = sorted({str(value).lower() for value in values})
+                canonical_group.append([str(field), canonical_values])
+            canonical_groups.append(sorted(canonical_group))
+        # Duplicate OR groups do not change the union.
+        unique_groups = {json.dumps(group) for group in canonical_groups}
+        return [json.loads(group) for group in sorted(unique_groups)]
+
+    def query_cache_key(self, criteria_groups, from_ts, to_ts, scope="seen"):
+        """
+        Return the result cache key of one query inside one time window.
+
+        The key embeds the current index generation, bumped by every indexing
+        batch, so results cached before new documents are never read again.
+        """
+        generation = self.r.get(self.QUERY_CACHE_GENERATION_KEY) or 0
+        payload = json.dumps(
+            {
+                "groups": self.canonical_criteria_groups(criteria_groups),
+                "from_ts": from_ts,
+                "to_ts": to_ts,
+                "scope": scope,
+            },
+            sort_keys=True,
+        )
+        digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        return f"{self.QUERY_CACHE_PREFIX}{generation}:{digest}"
+
+    def get_query_cache(self, cache_key):
+        """
+        Return the cached UID set of cache_key, or None on a miss.
+        """
+        uids = self.r.smembers(cache_key)
+        if not uids:
+            self.r.hincrby(self.QUERY_CACHE_STATS_KEY, "misses", 1)
+            return None
+        self.r.hincrby(self.QUERY_CACHE_STATS_KEY, "hits", 1)
+        uids.discard(self.QUERY_CACHE_MARKER)
+        return uids
+
+    def set_query_cache(self, cache_key, uids, ttl_seconds=None, max_uids=None):
+        """
+        Store a query result as a set expiring after ttl_seconds.
+
+        Results bigger than max_uids are not cached, returns True when stored.
+        """
+        ttl_seconds = int(ttl_seconds or self.QUERY_CACHE_TTL_SECONDS)
+        if max_uids is None:
+            max_uids = self.QUERY_CACHE_MAX_UIDS
+        uids = list(uids)
+        if len(uids) > max_uids:
+            return False
+        pipe = self.r.pipeline(transaction=False)
+        pipe.delete(cache_key)
+        pipe.sadd(cache_key, self.QUERY_CACHE_MARKER)
+        for i in range(0, len(uids), self.QUERY_CHUNK_SIZE):
+            pipe.sadd(cache_key, *uids[i : i + self.QUERY_CHUNK_SIZE])
+        pipe.expire(cache_key, ttl_seconds)
+        pipe.execute()
+        return True
+
+    def get_query_cache_stats(self):
+        """
+        Return query cache hits, misses, hit rate in percent and generation.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hgetall(self.QUERY_CACHE_STATS_KEY)
+        pipe.get(self.QUERY_CACHE_GENERATION_KEY)
+        counters, generation = pipe.execute()
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits * 100 / lookups, 1) if lookups else 0.0,
+            "generation": int(generation or 0),
+        }
+
+    def get_uids_by_criteria(self, criteria: dict, explain=False):
         """
         multi-criteria search:
         - Exact match: field:value
@@ -498,189 +1354,292 @@ class KVrocksIndexer:
          'http_title.bg': ['ivanti'], 'http_cookie': ['JSESSIONID'], 'port': 80}
 
 
-        The method used is the following.
-        we get a first results, then and intersect with results of others keywords.
+        The method used is the following, every intersection stays on the
+        Kvrocks side in a temporary key, only the final UID set is read back.
 
-        1)   The inital results could be ip or cidr.
+        1) The inital results could be ip or cidr.
             This result is culumative, if 2 ip, or a ip or a cidr is given a "or" is done between them.
             to get the first results.
 
-        2) If there are no ip or cidr, given.
-            Then we look for the first exact match to get the inital list to intersect.
+        2) All exact match terms are planned with SCARD and applied from the
+            most selective to the least selective one (SINTERSTORE).
+            A term with an empty set stops the search.
 
-            2A) If there is no exact match.. then we get one query with modifier and we remove the modifier and do
-            a scan_iter to get the initial results
+            2A) If there is no ip/cidr and no exact match, the first modifier
+            term (avoiding port.) is resolved with SUNIONSTORE of its matching keys.
 
-        3 After that, for each remaining term, the results is intersected with the query...
+        3) After that, each remaining modifier term is unioned into a
+            temporary key and intersected with the current result.
 
-        Need to be improved:
-            DONOTSEARCH with port in 2B since every scan has obviously a PORT
-            1 and 2 user with sscan
-            Cache Results a couple of min ( hash query -> set + timeout).
-        """
+        4) .not/.nt terms are removed last with SDIFFSTORE, a group made only
+            of .not terms starts from all_uids.
 
-        remaining_criteria = dict(criteria)  # dict with all the key to seach.
+        With explain=True a (uids, plan) tuple is returned, plan being the list
+        of executed steps with their term cardinality and resulting cardinality.
 
-        if not remaining_criteria:
-            return []
+        Results are not cached here, callers that repeat a query inside the
+        same time window use query_cache_key/get_query_cache/set_query_cache.
+        """
+        plan = []
+        uids = []
+        if criteria:
+            scope_key = f"{self.QUERY_TMP_PREFIX}{uuid.uuid4().hex}"
+            match_key = f"{scope_key}:match"
+            try:
+                uids = self._run_criteria_plan(
+                    dict(criteria), scope_key, match_key, plan
+                )
+            finally:
+                self.r.delete(scope_key, match_key)
 
-        partial_result = None  # The Result space that will be intersected.
+        if explain:
+            return uids, plan
+        return uids
 
-        # 1) We manage IP first
-        if "ip" in remaining_criteria:
-            ip_vals = remaining_criteria.pop("ip")
+    def _run_criteria_plan(self, remaining_criteria, scope_key, match_key, plan):
+        """
+        Execute get_uids_by_criteria, recording each step in plan.
+        """
+        # Key holding the current result, only scope_key is ever written.
+        current_key = None
+        cardinality = None
+
+        # 1) We manage IP and CIDRS first, "or" between them.
+        if "ip" in remaining_criteria or "net" in remaining_criteria:
+            ip_vals = remaining_criteria.pop("ip", [])
             if not isinstance(ip_vals, list):
                 ip_vals = [ip_vals]
-
-            uids_ip = set()
-            for ip in ip_vals:
-                uids_ip.update(
-                    self.r.smembers(f"ip:{ip}")
-                )  # Adding to the partial results all the Give IP's.
-            partial_result = uids_ip
-            # print("ip result")
-            # print(partial_result)
-
-        # 1) We manage the CIDRS
-        if "net" in remaining_criteria:
-            net_vals = remaining_criteria.pop("net")
+            net_vals = remaining_criteria.pop("net", [])
             if not isinstance(net_vals, list):
                 net_vals = [net_vals]
 
-            uids_net = set()
-            # For each net required, add corresponding uid it to uid_nets
-            for net_val in net_vals:
-                uids_net.update(self._get_uids_for_net_value(net_val))
-
-            if partial_result is None:
-                partial_result = uids_net
+            ip_keys = [f"ip:{ip}" for ip in ip_vals]
+            if net_vals:
+                uids_seed = set(self.r.sunion(ip_keys)) if ip_keys else set()
+                for net_val in net_vals:
+                    uids_seed.update(self._get_uids_for_net_value(net_val))
+                cardinality = self._store_uids(scope_key, uids_seed)
             else:
-                partial_result |= uids_net  # union with previous results
-
-        # If the base seach is not there we create the basic set using one available exact match
-        if partial_result is None:
-            logger.debug("No IP/NET specified, get base UID")
-            found_base = False
-            for field, values in remaining_criteria.items():
-                if not isinstance(values, list):
-                    values = [values]
-                for value_index, value in enumerate(values):
-                    base_field, suffix = self._split_field_modifier(field)
-                    if base_field == "http_headval":
-                        uids = self._get_uids_for_http_headval(value, suffix)
-                        if uids:
-                            partial_result = set(uids)
-                            remaining_values = (
-                                values[:value_index] + values[value_index + 1 :]
-                            )
-                            if remaining_values:
-                                remaining_criteria[field] = remaining_values
-                            else:
-                                remaining_criteria.pop(field)
-                            found_base = True
-                            break
-                    elif suffix == "":
-                        logger.debug(
-                            "Generate partial result by Looking at %s", base_field
-                        )
-                        uids = self.r.smembers(f"{base_field}:{value}")
-                        if uids:
-                            partial_result = set(uids)
-                            remaining_values = (
-                                values[:value_index] + values[value_index + 1 :]
-                            )
-                            if remaining_values:
-                                remaining_criteria[field] = remaining_values
-                            else:
-                                remaining_criteria.pop(field)
-                            found_base = True
-                            break
-                if found_base:
-                    break
-
-                # 2A) fallback: if no base, scan first criterion remove the .modifier and do not pop
-            if partial_result is None:
-                logger.debug("No plein search, looking by any modifier")
-
-                # avoid using port as search ( as is retrieve everything.)
-                # if only port.modifier is given, it will still be used
-                field = None
-                for field, values in remaining_criteria.items():
-                    if not field.startswith("port."):
-                        break
-
-                if field is None:
-                    return []
+                cardinality = self._union_store(scope_key, ip_keys)
+            current_key = scope_key
+            plan.append(
+                {
+                    "step": "seed",
+                    "term": " ".join(
+                        [f"ip:{ip}" for ip in ip_vals] + [f"net:{n}" for n in net_vals]
+                    ),
+                    "cardinality": cardinality,
+                    "result": cardinality,
+                }
+            )
+            if not cardinality:
+                return []
 
-                base_field, suffix = self._split_field_modifier(field)
+        # 2) Plan exact terms by cardinality
+        exact_terms = []
+        modifier_terms = []
+        not_terms = []
+        for field, values in remaining_criteria.items():
+            if not isinstance(values, list):
+                values = [values]
+            base_field, suffix = self._split_field_modifier(field)
+            for value in values:
+                if suffix in ("not", "nt"):
+                    not_terms.append((field, base_field, value))
+                    continue
+                if suffix:
+                    modifier_terms.append((field, base_field, suffix, value))
+                    continue
                 if base_field == "http_headval":
-                    values = remaining_criteria.get(field, [])
-                    if not isinstance(values, list):
-                        values = [values]
-                    partial_result = set()
-                    for value in values:
-                        partial_result.update(
-                            self._get_uids_for_http_headval(value, suffix)
+                    keys = self._get_http_headval_keys(value)
+                    if not keys:
+                        plan.append(
+                            {
+                                "step": "intersect",
+                                "term": f"{field}:{value}",
+                                "cardinality": 0,
+                                "result": 0,
+                            }
                         )
-                    if not partial_result:
                         return []
-                    remaining_criteria.pop(field)
+                    key = keys[0]
                 else:
-                    logger.debug(
-                        "No usable criteria get uid list from Base field: %s",
-                        base_field,
+                    key = f"{base_field}:{value}"
+                exact_terms.append((f"{field}:{value}", key))
+
+        if exact_terms:
+            pipe = self.r.pipeline(transaction=False)
+            for _, key in exact_terms:
+                pipe.scard(key)
+            cardinalities = pipe.execute()
+            planned_terms = sorted(
+                [
+                    (term_cardinality, term, key)
+                    for (term, key), term_cardinality in zip(exact_terms, cardinalities)
+                ],
+                key=lambda item: item[0],
+            )
+            logger.debug("Exact terms plan %s", planned_terms)
+
+            for term_cardinality, term, key in planned_terms:
+                if not term_cardinality:
+                    plan.append(
+                        {
+                            "step": "seed" if current_key is None else "intersect",
+                            "term": term,
+                            "cardinality": 0,
+                            "result": 0,
+                        }
                     )
-                    partial_result = set()
-                    for key in self.r.scan_iter(match=f"{base_field}:*", count=1000):
-                        partial_result.update(self.r.smembers(key))
-                    if not partial_result:
-                        return []
+                    return []
 
-        if partial_result is None:
-            return []
+                if current_key is None:
+                    current_key = key
+                    cardinality = term_cardinality
+                    step = "seed"
+                else:
+                    cardinality = self._intersect_store(scope_key, [current_key, key])
+                    current_key = scope_key
+                    step = "intersect"
+                plan.append(
+                    {
+                        "step": step,
+                        "term": term,
+                        "cardinality": term_cardinality,
+                        "result": cardinality,
+                    }
+                )
+                if not cardinality:
+                    return []
 
-        # 3) Finally using the rest of criterais.
-        for field, values in remaining_criteria.items():
-            if not isinstance(values, list):
-                values = [values]
+        # 2A) fallback: no base, use the first modifier term avoiding port.
+        # A group made only of .not terms starts from every indexed document.
+        if current_key is None and not modifier_terms and not_terms:
+            current_key = "all_uids"
+            cardinality = self.r.scard(current_key)
+            plan.append(
+                {
+                    "step": "seed",
+                    "term": "all documents",
+                    "cardinality": cardinality,
+                    "result": cardinality,
+                }
+            )
+            if not cardinality:
+                return []
 
-            for value in values:
-                base_field, suffix = self._split_field_modifier(field)
-                matching_uids = set()
+        if current_key is None:
+            if not modifier_terms:
+                return []
+            logger.debug("No plein search, looking by any modifier")
+            seed_index = 0
+            for index, term in enumerate(modifier_terms):
+                if not term[0].startswith("port."):
+                    seed_index = index
+                    break
+            field, base_field, suffix, value = modifier_terms.pop(seed_index)
+            keys = self._get_keys_for_modifier(base_field, value, suffix)
+            cardinality = self._union_store(scope_key, keys) if keys else 0
+            current_key = scope_key
+            plan.append(
+                {
+                    "step": "seed",
+                    "term": f"{field}:{value}",
+                    "keys": len(keys),
+                    "cardinality": cardinality,
+                    "result": cardinality,
+                }
+            )
+            if not cardinality:
+                return []
 
-                if base_field == "http_headval":
-                    partial_result = partial_result.intersection(
-                        self._get_uids_for_http_headval(
-                            value,
-                            suffix,
-                            scoped_uids=partial_result,
-                        )
-                    )
-                    continue
+        # 3) Finally using the rest of modifier criterias.
+        for field, base_field, suffix, value in modifier_terms:
+            keys = self._get_keys_for_modifier(base_field, value, suffix)
+            term_cardinality = self._union_store(match_key, keys) if keys else 0
+            if term_cardinality:
+                cardinality = self._intersect_store(scope_key, [current_key, match_key])
+            else:
+                cardinality = 0
+            current_key = scope_key
+            plan.append(
+                {
+                    "step": "intersect",
+                    "term": f"{field}:{value}",
+                    "keys": len(keys),
+                    "cardinality": term_cardinality,
+                    "result": cardinality,
+                }
+            )
+            if not cardinality:
+                return []
 
-                # handle .like / .lk / .begin / .bg
-                if suffix in ("like", "lk", "begin", "bg", "not", "nt"):
-                    # substring = value.rstrip("*")
-                    for key in self.r.scan_iter(f"{base_field}:*"):
-                        val = key.split(":", 1)[1]
-                        # If NOT is needed here later, use the already scoped
-                        # partial_result to subtract matching keys instead of
-                        # rescanning every UID value ad hoc.
-                        # IF like or begin we select it.
-                        if (suffix in ("like", "lk") and value in val) or (
-                            suffix in ("begin", "bg") and val.startswith(value)
-                        ):
-                            matching_uids.update(
-                                self.r.smembers(key).intersection(partial_result)
-                            )
-                    partial_result = partial_result.intersection(matching_uids)
-                else:
-                    # exact match
-                    uids = self.r.smembers(f"{base_field}:{value}")
-                    partial_result = partial_result.intersection(uids)
+        # 4) Exclude .not terms from the smallest result with SDIFFSTORE
+        for field, base_field, value in not_terms:
+            excluded_key = self._get_excluded_key(base_field, value, match_key)
+            term_cardinality = self.r.scard(excluded_key)
+            if term_cardinality:
+                cardinality = self.r.sdiffstore(scope_key, [current_key, excluded_key])
+                self.r.expire(scope_key, self.QUERY_TMP_TTL_SECONDS)
+                current_key = scope_key
+            plan.append(
+                {
+                    "step": "exclude",
+                    "term": f"{field}:{value}",
+                    "cardinality": term_cardinality,
+                    "result": cardinality,
+                }
+            )
+            if not cardinality:
+                return []
 
         # return an list of UUIDs
-        return list(partial_result or [])
+        return list(self.r.smembers(current_key))
+
+    def _get_excluded_key(self, base_field, value, match_key):
+        """
+        Return the key holding UIDs excluded by one field.not:value term.
+        """
+        if base_field == "net":
+            self._store_uids(match_key, self._get_uids_for_net_value(value))
+            return match_key
+        if base_field == "http_headval":
+            keys = self._get_http_headval_keys(value)
+            if len(keys) == 1:
+                return keys[0]
+            self._union_store(match_key, keys)
+            return match_key
+        return f"{base_field}:{value}"
+
+    def _get_excluded_uids(self, base_field, value, scoped_uids):
+        """
+        Return the scoped UIDs excluded by one field.not:value term.
+
+        Small excluded sets are read whole, otherwise only the scoped UIDs are
+        checked with pipelined SMISMEMBER.
+        """
+        if base_field == "net":
+            return self._get_uids_for_net_value(value, scoped_uids)
+
+        if base_field == "http_headval":
+            keys = self._get_http_headval_keys(value)
+        else:
+            keys = [f"{base_field}:{value}"]
+        scoped_uids = list(scoped_uids)
+        excluded_uids = set()
+        for key in keys:
+            if self.r.scard(key) <= len(scoped_uids):
+                excluded_uids.update(
+                    set(self.r.smembers(key)).intersection(scoped_uids)
+                )
+                continue
+
+            pipe = self.r.pipeline(transaction=False)
+            for i in range(0, len(scoped_uids), self.QUERY_CHUNK_SIZE):
+                pipe.smismember(key, scoped_uids[i : i + self.QUERY_CHUNK_SIZE])
+            flags = [flag for chunk in pipe.execute() for flag in chunk]
+            excluded_uids.update(uid for uid, flag in zip(scoped_uids, flags) if flag)
+        return excluded_uids
 
     def get_uids_by_criteria_scoped(self, criteria: dict, scoped_uids):
         """
@@ -724,7 +1683,11 @@ class KVrocksIndexer:
                 base_field, suffix = self._split_field_modifier(field)
                 value_uids = set()
 
-                if base_field == "http_headval":
+                if suffix in ("not", "nt"):
+                    value_uids = partial_result - self._get_excluded_uids(
+                        base_field, value, partial_result
+                    )
+                elif base_field == "http_headval":
                     value_uids.update(
                         self._get_uids_for_http_headval(
                             value,
@@ -732,15 +1695,11 @@ class KVrocksIndexer:
                             scoped_uids=partial_result,
                         )
                     )
-                elif suffix in ("like", "lk", "begin", "bg", "not", "nt"):
-                    for key in self.r.scan_iter(f"{base_field}:*"):
-                        val = key.split(":", 1)[1]
-                        if (suffix in ("like", "lk") and value in val) or (
-                            suffix in ("begin", "bg") and val.startswith(value)
-                        ):
-                            value_uids.update(
-                                self.r.smembers(key).intersection(partial_result)
-                            )
+                elif suffix in ("like", "lk", "begin", "bg"):
+                    for key in self._get_keys_for_modifier(base_field, value, suffix):
+                        value_uids.update(
+                            self.r.smembers(key).intersection(partial_result)
+                        )
                 else:
                     value_uids.update(
                         self.r.smembers(f"{base_field}:{value}").intersection(
@@ -761,16 +1720,12 @@ class KVrocksIndexer:
         Get info for a given IP
         """
 
-        uids = self.r.smembers(f"ip:{ip}")
-        pipe = self.r.pipeline()
-        for uid in uids:
-            pipe.hgetall(f"doc:{uid}")
-        results_raw = pipe.execute()
+        uids = list(self.r.smembers(f"ip:{ip}"))
         results = {}
-        for uid, data in zip(uids, results_raw):
+        for uid, (first_seen, last_seen) in zip(uids, self._read_seen_ranges(uids)):
             results[uid] = {
-                "first_seen": self.normalize_timestamp(data.get("first_seen")),
-                "last_seen": self.normalize_timestamp(data.get("last_seen")),
+                "first_seen": self.normalize_timestamp(first_seen),
+                "last_seen": self.normalize_timestamp(last_seen),
             }
         return results
 
@@ -839,18 +1794,29 @@ class KVrocksIndexer:
             5) "last_seen"
             6) "1767778159"
 
+        In compact timestamp storage the values are the seen ZSET scores.
         """
-        pipe = self.r.pipeline()
-        pipe.hgetall(f"doc:{uid}")
-        results_raw = pipe.execute()
-        data = results_raw[0] if results_raw else {}
-        first_seen, last_seen = self.normalize_seen_range(
-            data.get("first_seen"), data.get("last_seen")
+        return self.get_timestamps_for_uids([uid]).get(
+            uid, {"first_seen": None, "last_seen": None}
         )
-        return {
-            "first_seen": first_seen,
-            "last_seen": last_seen,
-        }
+
+    def get_timestamps_for_uids(self, uids):
+        """
+        Return {uid: {"first_seen": ts, "last_seen": ts}} for many documents.
+
+        Only the two timestamp fields of doc:{uid} are read, with HMGET in
+        pipelines of QUERY_CHUNK_SIZE documents, or the seen ZSET scores with
+        ZMSCORE in compact timestamp storage. Unknown UIDs get None values.
+        """
+        uids = [uid for uid in dict.fromkeys(uids or []) if uid]
+        results = {}
+        for uid, (first_seen, last_seen) in zip(uids, self._read_seen_ranges(uids)):
+            first_seen, last_seen = self.normalize_seen_range(first_seen, last_seen)
+            results[uid] = {
+                "first_seen": first_seen,
+                "last_seen": last_seen,
+            }
+        return results
 
     def get_timestamp_for_ip(self, ip):
         """
@@ -870,20 +1836,10 @@ class KVrocksIndexer:
         max_first_seen = 9999999999999
         max_last_seen = -1
 
-        uids = self.r.smembers(f"ip:{ip}")
-        pipe = self.r.pipeline()
-        for uid in uids:
-            pipe.hgetall(f"doc:{uid}")
-        results_raw = pipe.execute()
-        results = {}
-        for uid, data in zip(uids, results_raw):
-            first_seen, last_seen = self.normalize_seen_range(
-                data.get("first_seen"), data.get("last_seen")
-            )
-            results[uid] = {
-                "first_seen": first_seen,
-                "last_seen": last_seen,
-            }
+        results = self.get_timestamps_for_uids(self.r.smembers(f"ip:{ip}"))
+        for uid_timestamps in results.values():
+            first_seen = uid_timestamps["first_seen"]
+            last_seen = uid_timestamps["last_seen"]
             if first_seen is not None:
                 max_first_seen = min(first_seen, max_first_seen)
             if last_seen is not None:
@@ -146,6 +146,10 @@ def flat_marsh_error(err_msg):
     Flatten a Marshmallow error validation message
     """
     for key, value in err_msg.items():
+        if isinstance(value, dict):
+            nested = flat_marsh_error(value)
+            if nested:
+                return f"{nested} in {key}"
         if isinstance(value, list) and len(value) > 0:
             return f"{value[0]} in {key}"
 
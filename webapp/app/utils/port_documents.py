@@ -0,0 +1,118 @@
+"""
+Split one scanner host result into one search document per open port.
+
+Documents share the host fields and the port objects of the scan result
+instead of deep copies of them: only the dicts that differ per port (the
+body, and the port or script objects rewritten by the normalization) are
+new. The documents are read-only for the export, which only parses and
+serializes them, so the sharing is safe.
+
+Port hsh256 values are computed with D4-project/nmap2json smarthash.
+"""
+
+import re
+import uuid
+
+from nmap2json.smarthash import port_smart_hash
+
+UNKNOWN_FAVICON_MD5_RE = re.compile(
+    r"\bUnknown\s+favicon\s+MD5\s*:\s*([0-9a-fA-F]{32})\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_script(script):
+    """
+    Return script with banner newlines removed and legacy http-favicon
+    unknown-MD5 output converted to the http-mm-sha-favicon shape.
+
+    The script is returned as is when unchanged, else a new dict.
+    """
+    output = script.get("output")
+    if not isinstance(output, str):
+        return script
+
+    if script.get("id") == "banner" and "\n" in output:
+        output = output.replace("\n", "")
+        script = {**script, "output": output}
+
+    match = UNKNOWN_FAVICON_MD5_RE.search(output)
+    if match:
+        favicon_md5 = match.group(1).lower()
+        script = {
+            **script,
+            "id": "http-mm-sha-favicon",
+            "favicon_md5": favicon_md5,
+            "output": f"\n favicon_md5: {favicon_md5}",
+        }
+    return script
+
+
+def normalize_port(port):
+    """
+    Return port with normalize_script applied to its scripts.
+
+    Only the port and the script dicts that change are copied.
+    """
+    scripts = port.get("scripts") or []
+    normalized_scripts = None
+    for index, script in enumerate(scripts):
+        normalized = normalize_script(script)
+        if normalized is not script:
+            if normalized_scripts is None:
+                normalized_scripts = list(scripts)
+            normalized_scripts[index] = normalized
+    if normalized_scripts is None:
+        return port
+    return {**port, "scripts": normalized_scripts}
+
+
+def port_document_uuid(ip, port_id, port_hash):
+    """
+    Return deterministic UUID for one IP/port/hash report.
+    """
+    port_id = str(port_id or "").strip()
+    port_hash = str(port_hash or "").strip()
+    if not ip or not port_id or not port_hash:
+        return None
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{ip}:{port_id}:{port_hash}"))
+
+
+def split_scan_result_by_port(scan_result):
+    """
+    Build one Meilisearch document per port from one scanner result.
+    """
+    if not isinstance(scan_result, dict):
+        return []
+
+    ip = scan_result.get("addr")
+    ports = scan_result.get("ports") or []
+    if not ip or not isinstance(ports, list):
+        return []
+
+    port_documents = []
+    for port in ports:
+        if not isinstance(port, dict):
+            continue
+        public_port = normalize_port(port)
+        port_hash = port_smart_hash(public_port)
+        doc_id = port_document_uuid(ip, public_port.get("portid"), port_hash)
+        if not doc_id:
+            continue
+        if "hsh256" in public_port:
+            public_port = {
+                key: value for key, value in public_port.items() if key != "hsh256"
+            }
+
+        # Shallow host envelope, only "ports" and "hsh256" differ per port.
+        body = dict(scan_result)
+        body["ports"] = [public_port]
+        body["hsh256"] = port_hash
+        port_documents.append(
+            {
+                "id": doc_id,
+                "ip": ip,
+                "body": body,
+            }
+        )
+    return port_documents
@@ -1,23 +1,21 @@
 """
 This module will parse json results an prepare required data for indexation.
 
-It use a parsing profile description.
+It use a parsing profile description, one action:section.script.path rule
+per line (see default_parsing):
 
-hsh:http-header.output
-get_http_cookies:http-header.output
-get_hosts:http-header.output
-get_http_server:http-header.output
-get_http_title:http-title.output
-get_ssl_info:ssl-cert
-get_hosts:ssl-cert.issuer.commonName
-get_hosts:ssl-cert.extentions.X509v3_Subject_Alternative_Name
+get_http_server:p.http-headers.output
+get_ssl_info:p.ssl-cert
+get_hosts:p.ssl-cert.issuer.commonName
 
-Current problem, is that this syntax should be reversed...
-currently it parse headers 3x for ( cookie etc....)
-For now far from performance issues anyway.
+The rules are compiled once into a ParsePlan, a dispatch table keyed by
+script id. parse_json then visits each script of a document once, resolves
+each path of it once, and the http-headers actions share one tokenized
+parse of the header output (HttpHeaderOutput).
 
 """
 
+import functools
 import re
 from pyfaup import Url  # pylint: disable=no-name-in-module
 
@@ -32,31 +30,52 @@ except ImportError:
     from tagrules import apply_tag_rules_to_document
 
 
+# Config keys read by parse_json.
+PARSER_CONFIG_KEYS = ("ONLINETLD", "TLDS", "TLDADD", "HTTP_HEADER_COLLECTION")
+
+
 def normalize_db_conf(db_conf_local):
     """
     Accept either the full config dict or a legacy plain TLD list.
+
+    Only the PARSER_CONFIG_KEYS are kept, so the result is a plain picklable
+    dict even when built from the app config.
     """
     if isinstance(db_conf_local, dict):
-        conf = dict(db_conf_local)
-        conf.setdefault("ONLINETLD", False)
-        conf.setdefault("TLDS", [])
-        conf.setdefault("TLDADD", [])
-        conf["HTTP_HEADER_COLLECTION"] = normalize_http_header_collection(
-            conf.get("HTTP_HEADER_COLLECTION", {})
-        )
-        return conf
+        return {
+            "ONLINETLD": db_conf_local.get("ONLINETLD", False),
+            "TLDS": tld_set(db_conf_local.get("TLDS", [])),
+            "TLDADD": tld_set(db_conf_local.get("TLDADD", [])),
+            "HTTP_HEADER_COLLECTION": normalize_http_header_collection(
+                db_conf_local.get("HTTP_HEADER_COLLECTION", {})
+            ),
+        }
 
     if isinstance(db_conf_local, list):
         return {
             "ONLINETLD": False,
-            "TLDS": db_conf_local,
-            "TLDADD": [],
+            "TLDS": tld_set(db_conf_local),
+            "TLDADD": frozenset(),
             "HTTP_HEADER_COLLECTION": {},
         }
 
     raise TypeError("parse_json expects a config dict or a TLD list")
 
 
+def tld_set(tlds):
+    """
+    Return a TLD list as a frozenset, so suffix checks are O(1).
+
+    Callers parsing many documents should pass frozensets, or a config
+    already normalized once, to skip the conversion on every document.
+    """
+    if isinstance(tlds, frozenset):
+        return tlds
+    if isinstance(tlds, str):
+        return frozenset([tlds])
+    return frozenset(tlds or ())
+
+
 # B -> Body.XXXX Subsearch
 # P -> Body.ports.XXXX Per Port Search
 
@@ -92,10 +111,12 @@ ALLOW = [
     "get_favicon",
 ]
 
-CONFIG_AWARE_ACTIONS = {
-    "get_fqdn_requested",
-    "get_hosts",
+# Actions that read the shared HttpHeaderOutput instead of the raw output.
+HEADER_ACTIONS = {
+    "get_http_cookies",
+    "get_http_etag",
     "get_http_header",
+    "get_http_server",
 }
 
 fqdn_regex = re.compile(
@@ -112,6 +133,10 @@ favicon_field_regex = re.compile(
 
 http_header_regex = re.compile(r"^\s*([^:\s][^:\s]*)\s*:\s*(.*?)\s*$")
 
+# Hostname decompositions cached per process: CDN names, certificate SANs and
+# shared hosting names recur across many documents.
+HOSTNAME_CACHE_SIZE = 65536
+
 favicon_field_map = {
     "favicon_file": "http_favicon_path",
     "favicon_mmhash": "http_favicon_mmhash",
@@ -162,6 +187,25 @@ def normalize_http_header_collection(raw_collection):
     return collection
 
 
+def parse_http_header_line(line):
+    """
+    Return the normalized (header, value) pair of one http-headers line.
+    """
+    candidate = line.strip()
+    if candidate.startswith("|"):
+        candidate = candidate[1:].lstrip("_").strip()
+
+    match = http_header_regex.match(candidate)
+    if not match:
+        return None
+
+    header_name = normalize_http_header_name(match.group(1))
+    header_value = str(match.group(2) or "").strip().lower()
+    if not header_name:
+        return None
+    return header_name, header_value
+
+
 def iter_http_header_lines(body):
     """
     Yield normalized (header, value) pairs from http-headers NSE output.
@@ -170,18 +214,43 @@ def iter_http_header_lines(body):
         return
 
     for line in str(body).splitlines():
-        candidate = line.strip()
-        if candidate.startswith("|"):
-            candidate = candidate[1:].lstrip("_").strip()
+        field = parse_http_header_line(line)
+        if field:
+            yield field
 
-        match = http_header_regex.match(candidate)
-        if not match:
-            continue
 
-        header_name = normalize_http_header_name(match.group(1))
-        header_value = str(match.group(2) or "").strip().lower()
-        if header_name:
-            yield header_name, header_value
+class HttpHeaderOutput:
+    """
+    http-headers NSE output tokenized in one pass for all header actions.
+
+    Server, Set-Cookie and ETag values keep the case of the output. fields
+    holds the normalized (header, value) pairs, only when collect_fields is
+    set since HTTP_HEADER_COLLECTION is often empty.
+    """
+
+    def __init__(self, body, collect_fields=True):
+        self.server = []
+        self.cookie_names = []
+        self.etags = []
+        self.fields = []
+        if not body:
+            return
+
+        for line in str(body).splitlines():
+            # I know normally only one server header
+            # but just in case, everything is in array
+            candidate = line.strip().lower()
+            if candidate.startswith("server:"):
+                self.server.append(line.split(":", 1)[1].strip())
+            elif candidate.startswith("set-cookie:"):
+                self.cookie_names.append(line.split(":", 1)[1].split("=")[0].strip())
+            elif candidate.startswith("etag:"):
+                self.etags.append(line.split(":", 1)[1].strip())
+
+            if collect_fields:
+                field = parse_http_header_line(line)
+                if field:
+                    self.fields.append(field)
 
 
 def insensitive(input_list):
@@ -200,8 +269,13 @@ def get_ssl_info(data: dict, target: str, _general: bool = False):
     """
     Parse a Nmap script ssl-certs
     """
+    return _parse_ssl_info(get_body(data, target), None)
 
-    ssl_result = get_body(data, target)
+
+def _parse_ssl_info(ssl_result, _db_conf):
+    """
+    get_ssl_info on the resolved ssl-cert script.
+    """
     r_issuer = []
     issuers = ssl_result.get("issuer")
     if issuers:
@@ -229,85 +303,86 @@ def get_ssl_info(data: dict, target: str, _general: bool = False):
     }
 
 
-def get_body(data, target):
+def target_path(target):
     """
-    Get a Key from the Json with the parsing syntax.
+    Return the normalized keys of a parsing target below its script name.
+    """
+    return tuple(target.replace("-", "_").replace(" ", "_").split(".")[1:])
+
+
+def resolve_path(data, path):
+    """
+    Follow normalized keys from data, "-", " " and "_" matching alike.
     """
-    keys = target.replace("-", "_").replace(" ", "_").split(".")
     current = data
-    keys = keys[1:]
-
-    for k in keys:
-        k = k.replace("-", "_").replace(" ", "_")
-        if isinstance(current, dict):
-            norm_map = {key.replace(" ", "_").replace("-", "_"): key for key in current}
-            real_key = norm_map.get(k)
-            if not real_key:
-                return None
-            current = current[real_key]
+    for k in path:
+        if not isinstance(current, dict):
+            return None
+        if "_" not in k:
+            # Only the key itself normalizes to a key without "_".
+            real_key = k if k in current else None
         else:
+            # Last matching key wins, like a normalized key map would.
+            real_key = None
+            for key in reversed(current):
+                if key.replace(" ", "_").replace("-", "_") == k:
+                    real_key = key
+                    break
+        if not real_key:
             return None
+        current = current[real_key]
 
     return current
 
 
-def run_parser_action(action, script, target, db_conf):
+def get_body(data, target):
     """
-    Call one configured parser action with explicit config when required.
+    Get a Key from the Json with the parsing syntax.
     """
-    parser = globals()[action]
-    if action in CONFIG_AWARE_ACTIONS:
-        return parser(script, target, db_conf)
-    return parser(script, target)
+    return resolve_path(data, target_path(target))
 
 
 def get_http_cookies(data: dict, target: str):
     """
     Get cookies
     """
-    # Parse for http cookies
-    body = get_body(data, target)
-    http_cookie = []
-    if body:
-        for line in body.splitlines():
-            # I know normally only one server header
-            # but just in case, everything is in array
-            candidate = line.strip().lower()
-            if candidate.startswith("set-cookie:"):
-                http_cookie.append(line.split(":", 1)[1].split("=")[0].strip())
-    return {"http_cookiename": http_cookie}
+    return _parse_http_cookies(
+        HttpHeaderOutput(get_body(data, target), collect_fields=False), None
+    )
+
+
+def _parse_http_cookies(headers, _db_conf):
+    """
+    Cookie names of a tokenized http-headers output.
+    """
+    return {"http_cookiename": headers.cookie_names}
 
 
 def get_http_etag(data: dict, target: str):
     """
     Get etag from http header
     """
-    # Parse for http etag
-    body = get_body(data, target)
-    http_etag = []
-    if body:
-        for line in body.splitlines():
-            # I know normally only one server header
-            # but just in case, everything is in array
-            candidate = line.strip().lower()
-            if candidate.startswith("etag:"):
-                http_etag.append(line.split(":", 1)[1].strip())
-    return {"http_etag": http_etag}
+    return _parse_http_etag(
+        HttpHeaderOutput(get_body(data, target), collect_fields=False), None
+    )
+
+
+def _parse_http_etag(headers, _db_conf):
+    """
+    ETag values of a tokenized http-headers output.
+    """
+    return {"http_etag": headers.etags}
 
 
-def _suffix_is_allowed(suffix, suffix_str, db_conf):
+def _suffix_is_allowed(suffix_str, suffix_known, db_conf):
     """
-    Check suffix validity across pyfaup-rs API variants.
+    Check suffix validity against the configured validation mode.
     """
     if db_conf["ONLINETLD"]:
         if suffix_str in db_conf["TLDS"]:
             return True
-    else:
-        is_known = getattr(suffix, "is_known", None)
-        if callable(is_known) and is_known():
-            return True
-        if is_known is None:
-            return True
+    elif suffix_known:
+        return True
 
     return suffix_str in db_conf["TLDADD"]
 
@@ -345,6 +420,31 @@ def _parse_hostname_parts(hostname, db_conf):
     if not hostname:
         return None
 
+    parts = _decompose_hostname(hostname)
+    if parts is None:
+        return None
+
+    fqdn, host, domain, suffix_str, suffix_known = parts
+    if not _suffix_is_allowed(suffix_str, suffix_known, db_conf):
+        return None
+
+    return {
+        "fqdn": fqdn,
+        "host": host,
+        "domain": domain,
+        "tld": suffix_str,
+    }
+
+
+@functools.lru_cache(maxsize=HOSTNAME_CACHE_SIZE)
+def _decompose_hostname(hostname):
+    """
+    Split one normalized hostname with pyfaup-rs.
+
+    Returns (fqdn, host, domain, tld, suffix known) or None. The result does
+    not depend on the parser config, so one bounded cache serves every
+    config and thread of the process.
+    """
     try:
         url = Url(f"http://{hostname}")
     except (ValueError, TypeError):
@@ -352,18 +452,17 @@ def _parse_hostname_parts(hostname, db_conf):
 
     suffix = getattr(url, "suffix", None)
     if not suffix:
-        return _parse_hostname_parts_compat(hostname, db_conf)
+        return _decompose_hostname_compat(hostname)
 
     return _build_hostname_parts(
         hostname,
         suffix,
         getattr(url, "domain", None),
         getattr(url, "subdomain", None),
-        db_conf,
     )
 
 
-def _parse_hostname_parts_compat(hostname, db_conf):
+def _decompose_hostname_compat(hostname):
     """
     Parse with pyfaup-rs FaupCompat when Url exposes only raw URL fields.
     """
@@ -386,17 +485,17 @@ def _parse_hostname_parts_compat(hostname, db_conf):
         suffix,
         parsed.get("domain"),
         parsed.get("subdomain"),
-        db_conf,
     )
 
 
-def _build_hostname_parts(hostname, suffix, domain, subdomain, db_conf):
+def _build_hostname_parts(hostname, suffix, domain, subdomain):
     """
     Build normalized hostname parts from pyfaup Url or FaupCompat output.
     """
     suffix_str = str(suffix).lower()
-    if not _suffix_is_allowed(suffix, suffix_str, db_conf):
-        return None
+    # Suffixes without is_known, FaupCompat strings included, count as known.
+    is_known = getattr(suffix, "is_known", None)
+    suffix_known = is_known is None or bool(callable(is_known) and is_known())
 
     fallback_domain, fallback_subdomain = _split_hostname_from_suffix(
         hostname, suffix_str
@@ -404,20 +503,51 @@ def _build_hostname_parts(hostname, suffix, domain, subdomain, db_conf):
     domain = domain or fallback_domain
     subdomain = subdomain or fallback_subdomain
 
+    return (
+        hostname,
+        str(subdomain).lower() if subdomain else "",
+        str(domain).lower() if domain else "",
+        suffix_str,
+        suffix_known,
+    )
+
+
+def hostname_cache_stats():
+    """
+    Return the hits, misses and size of the hostname cache of this process.
+    """
+    info = _decompose_hostname.cache_info()
     return {
-        "fqdn": hostname,
-        "host": str(subdomain).lower() if subdomain else "",
-        "domain": str(domain).lower() if domain else "",
-        "tld": suffix_str,
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
     }
 
 
+def format_hostname_cache_stats(stats):
+    """
+    Format hostname cache counters, summed over processes, for CLI output.
+    """
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups if lookups else 0.0
+    return (
+        f"Hostname cache: lookups={lookups} hits={stats['hits']} "
+        f"misses={stats['misses']} hit_rate={hit_rate:.1%} size={stats['size']}"
+    )
+
+
 def get_hosts(data: dict, target: str, db_conf: dict):
     """
     extract fqdn.
     """
-    # Parse for http etag
-    body = get_body(data, target)
+    return _parse_hosts(get_body(data, target), db_conf)
+
+
+def _parse_hosts(body, db_conf):
+    """
+    get_hosts on a resolved value.
+    """
     hosts, fqdn_hosts, domains, tlds = [], [], [], []
     if body:
         # Extract FQDN using regex if not empty data
@@ -448,7 +578,13 @@ def get_fqdn_requested(data: dict, target: str, db_conf: dict):
     """
     Extract user-requested FQDN and domain values from hostnames entries.
     """
-    body = get_body(data, target)
+    return _parse_fqdn_requested(get_body(data, target), db_conf)
+
+
+def _parse_fqdn_requested(body, db_conf):
+    """
+    get_fqdn_requested on resolved hostnames entries.
+    """
     fqdn_requested = []
     domain_requested = []
     for entry in body or []:
@@ -478,7 +614,13 @@ def get_http_title(data: dict, target: str):
     """
     look for http parsed titles
     """
-    body = get_body(data, target)
+    return _parse_http_title(get_body(data, target), None)
+
+
+def _parse_http_title(body, _db_conf):
+    """
+    get_http_title on a resolved value.
+    """
     http_title = []
     if body:
         http_title = [body]
@@ -489,7 +631,13 @@ def get_banner(data: dict, target: str):
     """
     look for banner text
     """
-    body = get_body(data, target)
+    return _parse_banner(get_body(data, target), None)
+
+
+def _parse_banner(body, _db_conf):
+    """
+    get_banner on a resolved value.
+    """
     banner = []
     if body:
         banner = [body]
@@ -539,7 +687,13 @@ def get_favicon(data: dict, target: str):
     """
     Extract favicon hashes and the path that produced the favicon.
     """
-    body = get_body(data, target)
+    return _parse_favicon(get_body(data, target), None)
+
+
+def _parse_favicon(body, _db_conf):
+    """
+    get_favicon on a resolved value.
+    """
     result = {
         "http_favicon_path": [],
         "http_favicon_mmhash": [],
@@ -555,13 +709,23 @@ def get_http_header(data: dict, target: str, db_conf: dict):
     """
     Parse configured HTTP header names and selected values.
     """
-    body = get_body(data, target)
+    headers = HttpHeaderOutput(
+        get_body(data, target),
+        collect_fields=bool(db_conf.get("HTTP_HEADER_COLLECTION")),
+    )
+    return _parse_http_header(headers, db_conf)
+
+
+def _parse_http_header(headers, db_conf):
+    """
+    Collected header names and values of a tokenized http-headers output.
+    """
     collection = db_conf.get("HTTP_HEADER_COLLECTION", {})
     http_header = []
     http_headval = []
 
-    if body and collection:
-        for header_name, header_value in iter_http_header_lines(body):
+    if collection:
+        for header_name, header_value in headers.fields:
             if header_name not in collection:
                 continue
             http_header.append(header_name)
@@ -575,17 +739,16 @@ def get_http_server(data: dict, target: str):
     """
     Parse the HTTP Server header value.
     """
-    # Parse http server header
-    body = get_body(data, target)
-    http_server = []
-    if body:
-        for line in body.splitlines():
-            # I know normally only one server header
-            # but just in case, everything is in array
-            candidate = line.strip().lower()
-            if candidate.startswith("server:"):
-                http_server.append(line.split(":", 1)[1].strip())
-    return {"http_server": http_server}
+    return _parse_http_server(
+        HttpHeaderOutput(get_body(data, target), collect_fields=False), None
+    )
+
+
+def _parse_http_server(headers, _db_conf):
+    """
+    Server values of a tokenized http-headers output.
+    """
+    return {"http_server": headers.server}
 
 
 def fuse_dicts(d1, d2):
@@ -605,51 +768,136 @@ def fuse_dicts(d1, d2):
     return fused
 
 
-def parse_json(doc, db_conf_local, tag_rules=None):
+def fuse_results(results):
+    """
+    Fuse action results in order, as fuse_dicts applied one by one would.
+    """
+    fused = {}
+    for result in results:
+        for k, v in result.items():
+            if v is None:
+                continue
+            vals = fused.setdefault(k, [])
+            if isinstance(v, list):
+                vals.extend(v)
+            else:
+                vals.append(v)
+    return {k: list(dict.fromkeys(vals)) for k, vals in fused.items() if vals}
+
+
+# Parser of each action, called with the value at the rule path, or with the
+# shared HttpHeaderOutput for HEADER_ACTIONS, and the parser config.
+ACTION_PARSERS = {
+    "get_http_cookies": _parse_http_cookies,
+    "get_hosts": _parse_hosts,
+    "get_fqdn_requested": _parse_fqdn_requested,
+    "get_http_header": _parse_http_header,
+    "get_http_server": _parse_http_server,
+    "get_http_title": _parse_http_title,
+    "get_http_etag": _parse_http_etag,
+    "get_banner": _parse_banner,
+    "get_ssl_info": _parse_ssl_info,
+    "get_favicon": _parse_favicon,
+}
+
+
+class ParsePlan:
+    """
+    Parsing rules compiled into a dispatch table keyed by script id.
+
+    body_rules holds (rule index, body key, path, parser) for the "b"
+    rules. script_rules maps a script id to the "p" rules on it, grouped by
+    path as (path, [(rule index, parser, on headers)], collects fields).
+    Results are fused in rule order, so the output does not depend on the
+    order the scripts are visited in.
+    """
+
+    def __init__(self, rules):
+        self.rule_count = len(rules)
+        self.body_rules = []
+        script_paths = {}
+
+        for index, parsing_rule in enumerate(rules):
+            # Check if rule contains a splitter.
+            if not ":" in parsing_rule:
+                raise TypeError
+            action, target = parsing_rule.split(":")[:2]
+            action = action.lower()
+            section = target.split(".")[0]
+            script_name = target.split(".")[1]
+            path = target_path(".".join(target.split(".")[1:]))
+
+            # Check if rules contains a legitimate parsing method
+            if action not in ALLOW or action not in ACTION_PARSERS:
+                raise TypeError
+
+            parser = ACTION_PARSERS[action]
+            if section == "b":
+                self.body_rules.append((index, script_name, path, parser))
+            elif section == "p":
+                paths = script_paths.setdefault(script_name, {})
+                paths.setdefault(path, []).append(
+                    (index, parser, action in HEADER_ACTIONS)
+                )
+
+        self.script_rules = {
+            script_name: [
+                (
+                    path,
+                    actions,
+                    any(parser is _parse_http_header for _, parser, _ in actions),
+                )
+                for path, actions in paths.items()
+            ]
+            for script_name, paths in script_paths.items()
+        }
+
+    def parse(self, doc, db_conf):
+        """
+        Return the fused parsing result of one document.
+        """
+        rule_results = [[] for _ in range(self.rule_count)]
+        body = doc.get("body")
+
+        for index, script_name, path, parser in self.body_rules:
+            if script_name in body:
+                value = resolve_path(body[script_name], path)
+                rule_results[index].append(parser(value, db_conf))
+
+        collect_fields = bool(db_conf.get("HTTP_HEADER_COLLECTION"))
+        for port in body.get("ports"):  # for each ports,
+            for script in port.get("scripts", []):  # We look at script results
+                groups = self.script_rules.get(script.get("id"))
+                if not groups:
+                    continue
+                for path, actions, wants_fields in groups:
+                    value = resolve_path(script, path)
+                    headers = None
+                    for index, parser, on_headers in actions:
+                        if not on_headers:
+                            rule_results[index].append(parser(value, db_conf))
+                            continue
+                        if headers is None:
+                            headers = HttpHeaderOutput(
+                                value, collect_fields=wants_fields and collect_fields
+                            )
+                        rule_results[index].append(parser(headers, db_conf))
+
+        return fuse_results(result for results in rule_results for result in results)
+
+
+DEFAULT_PARSE_PLAN = ParsePlan(default_parsing)
+
+
+def parse_json(doc, db_conf_local, tag_rules=None, parse_plan=None):
     """
     Parse one Nmap-like document into the Kvrocks search fields.
+
+    parse_plan defaults to the compiled default_parsing rules.
     """
 
     db_conf = normalize_db_conf(db_conf_local)
-
-    final_result = {}  # Parsing result array
-    for parsing_rule in default_parsing:
-
-        # result = {}  # Parsing result array
-
-        # Check if rule contains a splitter.
-        if not ":" in parsing_rule:
-            raise TypeError
-        action = parsing_rule.split(":")
-        target = action[1]
-        script_name = target.split(".")[1]
-        section = target.split(".")[0]
-        action = action[0].lower()
-        target = ".".join(target.split(".")[1::])
-        # print(f"doing action {action} on {target}")
-
-        # Check if rules contains a legitimate parsing method
-        if not action in ALLOW:
-            raise TypeError
-
-        parse_result = {}
-        # print(f"Looking {target} for section >{section}<")
-        if section == "b":
-            for script in doc.get("body"):
-                if script == script_name:  # If it is in the job list.
-                    script = doc.get("body").get(script)
-                    parse_result = run_parser_action(action, script, target, db_conf)
-
-        elif section == "p":
-            for port in doc.get("body").get("ports"):  # for each ports,
-                for script in port.get("scripts", []):  # We look at script results
-                    if script.get("id") == script_name:  # If it is in the job list.
-                        parse_result = fuse_dicts(
-                            parse_result,
-                            run_parser_action(action, script, target, db_conf),
-                        )
-
-        final_result = fuse_dicts(final_result, parse_result)
+    final_result = (parse_plan or DEFAULT_PARSE_PLAN).parse(doc, db_conf)
 
     ports = []
     for port in doc.get("body").get("ports"):
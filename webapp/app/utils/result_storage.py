@@ -0,0 +1,345 @@
+"""
+On-disk storage of the job results sent back by the agents.
+
+Results live under JSON_FOLDER/<first-uid-char>/ in one of two formats:
+- json: the payload as received, <uid>.json,
+- ndjson.gz: one compact host object per line, gzip compressed,
+  <uid>.ndjson.gz.
+
+Readers look for both files, so a folder can hold a mix of formats while
+RESULT_STORAGE_FORMAT changes or the converter runs.
+
+Uploaded result files are stored through store_result_stream, which
+decompresses them chunk by chunk with a size limit.
+"""
+
+import gzip
+import json
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RESULT_FORMAT_JSON = "json"
+RESULT_FORMAT_NDJSON_GZ = "ndjson.gz"
+RESULT_FORMATS = (RESULT_FORMAT_JSON, RESULT_FORMAT_NDJSON_GZ)
+DEFAULT_RESULT_FORMAT = RESULT_FORMAT_JSON
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_MAX_RESULT_BYTES = 512 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+# gzip raises BadGzipFile (an OSError) or EOFError on a corrupt stream.
+DECODE_ERRORS = (OSError, EOFError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+class ResultTooLarge(ValueError):
+    """
+    Raised when a decompressed result exceeds the configured size limit.
+    """
+
+
+def supported_encodings():
+    """
+    Return the upload content encodings this install can decode.
+    """
+    encodings = ["identity", "gzip"]
+    if zstandard is not None:
+        encodings.append("zstd")
+    return encodings
+
+
+def normalize_encoding(content_encoding):
+    """
+    Return a supported content encoding, identity when unset.
+    """
+    content_encoding = str(content_encoding or "identity").strip().lower()
+    if content_encoding == "x-gzip":
+        content_encoding = "gzip"
+    if content_encoding not in supported_encodings():
+        raise ValueError(f"Unsupported content encoding {content_encoding!r}")
+    return content_encoding
+
+
+def normalize_result_format(storage_format):
+    """
+    Return a supported storage format, DEFAULT_RESULT_FORMAT when unset.
+    """
+    storage_format = str(storage_format or DEFAULT_RESULT_FORMAT).strip().lower()
+    if storage_format not in RESULT_FORMATS:
+        raise ValueError(
+            f"Unknown result storage format {storage_format!r}, "
+            f"expected one of {', '.join(RESULT_FORMATS)}"
+        )
+    return storage_format
+
+
+def result_path(json_folder, uid, storage_format=DEFAULT_RESULT_FORMAT):
+    """
+    Return the result file path of one job uid in one storage format.
+    """
+    storage_format = normalize_result_format(storage_format)
+    return os.path.join(json_folder, uid[0], f"{uid}.{storage_format}")
+
+
+def result_paths(json_folder, uid):
+    """
+    Return the result file paths of one job uid in every storage format.
+    """
+    return [
+        result_path(json_folder, uid, storage_format)
+        for storage_format in RESULT_FORMATS
+    ]
+
+
+def find_result_path(json_folder, uid):
+    """
+    Return the existing result file of one job uid, None when missing.
+    """
+    for path in result_paths(json_folder, uid):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def result_format_of(path):
+    """
+    Return the storage format of a result file from its name.
+    """
+    if str(path).endswith(f".{RESULT_FORMAT_NDJSON_GZ}"):
+        return RESULT_FORMAT_NDJSON_GZ
+    return RESULT_FORMAT_JSON
+
+
+def _as_hosts(data):
+    """
+    Return the host objects of one decoded result payload.
+    """
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return data
+    return []
+
+
+def _write_atomic(path, write_func):
+    """
+    Write path through a temporary file so readers never see a partial file.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        write_func(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_hosts(path, hosts, compresslevel=DEFAULT_COMPRESS_LEVEL):
+    """
+    Write host objects as gzip compressed NDJSON.
+    """
+
+    def write_ndjson(tmp_path):
+        with gzip.open(
+            tmp_path, "wt", encoding="utf-8", compresslevel=compresslevel
+        ) as f:
+            for host in hosts:
+                f.write(json.dumps(host, separators=(",", ":")))
+                f.write("\n")
+
+    _write_atomic(path, write_ndjson)
+
+
+def write_result(
+    json_folder,
+    uid,
+    payload,
+    storage_format=DEFAULT_RESULT_FORMAT,
+    compresslevel=DEFAULT_COMPRESS_LEVEL,
+):
+    """
+    Validate one agent payload and store it, return the written path.
+
+    The json format keeps the payload text as received. The ndjson.gz
+    format writes each host compactly. Raises json.JSONDecodeError or
+    TypeError on an invalid payload and OSError when the write fails.
+    """
+    storage_format = normalize_result_format(storage_format)
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode("utf-8")
+    data = json.loads(payload)
+    path = result_path(json_folder, uid, storage_format)
+
+    if storage_format == RESULT_FORMAT_NDJSON_GZ:
+        write_hosts(path, _as_hosts(data), compresslevel=compresslevel)
+    else:
+
+        def write_json(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+
+        _write_atomic(path, write_json)
+
+    # A resubmitted job may have been stored in the other format before.
+    for other_path in result_paths(json_folder, uid):
+        if other_path != path:
+            try:
+                os.remove(other_path)
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def iter_result_hosts(path):
+    """
+    Yield the host objects of one result file.
+
+    NDJSON files are read one line at a time, json files are decoded whole.
+    """
+    if result_format_of(path) == RESULT_FORMAT_NDJSON_GZ:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        yield from _as_hosts(json.load(f))
+
+
+def read_result(path):
+    """
+    Return the decoded result of one file as stored in the json format.
+
+    A single-host NDJSON result is returned as an object, as agents send it.
+    """
+    if result_format_of(path) == RESULT_FORMAT_JSON:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    hosts = list(iter_result_hosts(path))
+    return hosts[0] if len(hosts) == 1 else hosts
+
+
+def _decoded_reader(stream, content_encoding):
+    """
+    Wrap a binary stream with the decoder of its content encoding.
+    """
+    content_encoding = normalize_encoding(content_encoding)
+    if content_encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if content_encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return stream
+
+
+def _iter_decoded_chunks(stream, content_encoding, max_bytes):
+    """
+    Yield decoded chunks of a stream, at most max_bytes in total.
+    """
+    reader = _decoded_reader(stream, content_encoding)
+    size = 0
+    while True:
+        try:
+            chunk = reader.read(STREAM_CHUNK_SIZE)
+        except DECODE_ERRORS as error:
+            raise ValueError(f"Undecodable {content_encoding} data: {error}") from error
+        if not chunk:
+            return
+        size += len(chunk)
+        if size > max_bytes:
+            raise ResultTooLarge(f"Decoded data exceeds {max_bytes} bytes")
+        yield chunk
+
+
+def decode_body(stream, content_encoding, max_bytes=DEFAULT_MAX_RESULT_BYTES):
+    """
+    Return the decoded bytes of a compressed request body.
+
+    Raises ResultTooLarge once more than max_bytes are decoded, so a small
+    compressed body cannot expand without bound.
+    """
+    return b"".join(_iter_decoded_chunks(stream, content_encoding, max_bytes))
+
+
+def _iter_ndjson_file(path):
+    """
+    Yield the host objects of an uncompressed NDJSON file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def store_result_stream(
+    json_folder,
+    uid,
+    stream,
+    storage_format=DEFAULT_RESULT_FORMAT,
+    content_encoding=None,
+    ndjson=False,
+    max_bytes=DEFAULT_MAX_RESULT_BYTES,
+    compresslevel=DEFAULT_COMPRESS_LEVEL,
+):
+    """
+    Store an uploaded result file and return the written path.
+
+    The stream is decoded in STREAM_CHUNK_SIZE chunks into a temporary file
+    next to the result, then validated and written in storage_format. An
+    NDJSON upload is read back one host at a time, a JSON document is
+    decoded whole, so memory is bounded by max_bytes at most.
+
+    Raises ResultTooLarge past max_bytes decoded bytes, ValueError on an
+    invalid or undecodable result and OSError when the write fails.
+    """
+    storage_format = normalize_result_format(storage_format)
+    content_encoding = normalize_encoding(content_encoding)
+    path = result_path(json_folder, uid, storage_format)
+    spool_path = f"{path}.upload"
+    try:
+        with open(spool_path, "wb") as spool:
+            for chunk in _iter_decoded_chunks(stream, content_encoding, max_bytes):
+                spool.write(chunk)
+
+        if ndjson:
+            hosts = _iter_ndjson_file(spool_path)
+        else:
+            with open(spool_path, "r", encoding="utf-8") as f:
+                hosts = _as_hosts(json.load(f))
+
+        if storage_format == RESULT_FORMAT_NDJSON_GZ:
+            write_hosts(path, hosts, compresslevel=compresslevel)
+        elif ndjson:
+
+            def write_json_array(tmp_path):
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("[")
+                    for index, host in enumerate(hosts):
+                        if index:
+                            f.write(",")
+                        f.write(json.dumps(host, separators=(",", ":")))
+                    f.write("]")
+
+            _write_atomic(path, write_json_array)
+        else:
+            # The spooled upload is the validated JSON document itself.
+            os.replace(spool_path, path)
+    finally:
+        try:
+            os.remove(spool_path)
+        except FileNotFoundError:
+            pass
+
+    for other_path in result_paths(json_folder, uid):
+        if other_path != path:
+            try:
+                os.remove(other_path)
+            except FileNotFoundError:
+                pass
+    return path
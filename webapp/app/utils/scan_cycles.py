@@ -10,7 +10,7 @@ This module only derives cycle metadata from that state:
 
 # pylint: disable=no-name-in-module
 
-from sqlalchemy import and_, exists, func, text
+from sqlalchemy import and_, case, exists, func, select, text, update
 
 from .. import db
 from ..models import (
@@ -19,6 +19,7 @@ from ..models import (
     ScanProfiles,
     TargetScanStates,
     Targets,
+    assoc_jobs_targets,
     assoc_scanprofiles_targets,
 )
 from .timeutils import utcnow_naive
@@ -200,6 +201,21 @@ def _finished_job_scan_unit_count(cycle_id):
     )
 
 
+def _latest_running_cycle(scanprofile_id):
+    """
+    Return the newest running cycle of a profile, None when there is none.
+    """
+    return (
+        db.session.query(ScanProfileCycles)
+        .filter(
+            ScanProfileCycles.scanprofile_id == scanprofile_id,
+            ScanProfileCycles.status == "running",
+        )
+        .order_by(ScanProfileCycles.started_at.desc(), ScanProfileCycles.id.desc())
+        .first()
+    )
+
+
 def reconcile_scanprofile_cycle(scanprofile_id, cycle=None, now=None):
     """
     Recalculate one running scan-profile cycle from persisted runtime state.
@@ -218,15 +234,7 @@ def reconcile_scanprofile_cycle(scanprofile_id, cycle=None, now=None):
     """
     now = now or utcnow_naive()
     if cycle is None:
-        cycle = (
-            db.session.query(ScanProfileCycles)
-            .filter(
-                ScanProfileCycles.scanprofile_id == scanprofile_id,
-                ScanProfileCycles.status == "running",
-            )
-            .order_by(ScanProfileCycles.started_at.desc(), ScanProfileCycles.id.desc())
-            .first()
-        )
+        cycle = _latest_running_cycle(scanprofile_id)
     if cycle is None:
         return None
 
@@ -301,15 +309,7 @@ def get_or_create_running_cycle(scanprofile_id, now=None):
     `last_scan` values.
     """
     now = now or utcnow_naive()
-    cycle = (
-        db.session.query(ScanProfileCycles)
-        .filter(
-            ScanProfileCycles.scanprofile_id == scanprofile_id,
-            ScanProfileCycles.status == "running",
-        )
-        .order_by(ScanProfileCycles.started_at.desc(), ScanProfileCycles.id.desc())
-        .first()
-    )
+    cycle = _latest_running_cycle(scanprofile_id)
     if cycle is None:
         cycle = ScanProfileCycles(
             scanprofile_id=scanprofile_id,
@@ -421,3 +421,182 @@ def release_orphaned_scan_states_for_profile(scanprofile_id, target_ids=None):
         )
 
     return released
+
+
+def _job_target_ids(job_id):
+    """
+    Return a subquery of the target ids of one job.
+    """
+    return select(assoc_jobs_targets.c.target_id).where(
+        assoc_jobs_targets.c.job_id == job_id
+    )
+
+
+def _held_by_other_unfinished_job(target_id_column, job_id, scanprofile_id):
+    """
+    Return an EXISTS clause true while another unfinished job of the profile
+    still holds the target.
+    """
+    other_assoc = assoc_jobs_targets.alias("other_jobs_targets")
+    return exists().where(
+        other_assoc.c.target_id == target_id_column,
+        other_assoc.c.job_id == Jobs.id,
+        Jobs.id != job_id,
+        Jobs.finished.is_(False),
+        Jobs.scanprofile_id == scanprofile_id,
+    )
+
+
+def complete_job_scan_states(session, job_id, scanprofile_id, completed_at):
+    """
+    Mark the targets of a finished job as scanned, in three set-based UPDATEs.
+
+    A target is scanned once no other unfinished job of the same profile
+    still holds it: its profile state leaves working mode and both the state
+    and the target move last_scan to completed_at. The working flag of every
+    target of the job is then recomputed from its remaining working states.
+    Returns the number of completed target/profile states.
+    """
+    job_target_ids = _job_target_ids(job_id)
+
+    completed_states = (
+        session.execute(
+            update(TargetScanStates)
+            .where(
+                TargetScanStates.scanprofile_id == scanprofile_id,
+                TargetScanStates.target_id.in_(job_target_ids),
+                ~_held_by_other_unfinished_job(
+                    TargetScanStates.target_id, job_id, scanprofile_id
+                ),
+            )
+            .values(
+                working=False,
+                last_previous_scan=TargetScanStates.last_scan,
+                last_scan=completed_at,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        or 0
+    )
+    session.execute(
+        update(Targets)
+        .where(
+            Targets.id.in_(job_target_ids),
+            ~_held_by_other_unfinished_job(Targets.id, job_id, scanprofile_id),
+        )
+        .values(last_previous_scan=Targets.last_scan, last_scan=completed_at)
+        .execution_options(synchronize_session=False)
+    )
+    session.execute(
+        update(Targets)
+        .where(Targets.id.in_(job_target_ids))
+        .values(
+            working=exists().where(
+                TargetScanStates.target_id == Targets.id,
+                TargetScanStates.working.is_(True),
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return completed_states
+
+
+def _capped_increment(column, total_column, amount):
+    """
+    Return `column + amount`, capped by `total_column` when it is set.
+    """
+    return case(
+        (
+            and_(total_column > 0, column + amount > total_column),
+            total_column,
+        ),
+        else_=column + amount,
+    )
+
+
+def complete_job_in_cycle(job, completed_at):
+    """
+    Complete the targets of a finished job and advance its profile cycle.
+
+    Before `complete_job_scan_states()` marks the states as scanned, the
+    states it completes for the running cycle are counted the way
+    `reconcile_scanprofile_cycle()` counts them, and added to the cycle
+    counters with one bounded UPDATE. This keeps result submission away
+    from the full profile aggregates; `task_create_jobs()` still reconciles
+    every running cycle from the states as the periodic repair. The cycle is
+    only fully reconciled here once its counters reach the totals and no
+    unfinished job of the profile is left, to close it without waiting for
+    the scheduler. Returns the number of completed target/profile states.
+    """
+    cycle = profile = None
+    if job.scanprofile_id is not None:
+        cycle = _latest_running_cycle(job.scanprofile_id)
+    if cycle is not None:
+        profile = (
+            db.session.query(ScanProfiles)
+            .filter(ScanProfiles.id == job.scanprofile_id)
+            .one_or_none()
+        )
+
+    added_targets = added_units = 0
+    if profile is not None:
+        added_targets, added_units = (
+            _active_applicable_state_query(profile)
+            .filter(
+                TargetScanStates.target_id.in_(_job_target_ids(job.id)),
+                ~_held_by_other_unfinished_job(
+                    TargetScanStates.target_id, job.id, profile.id
+                ),
+                ~and_(
+                    TargetScanStates.working.is_(False),
+                    TargetScanStates.last_scan.isnot(None),
+                    TargetScanStates.last_scan >= cycle.started_at,
+                ),
+            )
+            .with_entities(
+                func.count(TargetScanStates.id),
+                func.coalesce(func.sum(Targets.scan_unit_count), 0),
+            )
+            .one()
+        )
+
+    completed_states = complete_job_scan_states(
+        db.session, job.id, job.scanprofile_id, completed_at
+    )
+    if profile is None:
+        return completed_states
+
+    # Units of jobs still holding shared targets count as progress, as in
+    # the finished-job sum of the reconcile.
+    if job.scanprofile_cycle_id == cycle.id:
+        added_units = max(int(added_units or 0), int(job.scan_unit_count or 0))
+    if added_targets or added_units:
+        db.session.query(ScanProfileCycles).filter(
+            ScanProfileCycles.id == cycle.id,
+            ScanProfileCycles.status == "running",
+        ).update(
+            {
+                ScanProfileCycles.completed_target_count: _capped_increment(
+                    ScanProfileCycles.completed_target_count,
+                    ScanProfileCycles.target_count,
+                    int(added_targets),
+                ),
+                ScanProfileCycles.completed_scan_unit_count: _capped_increment(
+                    ScanProfileCycles.completed_scan_unit_count,
+                    ScanProfileCycles.scan_unit_count,
+                    int(added_units),
+                ),
+            },
+            synchronize_session=False,
+        )
+
+    completed_target_count = int(cycle.completed_target_count or 0) + int(
+        added_targets or 0
+    )
+    if (
+        completed_target_count >= int(cycle.target_count or 0)
+        and _unfinished_job_count(profile.id) == 0
+    ):
+        db.session.refresh(cycle)
+        reconcile_scanprofile_cycle(profile.id, cycle=cycle, now=completed_at)
+    return completed_states
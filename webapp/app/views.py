@@ -37,6 +37,7 @@ from flask_wtf.file import FileField, FileAllowed
 from markupsafe import Markup, escape
 from meilisearch import Client
 from meilisearch.errors import MeilisearchApiError
+import redis
 import requests
 
 from netaddr import IPNetwork
@@ -75,6 +76,10 @@ from .models import (
 from .utils.mutils import is_valid_uuid, is_valid_ip, is_valid_cidr
 from .utils.mutils import is_valid_ip_or_cidr, is_valid_fqdn, lowercase_dict
 from .utils.kvrocks import KVrocksIndexer
+from .utils.export_queue import count_export_backlog, get_export_queue
+from .utils.job_dispatcher import get_job_dispatcher
+from .utils.job_leases import get_job_lease_stats as _get_job_lease_stats
+from .utils.result_storage import find_result_path, read_result
 from .utils.ip2asn import get_asn_description_for_ip
 from .utils.tagrules import (
     compile_tag_rule_definition,
@@ -101,7 +106,7 @@ from .utils.scan_cycles import (
     reconcile_scanprofile_cycle,
     release_orphaned_scan_states_for_profile,
 )
-from .utils.timeutils import ensure_utc_naive, utcnow_iso
+from .utils.timeutils import ensure_utc_naive, utcnow_iso, utcnow_naive
 
 
 from . import appbuilder, db
@@ -522,6 +527,15 @@ def get_scanprofile_cycle_rows(pk):
     return rows
 
 
+def get_job_lease_stats():
+    """
+    Return the agent lease counters shown above the jobs list.
+    """
+    stats = _get_job_lease_stats(utcnow_naive())
+    stats["next_expiry"] = _format_datetime_for_ui(stats["next_expiry"])
+    return stats
+
+
 def get_target_search_time_range(pk):
     """
     Return a search range starting one day before the oldest target scan stat.
@@ -556,6 +570,7 @@ app.jinja_env.globals["get_target_requested_hostname"] = get_target_requested_ho
 app.jinja_env.globals["get_target_profile_stats"] = get_target_profile_stats
 app.jinja_env.globals["get_scanprofile_cycle_rows"] = get_scanprofile_cycle_rows
 app.jinja_env.globals["get_target_search_time_range"] = get_target_search_time_range
+app.jinja_env.globals["get_job_lease_stats"] = get_job_lease_stats
 
 
 @appbuilder.app.errorhandler(404)
@@ -633,6 +648,8 @@ class KVSearchView(BaseView):
     SEARCH_WINDOW_SECONDS = 24 * 60 * 60
     MAX_EXPORT_WARNINGS = 20
     SEARCH_SESSION_TTL_SECONDS = 3600
+    SEARCH_CACHE_TTL_SECONDS = 120
+    SEARCH_CACHE_MAX_UIDS = 200000
     TAG_SUGGEST_LIMIT = 12
     TAG_SUGGEST_SCAN_LIMIT = 4096
     HTTP_HEADER_SUGGEST_LIMIT = 128
@@ -769,13 +786,15 @@ class KVSearchView(BaseView):
         """
         Build per-IP timestamp metadata for a search result map.
         """
+        uid_timestamps = indexer.get_timestamps_for_uids(
+            uid for uids in results_ip.values() for uid in uids
+        )
         timestamp_array = {}
         for ip in results_ip:
-            ip_timestamps = indexer.get_timestamp_for_ip(ip)
             filtered_timestamps = {
-                uid: ip_timestamps[uid]
+                uid: uid_timestamps[uid]
                 for uid in results_ip[ip]
-                if uid in ip_timestamps
+                if uid in uid_timestamps
             }
 
             min_seen = None
@@ -850,9 +869,7 @@ class KVSearchView(BaseView):
         """
         values = []
         try:
-            indexer = KVrocksIndexer(
-                db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
-            )
+            indexer = KVrocksIndexer.from_config(db.app.config)
             values = indexer.get_indexed_values(
                 "tag",
                 limit=cls.TAG_SUGGEST_SCAN_LIMIT,
@@ -1046,6 +1063,58 @@ class KVSearchView(BaseView):
                 )
         return matching_uids
 
+    @classmethod
+    def _get_search_cache_settings(cls):
+        """
+        Return (ttl_seconds, max_uids) of the search result cache.
+
+        A TTL of 0 disables the cache.
+        """
+        settings = []
+        for name in ("SEARCH_CACHE_TTL_SECONDS", "SEARCH_CACHE_MAX_UIDS"):
+            default_value = getattr(cls, name)
+            try:
+                value = int(db.app.config.get(name, default_value))
+            except (TypeError, ValueError):
+                value = default_value
+            settings.append(max(0, value))
+        return tuple(settings)
+
+    def _get_window_matching_uids(
+        self, indexer, criteria_groups, from_ts, to_ts, last_seen_only=False
+    ):
+        """
+        Resolve OR query groups inside one time window, through the result cache.
+
+        last_seen_only scopes the query on last_seen_index like the paged UI
+        search, otherwise documents seen at any point of the window match.
+        """
+        cache_ttl, cache_max_uids = self._get_search_cache_settings()
+        scope = "last_seen" if last_seen_only else "seen"
+        cache_key = None
+        if cache_ttl:
+            cache_key = indexer.query_cache_key(
+                criteria_groups, from_ts, to_ts, scope=scope
+            )
+            cached_uids = indexer.get_query_cache(cache_key)
+            if cached_uids is not None:
+                return cached_uids
+
+        if last_seen_only:
+            window_uids = indexer.get_uids_by_last_seen_range(from_ts, to_ts)
+            uids = self._get_matching_uids(
+                indexer, criteria_groups, scoped_uids=window_uids
+            )
+        else:
+            time_uids = indexer.get_uids_by_time_range(from_ts, to_ts)
+            uids = self._get_matching_uids(indexer, criteria_groups).intersection(
+                time_uids
+            )
+
+        if cache_key:
+            indexer.set_query_cache(cache_key, uids, cache_ttl, cache_max_uids)
+        return uids
+
     @staticmethod
     def _get_export_jobs_folder():
         export_jobs_folder = db.app.config["EXPORT_JOBS_FOLDER"]
@@ -1622,9 +1691,7 @@ class KVSearchView(BaseView):
         """
         start_time = time.time()
         query = query or ""
-        indexer = KVrocksIndexer(
-            db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
-        )
+        indexer = KVrocksIndexer.from_config(db.app.config)
         count_objects = indexer.objects_count()  # Get object count in db
         time_range, time_status, time_error = self._resolve_time_range(
             from_ts, to_ts, query=query
@@ -1649,12 +1716,12 @@ class KVSearchView(BaseView):
         timestamp_array = {}
 
         if status:
-            time_uids = indexer.get_uids_by_time_range(
-                time_range["from_ts"], time_range["to_ts"]
-            )
             uids = list(
-                self._get_matching_uids(indexer, criteria_groups).intersection(
-                    time_uids
+                self._get_window_matching_uids(
+                    indexer,
+                    criteria_groups,
+                    time_range["from_ts"],
+                    time_range["to_ts"],
                 )
             )
             results_ip = indexer.get_ip_from_uids(uids)
@@ -1723,9 +1790,7 @@ class KVSearchView(BaseView):
         except (TypeError, ValueError):
             window_days = 1
         window_seconds = window_days * self.SEARCH_WINDOW_SECONDS
-        indexer = KVrocksIndexer(
-            db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
-        )
+        indexer = KVrocksIndexer.from_config(db.app.config)
         count_objects = indexer.objects_count()
         time_range, time_status, time_error = self._resolve_time_range(
             from_ts, to_ts, query=query
@@ -1770,9 +1835,12 @@ class KVSearchView(BaseView):
                 1,
                 int((current_to - current_from) / self.SEARCH_WINDOW_SECONDS) + 1,
             )
-            window_uids = indexer.get_uids_by_last_seen_range(current_from, current_to)
-            page_uids = self._get_matching_uids(
-                indexer, criteria_groups, scoped_uids=window_uids
+            page_uids = self._get_window_matching_uids(
+                indexer,
+                criteria_groups,
+                current_from,
+                current_to,
+                last_seen_only=True,
             )
             day_ip_map = indexer.get_ip_from_uids(page_uids)
             day_timestamps = self._build_timestamp_array(indexer, day_ip_map)
@@ -1913,6 +1981,42 @@ class KVSearchView(BaseView):
         results["search_id"] = search_id
         return jsonify(results)
 
+    @expose("/explain")
+    @has_access
+    def explain(self):
+        """
+        Return the Kvrocks query plan used for each OR group of a query.
+        """
+        query = request.args.get("q", "")
+        criteria_groups, status, msg_error = self.parse_query(
+            query, allow_since_directive=True
+        )
+        if not status:
+            return jsonify(
+                {
+                    "status": False,
+                    "groups": [],
+                    "msg_error": msg_error or "Invalid query",
+                }
+            )
+
+        indexer = KVrocksIndexer.from_config(db.app.config)
+        groups = []
+        for criteria in criteria_groups:
+            start_time = time.time()
+            uids, plan = indexer.get_uids_by_criteria(
+                lowercase_dict(criteria), explain=True
+            )
+            groups.append(
+                {
+                    "criteria": criteria,
+                    "plan": plan,
+                    "matched_uids": len(uids),
+                    "processingTimeMs": (time.time() - start_time) * 1000,
+                }
+            )
+        return jsonify({"status": True, "groups": groups, "msg_error": ""})
+
     @expose("/tag_suggest")
     @has_access
     def tag_suggest(self):
@@ -2147,9 +2251,7 @@ class KVSearchView(BaseView):
         """
         This fuction display the search page
         """
-        indexer = KVrocksIndexer(
-            db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
-        )
+        indexer = KVrocksIndexer.from_config(db.app.config)
         count_objects = indexer.objects_count()
         return self.render_template(
             "search_kvrocks.html",
@@ -2340,9 +2442,7 @@ class IPDetailView(BaseView):
         if not is_valid_ip(ip):
             return make_response("Invalid IP", 400)
 
-        indexer = KVrocksIndexer(
-            db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
-        )
+        indexer = KVrocksIndexer.from_config(db.app.config)
         ip_timestamps = indexer.get_timestamp_for_ip(ip)
         uids = [uid for uid in ip_timestamps if uid not in ("min_seen", "max_seen")]
         sorted_uids = sorted(
@@ -2800,6 +2900,8 @@ class JobsView(ModelView):
         "finished",
         "exported",
         "duration_html",
+        "lease_expires",
+        "lease_html",
         "priority",
     ]
     list_columns = [
@@ -2811,6 +2913,7 @@ class JobsView(ModelView):
         "targets_count_html",
         "active",
         "finished",
+        "lease_html",
     ]
     edit_columns = ["targets", "active", "finished", "exported", "priority"]
     edit_form_extra_fields = {
@@ -2831,6 +2934,8 @@ class JobsView(ModelView):
         "targets_html": "Targets",
         "targets_count_html": "Targets",
         "duration_html": "Duration",
+        "lease_expires": "Lease Expires",
+        "lease_html": "Lease",
     }
 
     @action(
@@ -2852,6 +2957,7 @@ class JobsView(ModelView):
             # Raise Un tag
             items.priority = 4
         db.session.commit()
+        self._dispatch_queued_jobs(items if isinstance(items, list) else [items])
         self.update_redirect()
         return redirect(self.get_redirect())
 
@@ -2885,6 +2991,25 @@ class JobsView(ModelView):
         normalize_priority(item)
         return self
 
+    def post_update(self, item):
+        self._dispatch_queued_jobs([item])
+
+    @staticmethod
+    def _dispatch_queued_jobs(items):
+        """
+        Queue waiting jobs under their new priority right away.
+
+        Their old queue entry is skipped once the job is claimed, and the
+        next scheduler refill drops it.
+        """
+        try:
+            dispatcher = get_job_dispatcher(db.app.config)
+            for item in items:
+                if not item.active and not item.finished:
+                    dispatcher.push(item.priority, item.id)
+        except redis.RedisError as error:
+            logger.warning("Unable to queue jobs in the dispatcher: %s", error)
+
     @expose("/file_get/<uid>")
     @has_access  # Tout authenticated people.
     def file_get(self, uid):
@@ -2894,9 +3019,12 @@ class JobsView(ModelView):
         """
         base = db.app.config.get("JSON_FOLDER")
         try:
-            is_valid_uuid(uid)
-            with open(f"{base}/{uid[0]}/{uid}.json", "rb") as file_handle:
-                oobject = json.loads(file_handle.read())
+            if not is_valid_uuid(uid):
+                raise ValueError(uid)
+            filepath = find_result_path(base, uid)
+            if filepath is None:
+                raise FileNotFoundError(uid)
+            oobject = read_result(filepath)
         except (FileNotFoundError, ValueError):
             oobject = "{}"
 
@@ -3394,9 +3522,7 @@ class ReportsView(ModelView):
         if not results.get("status"):
             raise ValueError(results.get("msg_error") or "Invalid report query")
 
-        indexer = KVrocksIndexer(
-            db.app.config["KVROCKS_HOST"], db.app.config["KVROCKS_PORT"]
-        )
+        indexer = KVrocksIndexer.from_config(db.app.config)
         per_ip_ports, port_counter = collect_report_ports(
             indexer,
             results.get("results") or {},
@@ -4054,15 +4180,51 @@ class StatsView(BaseView):
             "kv_scanned_host_count": 0,
             "kv_scan_result_count": 0,
         }
-        indexer = db.app.config.get("KVROCKS_IDX") or KVrocksIndexer(
-            db.app.config["KVROCKS_HOST"],
-            db.app.config["KVROCKS_PORT"],
-        )
+        indexer = KVrocksIndexer.from_config(db.app.config)
         kv_counts = indexer.objects_count()
         stats["kv_scanned_host_count"] = kv_counts.get("ip_count", 0)
         stats["kv_scan_result_count"] = kv_counts.get("uid_count", 0)
+        cache_stats = indexer.get_query_cache_stats()
+        stats["search_cache_hit_rate"] = cache_stats["hit_rate"]
+        stats["search_cache_hits"] = cache_stats["hits"]
+        stats["search_cache_misses"] = cache_stats["misses"]
+        stats["kvrocks_pool"] = indexer.get_pool_stats()
+        stats["export_backlog"] = count_export_backlog()
+        stats["export_worker"] = dict(db.app.config.get("EXPORT_WORKER_STATS") or {})
         return self.render_template("stats.html", stats=stats, title="Stats")
 
+    @expose("/export")
+    @has_access
+    def export(self):
+        """
+        JSON export worker counters and backlog for monitoring.
+
+        Worker counters are empty until the scheduler process ran the worker.
+        """
+        return jsonify(
+            {
+                "backlog": count_export_backlog(),
+                "queue": get_export_queue(db.app.config).stats(),
+                "worker": dict(db.app.config.get("EXPORT_WORKER_STATS") or {}),
+            }
+        )
+
+    @expose("/kvrocks")
+    @has_access
+    def kvrocks(self):
+        """
+        JSON Kvrocks connection pool and search cache counters for monitoring.
+
+        Pool counters are per web process.
+        """
+        indexer = KVrocksIndexer.from_config(db.app.config)
+        return jsonify(
+            {
+                "pool": indexer.get_pool_stats(),
+                "search_cache": indexer.get_query_cache_stats(),
+            }
+        )
+
 
 appbuilder.add_view(
     KVSearchView, "Search Scans", icon="fa-magnifying-glass", category="Analytics"
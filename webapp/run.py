@@ -1,3 +1,6 @@
-from app import app
+# The export parser workers import this module again as __mp_main__, they
+# must not build the app nor start a server.
+if __name__ == "__main__":
+    from app import app
 
-app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=True)
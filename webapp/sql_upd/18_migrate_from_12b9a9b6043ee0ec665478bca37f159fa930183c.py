@@ -0,0 +1,130 @@
+"""
+Backfill the Kvrocks vals:{field} value dictionaries.
+
+Prefix and substring searches read the lex sorted set vals:{field} instead of
+scanning the whole keyspace. New documents maintain it at indexing time, this
+migration builds it for documents indexed before.
+
+Searches only use a dictionary once vals:fields flags it ready. Each one is
+built into a temporary key while the application keeps indexing, then merged
+with the values indexed meanwhile and renamed over vals:{field}.
+"""
+
+# pylint: disable=invalid-name
+
+import importlib.util
+from pathlib import Path
+
+import redis
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CONFIG_PATH = BASE_DIR / "config.py"
+BATCH_SIZE = 1000
+VALUE_INDEX_FIELDS_KEY = "vals:fields"
+# net:{cidr} keys are written by the network indexer and never use modifiers.
+VALUE_INDEX_FIELDS = [
+    "fqdn",
+    "fqdn_requested",
+    "host",
+    "domain",
+    "domain_requested",
+    "tld",
+    "tag",
+    "port",
+    "http_title",
+    "http_favicon_path",
+    "http_favicon_mmhash",
+    "http_favicon_md5",
+    "http_favicon_sha256",
+    "http_cookiename",
+    "http_etag",
+    "http_header",
+    "http_headval",
+    "http_server",
+    "x509_issuer",
+    "x509_md5",
+    "x509_sha1",
+    "x509_sha256",
+    "x509_subject",
+    "x509_san",
+    "banner",
+]
+
+
+def load_config_module():
+    """
+    Load the deployed config.py when available.
+    """
+    try:
+        spec = importlib.util.spec_from_file_location("plum_config", CONFIG_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except (ImportError, OSError, SyntaxError):
+        return None
+
+
+def load_kvrocks_config():
+    """
+    Read Kvrocks connection settings from config.py, with local defaults.
+    """
+    config = load_config_module()
+    host = getattr(config, "KVROCKS_HOST", "localhost") if config else "localhost"
+    port = getattr(config, "KVROCKS_PORT", 6666) if config else 6666
+    return host, int(port)
+
+
+def backfill_value_index(redis_client, field, batch_size=BATCH_SIZE):
+    """
+    Rebuild vals:{field} from the existing {field}:{value} reverse indexes.
+
+    The field is flagged building, then ready once vals:{field} is complete.
+    """
+    value_key = f"vals:{field}"
+    build_key = f"tmp:vals:{field}"
+    key_prefix = f"{field}:"
+    # Searches fall back to SCAN until the field is ready again.
+    redis_client.hset(VALUE_INDEX_FIELDS_KEY, field, "building")
+    redis_client.delete(build_key)
+
+    indexed = 0
+    batch = {}
+    for key in redis_client.scan_iter(match=f"{field}:*", count=batch_size):
+        if not key.startswith(key_prefix):
+            continue
+        value = key[len(key_prefix) :]
+        if not value:
+            continue
+        batch[value] = 0
+        if len(batch) >= batch_size:
+            redis_client.zadd(build_key, batch)
+            indexed += len(batch)
+            batch = {}
+    if batch:
+        redis_client.zadd(build_key, batch)
+        indexed += len(batch)
+
+    pipe = redis_client.pipeline(transaction=True)
+    if indexed:
+        # Keep the values indexed into vals:{field} during the scan.
+        pipe.zunionstore(build_key, [build_key, value_key])
+        pipe.rename(build_key, value_key)
+    pipe.hset(VALUE_INDEX_FIELDS_KEY, field, "ready")
+    pipe.execute()
+    return indexed
+
+
+host, port = load_kvrocks_config()
+kvrocks = redis.Redis(host=host, port=port, decode_responses=True, db=0)
+kvrocks.ping()
+
+total_indexed = 0
+for index_field in VALUE_INDEX_FIELDS:
+    field_indexed = backfill_value_index(kvrocks, index_field)
+    total_indexed += field_indexed
+    print(f"Indexed {field_indexed} values into vals:{index_field}", flush=True)
+
+print(
+    f"Kvrocks value dictionary migration complete: indexed_values={total_indexed}",
+    flush=True,
+)
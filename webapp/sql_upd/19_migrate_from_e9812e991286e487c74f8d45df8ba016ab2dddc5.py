@@ -0,0 +1,37 @@
+"""
+Add job lease deadlines and the per-bot active job index.
+"""
+
+# pylint: disable=invalid-name
+
+import sqlite3
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DB_PATH = BASE_DIR / "app.db"
+
+
+def column_exists(db_cursor, table_name, column_name):
+    """
+    Return True when a table already has the given column.
+    """
+    db_cursor.execute(f"PRAGMA table_info({table_name})")
+    return any(row[1] == column_name for row in db_cursor.fetchall())
+
+
+conn = sqlite3.connect(DB_PATH)
+cursor = conn.cursor()
+
+if not column_exists(cursor, "jobs", "lease_expires"):
+    cursor.execute("ALTER TABLE jobs ADD COLUMN lease_expires DATETIME")
+
+cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_active_bot
+        ON jobs(bot_id)
+        WHERE active = 1
+    """)
+
+conn.commit()
+conn.close()
+
+print("Job lease migration complete")
@@ -0,0 +1,73 @@
+"""
+Add job lease requeue counters and lease active jobs claimed before leases.
+"""
+
+# pylint: disable=invalid-name
+
+from datetime import datetime, timedelta, timezone
+import importlib.util
+import sqlite3
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DB_PATH = BASE_DIR / "app.db"
+CONFIG_PATH = BASE_DIR / "config.py"
+DEFAULT_JOB_LEASE_SECONDS = 3600
+
+
+def column_exists(db_cursor, table_name, column_name):
+    """
+    Return True when a table already has the given column.
+    """
+    db_cursor.execute(f"PRAGMA table_info({table_name})")
+    return any(row[1] == column_name for row in db_cursor.fetchall())
+
+
+def load_lease_seconds():
+    """
+    Read JOB_LEASE_SECONDS from config.py, with the default lease.
+    """
+    try:
+        spec = importlib.util.spec_from_file_location("plum_config", CONFIG_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return int(getattr(module, "JOB_LEASE_SECONDS", DEFAULT_JOB_LEASE_SECONDS))
+    except (ImportError, OSError, SyntaxError, TypeError, ValueError):
+        return DEFAULT_JOB_LEASE_SECONDS
+
+
+conn = sqlite3.connect(DB_PATH)
+cursor = conn.cursor()
+
+if not column_exists(cursor, "jobs", "lease_retries"):
+    cursor.execute(
+        "ALTER TABLE jobs ADD COLUMN lease_retries INTEGER NOT NULL DEFAULT 0"
+    )
+
+cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_active_lease
+        ON jobs(lease_expires)
+        WHERE active = 1
+    """)
+
+# Jobs running since before the upgrade get one lease from now, the
+# scheduler requeues them if their agent does not send them back.
+lease_expires = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(
+    seconds=load_lease_seconds()
+)
+cursor.execute(
+    """
+    UPDATE jobs
+       SET lease_expires = ?
+     WHERE active = 1
+       AND finished = 0
+       AND lease_expires IS NULL
+    """,
+    (lease_expires.isoformat(" ", timespec="microseconds"),),
+)
+leased_jobs = cursor.rowcount
+
+conn.commit()
+conn.close()
+
+print(f"Job lease requeue migration complete: leased_active_jobs={leased_jobs}")